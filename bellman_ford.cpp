@@ -1,105 +1,253 @@
 #include "johnson.hpp"
+#include <string.h>
+#include <vector>
 
-void BellmanFord(Graph *graph) {
-    if (display)
-        printf("BellmanFord started\n");
-    int distance[graph->nnode];
+bellman_ford_mode_t bellman_ford_mode = BELLMAN_FORD_EARLY;
 
+const char *bellman_ford_mode_name[BELLMAN_FORD_MODE_COUNT] = { "full", "early", "queue" };
+
+// Lower distance[v] to value if smaller; true if it changed
+static inline bool AtomicMin(int *distance, int v, int value) {
     #if OMP
-    #pragma omp parallel for
+    int old = __atomic_load_n(&distance[v], __ATOMIC_RELAXED);
+    while (value < old) {
+        if (__atomic_compare_exchange_n(&distance[v], &old, value, true, __ATOMIC_RELAXED, __ATOMIC_RELAXED))
+            return true;
+    }
+    return false;
+    #else
+    if (value >= distance[v]) return false;
+    distance[v] = value;
+    return true;
     #endif
-    // Initialize distances from new source node to all nodes
-    for (int nid = 0; nid < graph->nnode; nid++)
-        distance[nid] = 0;
+}
 
-    // #if OMP
-    // int** eid_matrix = (int**)malloc(graph->nnode * sizeof(int *));
-    // for (int nid = 0; nid < graph->nnode; nid++) {
-    //     eid_matrix[nid] = (int *)malloc(graph->nnode * sizeof(int));
-    //     #pragma omp parallel for
-    //     for (int nnid = 0; nnid < graph->nnode; nnid++) {
-    //         eid_matrix[nid][nnid] = -1;
-    //     }
-    // }
-    //
-    // #pragma omp parallel for
-    // for (int u = 0; u < graph->nnode; u++) {
-    //     for (int eid = graph->node[u]; eid < graph->node[u+1]; eid++) {
-    //         int v = graph->edge[eid];
-    //         eid_matrix[u][v] = eid;
-    //     }
-    // }
-    //
-    // int* rev_node = (int*)malloc((graph->nnode+1) * sizeof(int *));
-    // int* rev_edge = (int*)malloc(graph->nedge * sizeof(int *));
-    // int* rev_eid = (int*)malloc(graph->nedge * sizeof(int *));
-    //
-    // int i = 0;
-    //
-    // for (int v = 0; v < graph->nnode; v++) {
-    //     for (int u = 0; u < graph->nnode; u++) {
-    //         int eid = eid_matrix[u][v];
-    //         if (eid != -1) {
-    //             rev_eid[i] = eid;
-    //             rev_edge[i] = u;
-    //             i += 1;
-    //         }
-    //     }
-    //     rev_node[v+1] = i;
-    // }
-    //
-    // #pragma omp parallel for
-    // for (int nid = 0; nid < graph->nnode; nid++) {
-    //     free(eid_matrix[nid]);
-    // }
-    // free(eid_matrix);
-    //
-    // // Iterate through the graph V - 1 times
-    // for (int iter = 0; iter < graph->nnode; iter++)
-    //     #pragma omp parallel for
-    //     for (int v = 0; v < graph -> nnode; v++) {
-    //         for (int i = rev_node[v]; i < rev_node[v+1]; i++) {
-    //             int u = rev_edge[i];
-    //             int eid = rev_eid[i];
-    //             int weight = graph->weight[eid];
-    //             if (distance[v] > distance[u] + weight)
-    //                 distance[v] = distance[u] + weight;
-    //         }
-    //     }
-    //
-    // free(rev_node);
-    // free(rev_edge);
-    // free(rev_eid);
-    //
-    // #else
-
-    // Iterate through the graph V - 1 times
+// Iterate through the graph V times, returns number of passes
+static int RelaxFull(Graph *graph, int *distance) {
     for (int iter = 0; iter < graph->nnode; iter++)
         #if OMP
-        #pragma omp parallel for
+        #pragma omp parallel
         #endif
+        {
+            START_LOCAL_ACTIVITY(BELLMAN_FORD);
+            #if OMP
+            #pragma omp for nowait
+            #endif
+            for (int u = 0; u < graph->nnode; u++)
+                for (int eid = graph->node[u]; eid < graph->node[u+1]; eid++) {
+                    int v = graph->edge[eid];
+                    int weight = graph->weight[eid];
+                    if (distance[v] > distance[u] + weight)
+                        distance[v] = distance[u] + weight;
+                }
+            FINISH_LOCAL_ACTIVITY(BELLMAN_FORD);
+        }
+    return graph->nnode;
+}
+
+#if OMP
+// Each thread owns the in-edges of its nodes, so every distance has a single writer
+static int RelaxEarly(Graph *graph, int *distance) {
+    int nnode = graph->nnode;
+    int *rev_node = (int *)calloc(nnode + 1, sizeof(int));
+    int *rev_edge = (int *)malloc(graph->nedge * sizeof(int));
+    int *rev_weight = (int *)malloc(graph->nedge * sizeof(int));
+
+    // Counting sort of edges by destination
+    for (int eid = 0; eid < graph->nedge; eid++)
+        rev_node[graph->edge[eid] + 1]++;
+    for (int v = 0; v < nnode; v++)
+        rev_node[v+1] += rev_node[v];
+    int *fill = (int *)malloc(nnode * sizeof(int));
+    memcpy(fill, rev_node, nnode * sizeof(int));
+    for (int u = 0; u < nnode; u++)
+        for (int eid = graph->node[u]; eid < graph->node[u+1]; eid++) {
+            int i = fill[graph->edge[eid]]++;
+            rev_edge[i] = u;
+            rev_weight[i] = graph->weight[eid];
+        }
+    free(fill);
+
+    int passes = 0;
+    bool changed = true;
+    while (changed && passes < nnode) {
+        changed = false;
+        passes++;
+        #pragma omp parallel
+        {
+            START_LOCAL_ACTIVITY(BELLMAN_FORD);
+            #pragma omp for schedule(static) reduction(||:changed) nowait
+            for (int v = 0; v < nnode; v++) {
+                int best = __atomic_load_n(&distance[v], __ATOMIC_RELAXED);
+                for (int i = rev_node[v]; i < rev_node[v+1]; i++) {
+                    int candidate = __atomic_load_n(&distance[rev_edge[i]], __ATOMIC_RELAXED) + rev_weight[i];
+                    if (candidate < best) best = candidate;
+                }
+                if (best < distance[v]) {
+                    __atomic_store_n(&distance[v], best, __ATOMIC_RELAXED);
+                    changed = true;
+                }
+            }
+            FINISH_LOCAL_ACTIVITY(BELLMAN_FORD);
+        }
+    }
+
+    free(rev_node);
+    free(rev_edge);
+    free(rev_weight);
+    return passes;
+}
+#else
+// Stop after a pass that improves no distance
+static int RelaxEarly(Graph *graph, int *distance) {
+    int passes = 0;
+    bool changed = true;
+    while (changed && passes < graph->nnode) {
+        changed = false;
+        passes++;
         for (int u = 0; u < graph->nnode; u++)
             for (int eid = graph->node[u]; eid < graph->node[u+1]; eid++) {
                 int v = graph->edge[eid];
                 int weight = graph->weight[eid];
-                // #pragma omp critical
-                if (distance[v] > distance[u] + weight)
+                if (distance[v] > distance[u] + weight) {
                     distance[v] = distance[u] + weight;
+                    changed = true;
+                }
+            }
+    }
+    return passes;
+}
+#endif
+
+// Work-list relaxation: each round relaxes only out-edges of nodes improved in the previous round,
+// starting from the nstart distinct nodes in start.
+// Threads collect improved nodes in their own frontier, which are concatenated after the round.
+// Sets converged if no distance changed in the last pass.  Thread time is accounted to activity.
+static int RelaxFrom(Graph *graph, int *distance, const int *start, int nstart, bool *converged, activity_t activity) {
+    int nnode = graph->nnode;
+    int *frontier = (int *)malloc(nnode * sizeof(int));
+    int *next = (int *)malloc(nnode * sizeof(int));
+    char *in_next = (char *)calloc(nnode, sizeof(char));
+    int frontier_size = nstart;
+    int passes = 0;
+
+    memcpy(frontier, start, nstart * sizeof(int));
+
+    while (frontier_size > 0 && passes < nnode) {
+        int next_size = 0;
+        passes++;
+        #if OMP
+        #pragma omp parallel
+        #endif
+        {
+            START_LOCAL_ACTIVITY(activity);
+            std::vector<int> local;
+            #if OMP
+            #pragma omp for schedule(dynamic, 64) nowait
+            #endif
+            for (int i = 0; i < frontier_size; i++) {
+                int u = frontier[i];
+                int du = __atomic_load_n(&distance[u], __ATOMIC_RELAXED);
+                for (int eid = graph->node[u]; eid < graph->node[u+1]; eid++) {
+                    int v = graph->edge[eid];
+                    if (AtomicMin(distance, v, du + graph->weight[eid])
+                        && !__atomic_exchange_n(&in_next[v], 1, __ATOMIC_RELAXED))
+                        local.push_back(v);
+                }
             }
+            int offset;
+            #if OMP
+            #pragma omp atomic capture
+            #endif
+            { offset = next_size; next_size += local.size(); }
+            if (!local.empty())
+                memcpy(next + offset, local.data(), local.size() * sizeof(int));
+            FINISH_LOCAL_ACTIVITY(activity);
+        }
 
-    //#endif
+        int *tmp = frontier;
+        frontier = next;
+        next = tmp;
+        frontier_size = next_size;
+        for (int i = 0; i < frontier_size; i++)
+            in_next[frontier[i]] = 0;
+    }
+
+    *converged = frontier_size == 0;
+    free(frontier);
+    free(next);
+    free(in_next);
+    return passes;
+}
+
+static int RelaxQueue(Graph *graph, int *distance) {
+    // Every node starts at distance 0 from the virtual source
+    int *start = (int *)malloc(graph->nnode * sizeof(int));
+    for (int nid = 0; nid < graph->nnode; nid++)
+        start[nid] = nid;
+    bool converged;
+    int passes = RelaxFrom(graph, distance, start, graph->nnode, &converged, BELLMAN_FORD);
+    free(start);
+    return passes;
+}
 
+// Lower the potentials after the edges leaving the start nodes got cheaper.
+// False if they did not settle within nnode passes, so the graph may have a negative cycle.
+bool RepairPotential(Graph *graph, const int *start, int nstart) {
+    bool converged;
+    int passes = RelaxFrom(graph, graph->potential, start, nstart, &converged, UPDATE_GRAPH);
+    if (display)
+        printf("Potential repair finished after %d passes\n", passes);
+    return converged;
+}
+
+// Reweight edge weights with the potentials, false if any reweighted edge is negative
+bool Reweight(Graph *graph) {
+    int *potential = graph->potential;
+    bool negative = false;
     #if OMP
-    #pragma omp parallel for schedule(dynamic, 32)
+    #pragma omp parallel for schedule(dynamic, 32) reduction(||:negative)
     #endif
-    // Reweight edge weights
     for (int u = 0; u < graph->nnode; u++)
         for (int eid = graph->node[u]; eid < graph->node[u+1]; eid++) {
             int v = graph->edge[eid];
-            graph->new_weight[eid] = graph->weight[eid] + distance[u] - distance[v];
-            if (graph->new_weight[eid] < 0) {
-                printf("Graph contains negative weight cycle\n");
-                exit(0);
-            }
+            graph->new_weight[eid] = graph->weight[eid] + potential[u] - potential[v];
+            if (graph->new_weight[eid] < 0)
+                negative = true;
         }
+    if (!negative && dijkstra_engine == DIJKSTRA_DELTA)
+        DeltaSetup(graph);
+    return !negative;
+}
+
+// Potentials and reweighted edges; false if the graph has a negative cycle
+bool BellmanFord(Graph *graph) {
+    if (display)
+        printf("BellmanFord started\n");
+    // Shortest distances from a virtual source with 0-weight edges to every node
+    int *distance = graph->potential;
+
+    #if OMP
+    #pragma omp parallel for
+    #endif
+    // Initialize distances from new source node to all nodes
+    for (int nid = 0; nid < graph->nnode; nid++)
+        distance[nid] = 0;
+
+    int passes;
+    switch (bellman_ford_mode) {
+        case BELLMAN_FORD_FULL:
+            passes = RelaxFull(graph, distance);
+            break;
+        case BELLMAN_FORD_QUEUE:
+            passes = RelaxQueue(graph, distance);
+            break;
+        default:
+            passes = RelaxEarly(graph, distance);
+    }
+    RECORD_COUNTER(BELLMAN_FORD_PASSES, passes);
+    if (display)
+        printf("BellmanFord finished after %d passes\n", passes);
+
+    return Reweight(graph);
 }
@@ -3,17 +3,27 @@
 # Adapted from https://github.com/cmu15418/asst3-s20/blob/master/code/benchmark.py
 
 import argparse
+import filecmp
 import getopt
 import math
 import os
 import os.path
 import random
+import socket
 import subprocess
 import sys
+import tempfile
+import threading
 import time
 
-from regress import checkFiles
-from graph import generate_graph, graphName
+import cache
+import prepare
+import query
+import resultdb
+import scaling
+import verify
+from regress import checkDistanceFiles
+from graph import binaryName, DISTANCE_SUFFIX
 
 # General information
 stdProgram = "./johnson_boost"
@@ -29,37 +39,73 @@ outFile = None
 
 doCheck = True
 doRegress = False
+# Certify the test output with verify.py instead of comparing it with the baseline's (--certify):
+# all rows when certifyConfidence is None, else a sample of rows at that confidence
+doCertify = False
+certifyConfidence = None
 saveDirectory = "./check"
 
 testFileName = ""
 referenceFileName = ""
 
 doInstrument = False
-instColumns = ["load_graph", "print_graph", "bellman_ford", "dijkstra", "overhead", "unknown", "elapsed"]
+# Short names of the all-pairs phases in table headers
+phaseAbbrev = {"bellman_ford": "BF", "dijkstra": "D", "floyd_warshall": "FW"}
+instColumns = ["load_graph", "print_graph", "bellman_ford", "dijkstra", "floyd_warshall", "overhead", "unknown", "elapsed"]
+
+# Resource usage of each run (os.wait4), stored with the instrumentation results
+usageColumns = ["wall_ms", "user_ms", "sys_ms", "max_rss_mb", "minor_faults", "major_faults", "vol_ctx", "invol_ctx"]
 
 # How many times does each benchmark get run?
 runCount = 3
 
+# Reuse baseline results from the result cache
+useCache = True
+
+# Database recording every run (see resultdb.py), with the session and git revision of this invocation
+resultsDb = None
+resultsSession = None
+resultsRevision = None
+
 # How many mismatched lines warrant detailed report
 mismatchLimit = 5
 
-# Graph: (#node, #edge, #seed)
+# Graph: (#node, #edge, #seed), or (#node, #edge target, #seed, family, weights) for the
+# sparse graph families of graph.py
 benchmarkDict = {
     # density = 0.5
     "small":  (256,   16384,   1),
     "medium": (1024,  262144,  2),
     "large":  (4096,  4194304, 3),
     # density = 0.125
-    "medium-sparse": (1024, 65536, 2)
+    "medium-sparse": (1024, 65536, 2),
+    # average degree 8
+    "grid-nonneg":      (8192, 32768, 1, "grid", "nonneg"),
+    "grid-mixed":       (8192, 32768, 1, "grid", "mixed"),
+    "powerlaw-nonneg":  (8192, 65536, 1, "powerlaw", "nonneg"),
+    "powerlaw-mixed":   (8192, 65536, 1, "powerlaw", "mixed"),
+    "geometric-nonneg": (8192, 65536, 1, "geometric", "nonneg"),
+    "geometric-mixed":  (8192, 65536, 1, "geometric", "mixed"),
 }
 
 scalingList = ['small', 'medium', 'medium-sparse', 'large']
 
-defaultTests = benchmarkDict.keys()
+familyList = [t for t in benchmarkDict if len(benchmarkDict[t]) > 3]
+
+defaultTests = ['small', 'medium', 'large', 'medium-sparse']
 
 # Does the test program run on GPU
 gpu = False
 
+# Dijkstra engines of the test program to sweep (None: program default)
+dijkstraEngines = [None]
+engineChoices = ["scan", "heap", "radix", "delta"]
+
+# All-pairs algorithm of the test runs (-a); baselines always run Johnson.
+# auto picks Floyd-Warshall or Johnson from the edge density and the Dijkstra engine.
+testAlgorithm = "auto"
+algorithmChoices = ["johnson", "floyd", "auto"]
+
 # Latedays machines have 12 cores
 threadLimit = 12
 host = os.getenv('HOSTNAME')
@@ -69,6 +115,17 @@ if host is not None and 'ghc' in host:
 defaultThreadCount = threadLimit
 threadCounts = [defaultThreadCount]
 
+# Query server load generation (-L): requests per test, concurrent clients,
+# kind of query, row cache size (MB) and number of sources per "rows" query
+loadRequests = 0
+loadClients = 4
+loadQuery = "mix"
+loadCacheMB = 256
+loadRowsBatch = 8
+# Seconds a query server gets to exit after SHUTDOWN before it is killed
+loadExitTimeout = 10
+queryChoices = ["row", "rows", "dist", "mix"]
+
 uniqueId = ""
 
 def outmsg(s, noreturn = False):
@@ -81,8 +138,10 @@ def outmsg(s, noreturn = False):
     if outFile is not None:
         outFile.write(s)
 
-def testName(testId, threadCount):
+def testName(testId, threadCount, engine = None):
     root = "%sx%.2d" % (testId, threadCount)
+    if engine is not None:
+        root += "-" + engine
     if uniqueId != "":
         root +=  ("-" + uniqueId)
     return root + ".txt"
@@ -90,14 +149,38 @@ def testName(testId, threadCount):
 def graphFileName(fname):
     return graphDirectory + '/' + fname
 
-def saveFileName(useRef, testId, threadCount):
-    return saveDirectory + "/" + ("ref-" if useRef else "tst-") + testName(testId, threadCount)
+def saveFileName(useRef, testId, threadCount, engine = None):
+    name = os.path.splitext(testName(testId, threadCount, engine))[0] + DISTANCE_SUFFIX
+    return saveDirectory + "/" + ("ref-" if useRef else "tst-") + name
 
 def parseInstrumentResult(s):
     res = s.decode("utf-8", "ignore").split()
     msecs, task = res[0], res[-1]
     return msecs, task
 
+# Resource usage of a finished child, in the units of usageColumns
+def usageResult(ru, msecs):
+    return {"wall_ms": round(msecs, 2), "user_ms": round(ru.ru_utime * 1e3, 2), "sys_ms": round(ru.ru_stime * 1e3, 2),
+            "max_rss_mb": round(ru.ru_maxrss / 1024.0, 1), "minor_faults": ru.ru_minflt, "major_faults": ru.ru_majflt,
+            "vol_ctx": ru.ru_nvcsw, "invol_ctx": ru.ru_nivcsw}
+
+# Max RSS of a child that does nothing.  Linux keeps the high-water mark across exec,
+# so every run's max RSS includes this copy of the benchmark process made at fork.
+def launcherRss():
+    try:
+        proc = subprocess.Popen(["true"])
+        _, _, ru = os.wait4(proc.pid, 0)
+        proc.returncode = 0
+        return ru.ru_maxrss / 1024.0
+    except OSError:
+        return None
+
+# CPU time over the wall time available to all threads, or None without usage
+def cpuEfficiency(instDict, threads):
+    if "wall_ms" not in instDict or instDict["wall_ms"] <= 0:
+        return None
+    return (instDict["user_ms"] + instDict["sys_ms"]) / (instDict["wall_ms"] * threads)
+
 def doRun(cmdList, progFileName):
     cmdLine = " ".join(cmdList)
     progFile = subprocess.PIPE
@@ -112,7 +195,8 @@ def doRun(cmdList, progFileName):
     try:
         outmsg("Running '%s > %s'" % (cmdLine, progFileName) if progFileName is not None else "Running '%s'" % (cmdLine))
         progProcess = subprocess.Popen(cmdList, stdout = progFile, stderr = subprocess.PIPE)
-        progProcess.wait()
+        _, status, rusage = os.wait4(progProcess.pid, 0)
+        progProcess.returncode = os.waitstatus_to_exitcode(status)
         if progFile != subprocess.PIPE:
             progFile.close()
         returnCode = progProcess.returncode
@@ -132,6 +216,7 @@ def doRun(cmdList, progFileName):
     if returnCode == 0:
         delta = time.perf_counter() - tstart
         msecs = delta * 1e3
+        instDict.update(usageResult(rusage, msecs))
         if progFile != subprocess.PIPE:
             progFile.close()
         return msecs, instDict
@@ -141,7 +226,7 @@ def doRun(cmdList, progFileName):
             progFile.close()
         return None, {}
 
-def bestRun(cmdList, progFileName):
+def bestRun(cmdList, progFileName, context = None):
     sofar = 1e6
     d = {}
     for r in range(runCount):
@@ -150,16 +235,20 @@ def bestRun(cmdList, progFileName):
         secs, instDict = doRun(cmdList, progFileName)
         if secs is None:
             return None, {}
+        if context is not None:
+            resultdb.recordRun(resultsDb, context, r, secs, instDict)
         if secs < sofar:
             sofar = secs
             d = instDict
     return sofar, d
 
-def getGraph(nnode, nedge, seed):
-    gfname = graphName(nnode, nedge, seed)
-    if not os.path.exists(gfname):
-        # generate graph
-        generate_graph(nnode, nedge, seed)
+# Graphs are built by prepare.py and checked against its manifest before the sweep
+def getGraph(*params):
+    gfname = prepare.graphFiles(params)[0]
+    # Prefer the binary CSR file, which the solvers map without parsing
+    bfname = binaryName(gfname)
+    if os.path.exists(bfname):
+        return bfname
     return gfname
 
 def getProgram(useRef, threadCount, gpu):
@@ -168,46 +257,99 @@ def getProgram(useRef, threadCount, gpu):
     if threadCount > 1: return ompProgram
     return seqProgram
 
-def runBenchmark(useRef, testId, threadCount, gpu=False):
+def runBenchmark(useRef, testId, threadCount, gpu=False, engine=None):
     global referenceFileName, testFileName
-    nnode, nedge, seed = benchmarkDict[testId]
-    gfname = getGraph(nnode, nedge, seed)
+    nnode, nedge, seed = benchmarkDict[testId][:3]
+    gfname = getGraph(*benchmarkDict[testId])
     results = [nnode, nedge, seed, str(threadCount)]
     prog = getProgram(useRef, threadCount, gpu)
     clist = ["-g", gfname]
     if prog == ompProgram:
         clist += ["-t", str(threadCount)]
+    # the CUDA solver only implements Johnson and has no -a option
+    algorithm = "johnson" if useRef or prog == cudaProgram else testAlgorithm
+    if prog != cudaProgram:
+        clist += ["-a", algorithm]
+    if engine is not None and not useRef and prog != cudaProgram:
+        clist += ["-d", engine]
+    else:
+        engine = None
+    if sweepEngines():
+        results.append(engine or "-")
     if doInstrument:
         clist += ["-I"]
-    fileName = None
+    distanceFileName = None
     if not useRef:
-        name = testName(testId, threadCount)
+        name = testName(testId, threadCount, engine)
         outmsg("+++++++++++++++++ Benchmark %s +++++++++++++++++" % name)
-    if doRegress: #doCheck:
+    if doRegress or (doCertify and not useRef): #doCheck:
         if not os.path.exists(saveDirectory):
             try:
                 os.mkdir(saveDirectory)
             except Exception as e:
                 outmsg("Couldn't create directory '%s' (%s)" % (saveDirectory, str(e)))
                 progFile = subprocess.PIPE
-        fileName = saveFileName(useRef, testId, threadCount)
+        distanceFileName = saveFileName(useRef, testId, threadCount, engine)
         if useRef:
-            referenceFileName = fileName
+            referenceFileName = distanceFileName
         else:
-            testFileName = fileName
-        clist += ["-P"] # print output graph
+            testFileName = distanceFileName
+        clist += ["-B", distanceFileName] # write binary distance matrix
 
     cmd = [prog] + clist
     cmdLine = " ".join(cmd)
-    secs, instDict = bestRun(cmd, fileName)
+    # Baseline results only change with the graph contents, the binary and the options
+    key = None
+    if useRef and useCache:
+        try:
+            key = cache.cacheKey(gfname, prog, "baseline", socket.gethostname(), runCount, doInstrument, doRegress, *clist[2:])
+        except OSError:
+            key = None
+    if key is not None:
+        entry = cache.lookupJSON(key)
+        refPath = cache.lookup(key, DISTANCE_SUFFIX) if doRegress else None
+        if entry is not None and (refPath is not None or not doRegress):
+            outmsg("Using cached baseline for '%s'" % cmdLine)
+            if doRegress:
+                referenceFileName = refPath
+            return results + [ranAlgorithm(algorithm, entry["inst"]), entry["msecs"]], entry["inst"]
+
+    context = None
+    if resultsDb is not None:
+        context = resultdb.runContext(resultsSession, resultsRevision, prog, testId, gfname,
+                                     (nnode, nedge, seed), threadCount if prog == ompProgram else 1, prog == cudaProgram, engine)
+    secs, instDict = bestRun(cmd, None, context)
     if secs is None:
         return None, {}
     else:
+        results.append(ranAlgorithm(algorithm, instDict))
         results.append("%.2f" % secs)
+        if key is not None:
+            if doRegress:
+                referenceFileName = cache.store(key, DISTANCE_SUFFIX, distanceFileName)
+            cache.storeJSON(key, {"msecs": results[-1], "inst": instDict})
         return results, instDict
 
+# Algorithm a run used: the requested one, or for auto the one the instrumentation (-I) shows
+# time for; uninstrumented auto runs stay "auto"
+def ranAlgorithm(algorithm, instDict):
+    if algorithm != "auto" or "elapsed" not in instDict:
+        return algorithm
+    return "floyd" if float(instDict.get("floyd_warshall", 0)) > 0 else "johnson"
+
+# Is the Dijkstra engine a dimension of the sweep
+def sweepEngines():
+    return dijkstraEngines != [None]
+
+# Index of the algorithm in a result row, after the engine when engines are swept
+def algorithmColumn():
+    return 5 if sweepEngines() else 4
+
 def formatTitle():
-    ls = ["# Node", "# Edge", "Seed", "GPU" if gpu else "Threads", "Test (ms)"]
+    ls = ["# Node", "# Edge", "Seed", "GPU" if gpu else "Threads"]
+    if sweepEngines():
+        ls += ["Engine"]
+    ls += ["Algorithm", "Test (ms)"]
     if doCheck:
          ls += ["Base (ms)", "Speedup"]
     return " ".join("{0:<10}".format(t) for t in ls)
@@ -234,14 +376,16 @@ def sweep(testList, threadCounts, gpu=False):
             outmsg("+++++++++++++++++ Benchmark Baseline +++++++++++++++++")
             cresults, cinstResult = runBenchmark(True, t, 1)
 
-        for tc in threadCounts:
+        for tc, engine in [(tc, e) for tc in threadCounts for e in dijkstraEngines]:
             tstart = time.perf_counter()
             ok = True
-            results, instResult = runBenchmark(False, t, tc, gpu)
+            results, instResult = runBenchmark(False, t, tc, gpu, engine)
             if results is not None and doCheck and (len(threadCounts) <= 1 and not gpu):
                 cresults, _ = runBenchmark(True, t, tc, gpu)
                 if doRegress and referenceFileName != "" and testFileName != "":
-                    ok = checkFiles(referenceFileName, testFileName)
+                    ok = checkDistanceFiles(referenceFileName, testFileName)
+            if results is not None and doCertify and testFileName != "":
+                ok = verify.verifyFile(getGraph(*benchmarkDict[t]), testFileName, certifyConfidence)
             if not ok:
                 outmsg("TEST FAILED")
             if results is not None:
@@ -251,7 +395,7 @@ def sweep(testList, threadCounts, gpu=False):
                     speedup = float(msecs) / float(results[-1])
                     results += [msecs, "%.2fx" % speedup]
                 resultList.append(results)
-            if instResult is not None:
+            if results is not None:
                 instResultList.append(instResult)
             secs = time.perf_counter() - tstart
             print("Test time for %d threads = %.2f secs." % (tc, secs))
@@ -259,8 +403,10 @@ def sweep(testList, threadCounts, gpu=False):
         if len(threadCounts) > 1 or gpu: #one table per test
             if doInstrument:
                 generateInstResultTable(resultList, instResultList, cinstResult)
+                generateImbalanceTable(resultList, instResultList)
             else:
                 printTable(resultList)
+            generateUsageTable(resultList, instResultList, cinstResult)
 
             resultList = []
             instResultList = []
@@ -269,8 +415,10 @@ def sweep(testList, threadCounts, gpu=False):
     if len(threadCounts) == 1 and not gpu:
         if doInstrument:
             generateInstResultTable(resultList, instResultList, cinstResult)
+            generateImbalanceTable(resultList, instResultList)
         else:
             printTable(resultList)
+        generateUsageTable(resultList, instResultList, cinstResult)
 
 def printTable(resultList):
     printTitle() # one table in total
@@ -280,23 +428,23 @@ def printTable(resultList):
 def generateInstResultTable(resultList, instResultList, cinstResult):
     bf, dijkstra = None, None
 
-    outmsg("+" * 105)
+    outmsg("+" * 141)
     if len(resultList) > 0:
         nnode, nedge, seed = resultList[0][:3]
         outmsg(" " * 35 + "{} Nodes, {} Edges, Seed {}".format(nnode, nedge, seed))
-    msg = "{0:<8} {1:<14} {2:<10} {3:<10} {4:<8} {5:<8} {6:<12} {7:<12} {8:<15}".format("GPU" if gpu else "Thread", "bellman_ford", "dijkstra", "overhead", "unknown", "elapsed", "BF Speedup", "D Speedup", "Overall Speedup")
+    msg = "{0:<8} {1:<10} {2:<14} {3:<10} {4:<16} {5:<10} {6:<8} {7:<8} {8:<12} {9:<12} {10:<15} {11:<9}".format("GPU" if gpu else "Thread", "Algorithm", "bellman_ford", "dijkstra", "floyd_warshall", "overhead", "unknown", "elapsed", "BF Speedup", "D Speedup", "Overall Speedup", "BF Passes")
     outmsg(msg)
-    outmsg("+" * 105)
+    outmsg("+" * 141)
 
     bf_ref, d_ref, elapsed_ref = 0., 0., 0.
 
     if cinstResult is not None:
-        l, p, bf, d, o, u, e = [cinstResult.get(c, 0.0) for c in instColumns]
-        msg = "{0:<8} {1:<14} {2:<10} {3:<10} {4:<8} {5:<8}".format("Ref", bf, d, o, u, e)
+        l, p, bf, d, fw, o, u, e = [cinstResult.get(c, 0.0) for c in instColumns]
+        msg = "{0:<8} {1:<10} {2:<14} {3:<10} {4:<16} {5:<10} {6:<8} {7:<8} {8:<12} {9:<12} {10:<15} {11:<9}".format("Ref", "johnson", bf, d, fw, o, u, e, "", "", "", cinstResult.get("bellman_ford_passes", "-"))
         outmsg(msg)
         bf_ref, d_ref, elapsed_ref = float(bf), float(d), (float(e) - float(l) - float(p)) # remove load_graph and print_graph
     for result, instResult in zip(resultList, instResultList):
-        l, p, bf, d, o, u, e = [instResult.get(c, 0.0) for c in instColumns]
+        l, p, bf, d, fw, o, u, e = [instResult.get(c, 0.0) for c in instColumns]
         elapsed = float(e) - float(l) - float(p) # remove load_graph and print_graph
         e = "%.2f" % elapsed
         bf_speedup, dijkstra_speedup, speedup = "-", "-", "-"
@@ -306,9 +454,376 @@ def generateInstResultTable(resultList, instResultList, cinstResult):
             dijkstra_speedup = "%.2fx" % (d_ref/float(d))
         if e and elapsed_ref:
             speedup = "%.2fx" % (elapsed_ref/elapsed)
-        msg = "{0:<8} {1:<14} {2:<10} {3:<10} {4:<8} {5:<8} {6:<12} {7:<12} {8:<15}".format("x" if gpu else result[3], bf, d, o, u, e, bf_speedup, dijkstra_speedup, speedup)
+        msg = "{0:<8} {1:<10} {2:<14} {3:<10} {4:<16} {5:<10} {6:<8} {7:<8} {8:<12} {9:<12} {10:<15} {11:<9}".format("x" if gpu else (result[3] + "/" + result[4] if sweepEngines() else result[3]), result[algorithmColumn()], bf, d, fw, o, u, e, bf_speedup, dijkstra_speedup, speedup, instResult.get("bellman_ford_passes", "-"))
         outmsg(msg)
 
+# Value at fraction p of a sorted list, interpolating between neighbours
+def percentile(values, p):
+    if len(values) == 0:
+        return 0.0
+    pos = p * (len(values) - 1)
+    lo = int(math.floor(pos))
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+# Random query requests, generated up front so clients only measure the server
+def queryPlan(nnode, seed):
+    rng = random.Random(seed)
+    plan = []
+    for i in range(loadRequests):
+        kind = loadQuery if loadQuery != "mix" else rng.choice(queryChoices[:-1])
+        if kind == "row":
+            plan.append("ROW %d" % rng.randrange(nnode))
+        elif kind == "rows":
+            plan.append("ROWS " + " ".join(str(rng.randrange(nnode)) for j in range(loadRowsBatch)))
+        else:
+            plan.append("DIST %d %d" % (rng.randrange(nnode), rng.randrange(nnode)))
+    return plan
+
+# Start a query server on the test graph and replay a query plan from concurrent clients
+def loadTest(testId, threadCount):
+    nnode, nedge, seed = benchmarkDict[testId][:3]
+    gfname = getGraph(*benchmarkDict[testId])
+    prog = getProgram(False, threadCount, False)
+    sockPath = os.path.join(tempfile.gettempdir(), "johnson-%d-%s.sock" % (os.getpid(), testId))
+    cmd = [prog, "-g", gfname, "-Q", sockPath, "-M", str(loadCacheMB)]
+    if prog == ompProgram:
+        cmd += ["-t", str(threadCount)]
+    outmsg("Running '%s'" % " ".join(cmd))
+
+    tstart = time.perf_counter()
+    process = subprocess.Popen(cmd, stdout = subprocess.DEVNULL)
+    try:
+        control = query.waitForServer(sockPath, process = process)
+    except query.QueryError as e:
+        outmsg("Couldn't start query server: %s" % e)
+        process.kill()
+        process.wait()
+        return None
+    startup = (time.perf_counter() - tstart) * 1e3
+
+    plan = queryPlan(nnode, seed)
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+    nextRequest = [0]
+
+    def client():
+        with query.QueryClient(sockPath) as c:
+            while True:
+                with lock:
+                    i = nextRequest[0]
+                    nextRequest[0] += 1
+                if i >= len(plan):
+                    return
+                t = time.perf_counter()
+                try:
+                    c.request(plan[i])
+                except (OSError, query.QueryError) as e:
+                    with lock:
+                        failures.append(str(e))
+                    return
+                with lock:
+                    latencies.append((time.perf_counter() - t) * 1e3)
+
+    threads = [threading.Thread(target = client) for i in range(loadClients)]
+    tstart = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    secs = time.perf_counter() - tstart
+
+    info = None
+    try:
+        info = control.info()
+        control.shutdown()
+    except (OSError, query.QueryError) as e:
+        outmsg("Query server didn't %s: %s" % ("shut down cleanly" if info is not None else "report statistics", e))
+    control.close()
+    try:
+        process.wait(timeout = loadExitTimeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+    if info is None:
+        return None
+    if len(failures) > 0:
+        outmsg("%d query clients failed: %s" % (len(failures), failures[0]))
+        return None
+
+    latencies.sort()
+    lookups = info["hits"] + info["misses"]
+    hitRate = "%.1f%%" % (100.0 * info["hits"] / lookups) if lookups > 0 else "-"
+    return [nnode, nedge, seed, str(threadCount), "%.2f" % startup, "%.1f" % (len(latencies) / secs),
+            "%.3f" % percentile(latencies, 0.5), "%.3f" % percentile(latencies, 0.99), hitRate]
+
+def loadSweep(testList, threadCounts):
+    resultList = []
+    for t in testList:
+        for tc in threadCounts:
+            outmsg("+++++++++++++++++ Load %s +++++++++++++++++" % testName(t, tc))
+            results = loadTest(t, tc)
+            if results is not None:
+                resultList.append(results)
+    ls = ["# Node", "# Edge", "Seed", "Threads", "Start (ms)", "Req/s", "p50 (ms)", "p99 (ms)", "Hit rate"]
+    outmsg("+" * 100)
+    outmsg("%d %s requests, %d clients" % (loadRequests, loadQuery, loadClients))
+    outmsg(" ".join("{0:<10}".format(t) for t in ls))
+    outmsg("+" * 100)
+    for result in resultList:
+        outmsg(" ".join("{0:<10}".format(r) for r in result))
+
+# Activities whose per-thread times ("activity@thread" lines) are summarised in the imbalance table
+threadActivities = ["bellman_ford", "dijkstra", "floyd_warshall"]
+
+# (max, mean, idle fraction) of an activity's per-thread busy times, or None.
+# Idle fraction is the share of threads x activity time during which threads had no work.
+def threadBalance(instDict, activity, threads):
+    prefix = activity + "@"
+    times = [float(v) for k, v in instDict.items() if k.startswith(prefix)]
+    total = float(instDict.get(activity, 0.0))
+    if len(times) == 0 or total <= 0:
+        return None
+    busy = sum(times)
+    return max(times), busy / len(times), max(0.0, 1.0 - busy / (total * max(threads, len(times))))
+
+def generateImbalanceTable(resultList, instResultList):
+    fmt = "{0:<8} " + " ".join(["{%d:<10} {%d:<10} {%d:<10} {%d:<8}" % (4*i+1, 4*i+2, 4*i+3, 4*i+4) for i in range(len(threadActivities))])
+    outmsg("+" * 155)
+    titles = ["Thread"]
+    for a in threadActivities:
+        short = phaseAbbrev[a]
+        titles += [short + " max", short + " mean", short + " max/avg", short + " idle"]
+    outmsg(fmt.format(*titles))
+    outmsg("+" * 155)
+    for result, instResult in zip(resultList, instResultList):
+        threads = 1 if gpu else int(result[3])
+        row = ["x" if gpu else (result[3] + "/" + result[4] if sweepEngines() else result[3])]
+        for a in threadActivities:
+            balance = threadBalance(instResult, a, threads)
+            if balance is None:
+                row += ["-", "-", "-", "-"]
+            else:
+                tmax, tmean, idle = balance
+                row += ["%.2f" % tmax, "%.2f" % tmean, "%.2f" % (tmax / tmean if tmean > 0 else 0.0), "%.1f%%" % (100.0 * idle)]
+        outmsg(fmt.format(*row))
+
+# Child resource usage per run, with CPU efficiency = cpu time / (wall time x threads)
+def generateUsageTable(resultList, instResultList, cinstResult):
+    fmt = "{0:<8} {1:<10} {2:<10} {3:<10} {4:<8} {5:<10} {6:<10} {7:<8} {8:<10} {9:<10}"
+    outmsg("+" * 100)
+    outmsg(fmt.format("GPU" if gpu else "Thread", "wall", "user", "sys", "CPU Eff", "RSS (MB)", "min_flt", "maj_flt", "vol_ctx", "invol_ctx"))
+    outmsg("+" * 100)
+    rows = []
+    if cinstResult is not None:
+        rows.append(("Ref", 1, cinstResult))
+    for result, instResult in zip(resultList, instResultList):
+        label = "x" if gpu else (result[3] + "/" + result[4] if sweepEngines() else result[3])
+        rows.append((label, 1 if gpu else int(result[3]), instResult))
+    for label, threads, instResult in rows:
+        eff = cpuEfficiency(instResult, threads)
+        values = [instResult.get(c, "-") for c in usageColumns]
+        outmsg(fmt.format(label, *(values[:3] + ["-" if eff is None else "%.2f" % eff] + values[3:])))
+    floor = launcherRss()
+    if floor is not None:
+        outmsg("RSS includes about %.1f MB of the forked benchmark process" % floor)
+
+# Scaling analysis (-A): every graph size x density runs johnson_omp on each thread count,
+# and the instrumented time of each phase is fitted separately (see scaling.py).
+# Density is relative to n^2/2 edges, as for the benchmark tests.
+analysisSizes = [256, 512, 1024, 2048]
+analysisDensities = [0.0625, 0.125, 0.25, 0.5]
+analysisSeed = 1
+analysisReport = None
+analysisLimit = 0
+
+def analysisGraphs():
+    return [(n, int(d * n * n / 2), analysisSeed) for n in analysisSizes for d in analysisDensities]
+
+# One thread, powers of two and the limit itself
+def analysisThreads(limit):
+    counts = [1]
+    while counts[-1] * 2 < limit:
+        counts.append(counts[-1] * 2)
+    if limit > 1:
+        counts.append(limit)
+    return counts
+
+def analysisRun(params, threadCount, engine):
+    nnode, nedge, seed = params
+    gfname = getGraph(*params)
+    # auto by default, so dense grid points measure the Floyd-Warshall phase
+    cmd = [ompProgram, "-g", gfname, "-t", str(threadCount), "-I", "-a", testAlgorithm]
+    if engine is not None:
+        cmd += ["-d", engine]
+    context = None
+    if resultsDb is not None:
+        context = resultdb.runContext(resultsSession, resultsRevision, ompProgram, "scale-n%d-e%d" % (nnode, nedge),
+                                     gfname, params, threadCount, False, engine)
+    secs, instDict = bestRun(cmd, None, context)
+    return instDict if secs is not None else None
+
+def analysisSweep(limit):
+    engine = dijkstraEngines[0]
+    counts = analysisThreads(limit)
+    measurements = []
+    fmt = "{0:<8} " + " ".join("{%d:<10} {%d:<8} {%d:<8}" % (3*i+1, 3*i+2, 3*i+3) for i in range(len(scaling.phases)))
+    for nnode in analysisSizes:
+        for density in analysisDensities:
+            params = (nnode, int(density * nnode * nnode / 2), analysisSeed)
+            outmsg("+++++++++++++++++ Scaling %d nodes, %d edges +++++++++++++++++" % params[:2])
+            points = []
+            for tc in counts:
+                instDict = analysisRun(params, tc, engine)
+                if instDict is None:
+                    outmsg("Skipping remaining thread counts")
+                    break
+                for phase in scaling.phases:
+                    if phase in instDict:
+                        points.append((nnode, params[1], density, tc, phase, float(instDict[phase])))
+            measurements += points
+            groups = scaling.series(points)
+            outmsg("+" * 75)
+            titles = ["Thread"]
+            for phase in scaling.phases:
+                titles += [phaseAbbrev[phase] + " (ms)", phaseAbbrev[phase] + " spd", phaseAbbrev[phase] + " K-F"]
+            outmsg(fmt.format(*titles))
+            outmsg("+" * 75)
+            for tc in counts:
+                row = [str(tc)]
+                for phase in scaling.phases:
+                    times = dict(groups.get((nnode, params[1], density, phase), []))
+                    if tc not in times or times.get(1, 0) <= 0 or times[tc] <= 0:
+                        row += ["-", "-", "-"]
+                        continue
+                    speedup = times[1] / times[tc]
+                    kf = scaling.karpFlatt(speedup, tc)
+                    row += ["%.2f" % times[tc], "%.2f" % speedup, "-" if kf is None else "%.3f" % kf]
+                outmsg(fmt.format(*row))
+            fits = scaling.fitAll(points)
+            outmsg("Amdahl serial fraction: " + ", ".join("%s %s" % (k[3], "-" if f is None else "%.3f" % f)
+                                                          for k, f in sorted(fits.items())))
+    prefix = analysisReport or "scaling-%s" % time.strftime("%Y%m%d-%H%M%S")
+    scaling.writeCSV(prefix + ".csv", measurements)
+    title = "Scaling of %s on %s, threads %s" % (ompProgram, socket.gethostname(), ",".join(str(c) for c in counts))
+    if engine is not None:
+        title += ", %s Dijkstra" % engine
+    scaling.writeHTML(prefix + ".html", measurements, title)
+    outmsg("Wrote %s.csv and %s.html" % (prefix, prefix))
+
+# Single-source comparison (--sssp N): N random sources of each test graph, solved by serial
+# heap Dijkstra on one thread and by delta-stepping on each thread count, where the threads
+# share the work of every source.  Only the instrumented Dijkstra phase is compared, and rows
+# are summarised rather than printed, so the check compares the summaries (distance sums).
+ssspSources = 0
+ssspSeed = 1
+ssspWidth = None
+ssspLimit = 0
+
+def ssspRun(testId, sources, engine, threadCount):
+    gfname = getGraph(*benchmarkDict[testId])
+    cmd = [ompProgram, "-g", gfname, "-t", str(threadCount), "-I", "-d", engine,
+           "--sources", ",".join(str(s) for s in sources)]
+    if engine == "delta" and ssspWidth is not None:
+        cmd += ["--delta", str(ssspWidth)]
+    outName = "%s/sssp-%s-%s-%d.txt" % (saveDirectory, testId, engine, threadCount)
+    context = None
+    if resultsDb is not None:
+        context = resultdb.runContext(resultsSession, resultsRevision, ompProgram, "sssp-" + testId,
+                                     gfname, benchmarkDict[testId][:3], threadCount, False, engine)
+    secs, instDict = bestRun(cmd, outName, context)
+    if secs is None:
+        return None, outName
+    return float(instDict.get("dijkstra", secs)), outName
+
+def ssspSweep(testList, limit):
+    if not os.path.exists(saveDirectory):
+        os.mkdir(saveDirectory)
+    fmt = "{0:<8} {1:<12} {2:<12} {3:<10} {4:<8}"
+    for t in testList:
+        nnode = benchmarkDict[t][0]
+        sources = random.Random(ssspSeed).sample(range(nnode), min(ssspSources, nnode))
+        outmsg("+++++++++++++++++ Single source %s, %d sources +++++++++++++++++" % (t, len(sources)))
+        base, baseName = ssspRun(t, sources, "heap", 1)
+        if base is None:
+            continue
+        rows = []
+        for tc in analysisThreads(limit):
+            ms, outName = ssspRun(t, sources, "delta", tc)
+            if ms is None:
+                rows.append([str(tc), "%.2f" % base, "-", "-", "-"])
+                continue
+            check = "-"
+            if doCheck:
+                check = "ok" if filecmp.cmp(baseName, outName, shallow=False) else "FAILED"
+            rows.append([str(tc), "%.2f" % base, "%.2f" % ms, "%.2fx" % (base / ms if ms > 0 else 0.0), check])
+        outmsg("+" * 55)
+        outmsg(fmt.format("Thread", "Heap (ms)", "Delta (ms)", "Speedup", "Check"))
+        outmsg("+" * 55)
+        for row in rows:
+            outmsg(fmt.format(*row))
+
+# Node orderings (--orderings): each test runs with the solver's -O option for every ordering and
+# without one.  Gain is the all-pairs time (Bellman-Ford and Dijkstra or Floyd-Warshall) without
+# reordering over the time with it; net gain also counts the time spent reordering.
+orderingChoices = ["rcm", "degree", "reuse"]
+orderings = []
+
+def orderingRun(testId, order, threadCount, engine):
+    gfname = getGraph(*benchmarkDict[testId])
+    prog = getProgram(False, threadCount, False)
+    cmd = [prog, "-g", gfname, "-I", "-O", order]
+    if prog == ompProgram:
+        cmd += ["-t", str(threadCount)]
+    if engine is not None:
+        cmd += ["-d", engine]
+    outName = None
+    if doCheck:
+        if not os.path.exists(saveDirectory):
+            os.mkdir(saveDirectory)
+        outName = "%s/order-%s-%s-%d%s" % (saveDirectory, testId, order, threadCount, DISTANCE_SUFFIX)
+        cmd += ["-B", outName]
+    context = None
+    if resultsDb is not None:
+        context = resultdb.runContext(resultsSession, resultsRevision, prog, "order-%s-%s" % (testId, order),
+                                     gfname, benchmarkDict[testId][:3], threadCount if prog == ompProgram else 1, False, engine)
+    secs, instDict = bestRun(cmd, None, context)
+    if secs is None:
+        return None, None, outName
+    solve = sum(float(instDict.get(p, 0)) for p in scaling.phases)
+    return solve, float(instDict.get("reorder_graph", 0)), outName
+
+def orderingSweep(testList, threadCounts):
+    engine = dijkstraEngines[0]
+    fmt = "{0:<8} {1:<8} {2:<12} {3:<14} {4:<8} {5:<10} {6:<8}"
+    for t in testList:
+        for tc in threadCounts:
+            outmsg("+++++++++++++++++ Node orderings %s, %d threads +++++++++++++++++" % (t, tc))
+            base, _, baseName = orderingRun(t, "none", tc, engine)
+            if base is None:
+                continue
+            rows = [["none", str(tc), "%.2f" % base, "-", "1.00x", "1.00x", "-"]]
+            for order in orderings:
+                solve, reorder, outName = orderingRun(t, order, tc, engine)
+                if solve is None:
+                    rows.append([order, str(tc), "-", "-", "-", "-", "-"])
+                    continue
+                check = "-"
+                if outName is not None and baseName is not None:
+                    check = "ok" if filecmp.cmp(baseName, outName, shallow=False) else "FAILED"
+                    os.remove(outName)
+                rows.append([order, str(tc), "%.2f" % solve, "%.2f" % reorder,
+                             "%.2fx" % (base / solve if solve > 0 else 0.0),
+                             "%.2fx" % (base / (solve + reorder) if solve + reorder > 0 else 0.0), check])
+            if baseName is not None and os.path.exists(baseName):
+                os.remove(baseName)
+            outmsg("+" * 75)
+            outmsg(fmt.format("Order", "Thread", "Solve (ms)", "Reorder (ms)", "Gain", "Net gain", "Check"))
+            outmsg("+" * 75)
+            for row in rows:
+                outmsg(fmt.format(*row))
+
 def generateFileName(template):
     global uniqueId
     myId = ""
@@ -330,8 +845,29 @@ def run():
 
     testList = list(defaultTests)
 
+    # The analysis grid is set on the command line, so its graphs are built here, before any timing
+    if analysisLimit > 0:
+        if not prepare.prepare(analysisGraphs()):
+            sys.exit(1)
+        testList = []
+    problems = prepare.validate([benchmarkDict[t] for t in testList])
+    if len(problems) > 0:
+        for msg in problems:
+            outmsg(msg)
+        outmsg("Graphs are not prepared.  Run 'python3 prepare.py' first")
+        sys.exit(1)
+
     gstart = time.perf_counter()
-    sweep(testList, threadCounts, gpu)
+    if analysisLimit > 0:
+        analysisSweep(analysisLimit)
+    elif ssspSources > 0:
+        ssspSweep(testList, ssspLimit)
+    elif len(orderings) > 0:
+        orderingSweep(testList, threadCounts)
+    elif loadRequests > 0:
+        loadSweep(testList, threadCounts)
+    else:
+        sweep(testList, threadCounts, gpu)
     if len(threadCounts) > 1:
         secs = time.perf_counter() - gstart
         print("Overall test time = %.2f secs." % (secs))
@@ -342,16 +878,53 @@ if __name__ == "__main__":
                     help="Quick mode: do not compare performance with reference solution")
     parser.add_argument("-V", "--verify", action="store_true",
                     help="Verify result against reference solution")
+    parser.add_argument("--certify", type=float, nargs="?", const=0.0,
+                    help="Verify results with the shortest-path conditions (verify.py) instead of the reference output; "
+                         "with a confidence such as %g, check a random sample of rows" % verify.defaultConfidence)
     parser.add_argument("-I", "--instrument", action="store_true",
                     help="Instrument activities")
     parser.add_argument("-S", "--scale", action="store_true",
                     help="Instrument activities")
+    parser.add_argument("-T", "--tests", type=str,
+                    help="Comma-separated tests to run, or 'families' for all graph families (default %s)" % ",".join(defaultTests))
     parser.add_argument("-r", "--runs", type=int,
                     help="Specify number of times each benchmark is run")
     parser.add_argument("-t", "--threadCount", type=int,
                     help="Specify number of OMP threads.\n If > 1, will run johnson_omp.  Else will run johnson_seq")
     parser.add_argument("-G", "--gpu", action="store_true",
                     help="Run johnson_cuda")
+    parser.add_argument("-E", "--engines", type=str,
+                    help="Comma-separated Dijkstra engines to sweep (%s)" % ",".join(engineChoices))
+    parser.add_argument("-a", "--algorithm", type=str, choices=algorithmChoices,
+                    help="All-pairs algorithm of the test runs (default %s); baselines run johnson" % testAlgorithm)
+    parser.add_argument("-F", "--fresh", action="store_true",
+                    help="Rerun baselines instead of using cached results")
+    parser.add_argument("-D", "--database", type=str, default=resultdb.defaultDatabase,
+                    help="Record every run in this results database")
+    parser.add_argument("-N", "--norecord", action="store_true",
+                    help="Do not record runs in the results database")
+    parser.add_argument("-L", "--load", type=int,
+                    help="Load-test the query server (-Q) with this many requests per test")
+    parser.add_argument("--clients", type=int,
+                    help="Concurrent query clients in load mode (default %d)" % loadClients)
+    parser.add_argument("--query", type=str, choices=queryChoices,
+                    help="Kind of query in load mode (default %s)" % loadQuery)
+    parser.add_argument("--cache-mb", type=int,
+                    help="Row cache size of the query server in MB (default %d)" % loadCacheMB)
+    parser.add_argument("-A", "--analyze", action="store_true",
+                    help="Scaling analysis over graph size x density x threads, with per-phase speedup models")
+    parser.add_argument("--sizes", type=str,
+                    help="Comma-separated node counts for -A (default %s)" % ",".join(str(n) for n in analysisSizes))
+    parser.add_argument("--densities", type=str,
+                    help="Comma-separated edge densities for -A (default %s)" % ",".join(str(d) for d in analysisDensities))
+    parser.add_argument("--report", type=str,
+                    help="Path prefix of the -A CSV and HTML report (default scaling-<time>)")
+    parser.add_argument("--sssp", type=int,
+                    help="Compare delta-stepping with serial Dijkstra on this many random sources per test (default tests: families)")
+    parser.add_argument("--delta", type=int,
+                    help="Bucket width of delta-stepping for --sssp (default chosen by the solver)")
+    parser.add_argument("--orderings", type=str,
+                    help="Compare comma-separated node orderings (%s, or 'all') with none" % ",".join(orderingChoices))
     parser.add_argument("-f", "--outfile", type=str,
                     help="Create output file recording measurements")
 
@@ -359,8 +932,19 @@ if __name__ == "__main__":
 
     doCheck = not args.quick if args.quick is not None else doCheck
     doRegress = args.verify if doCheck else False
+    if args.certify is not None:
+        if args.certify != 0.0 and not 0 < args.certify < 1:
+            parser.error("certify confidence must be in (0, 1)")
+        doCertify = True
+        doRegress = False
+        certifyConfidence = args.certify if args.certify != 0.0 else None
     doInstrument = args.instrument if args.instrument is not None else doInstrument
     runCount = args.runs if args.runs is not None else runCount
+    useCache = not args.fresh
+    if not args.norecord:
+        resultsDb = resultdb.openDatabase(args.database)
+        resultsSession = "%s-%d" % (time.strftime("%Y%m%d-%H%M%S"), os.getpid())
+        resultsRevision = resultdb.gitRevision()
     if doInstrument:
         stdProgram = seqProgram # instrumentation not available for johnson_boost
     # Scaling mode: vary the number of threads
@@ -370,9 +954,65 @@ if __name__ == "__main__":
         stdProgram = seqProgram # use seq program as baseline when checking for perf scaling
     else:
         threadCounts = [args.threadCount] if args.threadCount is not None else threadCounts
+    if args.tests is not None:
+        defaultTests = familyList if args.tests == "families" else args.tests.split(",")
+        for t in defaultTests:
+            if t not in benchmarkDict:
+                parser.error("unknown test '%s'" % t)
     if args.gpu:
         gpu = True
         threadCounts = [1]
+    testAlgorithm = args.algorithm or testAlgorithm
+    if args.engines is not None:
+        dijkstraEngines = args.engines.split(",")
+        for e in dijkstraEngines:
+            if e not in engineChoices:
+                parser.error("unknown Dijkstra engine '%s'" % e)
+    if args.load is not None:
+        if args.gpu:
+            parser.error("the query server runs on the CPU only")
+        loadRequests = args.load
+        loadClients = args.clients if args.clients is not None else loadClients
+        loadQuery = args.query if args.query is not None else loadQuery
+        loadCacheMB = args.cache_mb if args.cache_mb is not None else loadCacheMB
+    if args.analyze:
+        if args.gpu or args.load is not None or args.scale:
+            parser.error("-A can't be combined with -G, -L or -S")
+        if len(dijkstraEngines) > 1:
+            parser.error("-A runs a single Dijkstra engine")
+        try:
+            if args.sizes is not None:
+                analysisSizes = [int(n) for n in args.sizes.split(",")]
+            if args.densities is not None:
+                analysisDensities = [float(d) for d in args.densities.split(",")]
+        except ValueError:
+            parser.error("bad --sizes or --densities list")
+        if min(analysisSizes) < 2 or min(analysisDensities) <= 0 or max(analysisDensities) > 1:
+            parser.error("sizes must be at least 2 and densities in (0, 1]")
+        analysisLimit = args.threadCount if args.threadCount is not None else defaultThreadCount
+        analysisReport = args.report
+        doInstrument = True
+    if args.sssp is not None:
+        if args.gpu or args.load is not None or args.scale or args.analyze or args.engines is not None:
+            parser.error("--sssp can't be combined with -G, -L, -S, -A or -E")
+        if args.sssp < 1:
+            parser.error("--sssp needs at least one source")
+        ssspSources = args.sssp
+        ssspWidth = args.delta
+        ssspLimit = args.threadCount if args.threadCount is not None else defaultThreadCount
+        if args.tests is None:
+            defaultTests = familyList
+        doInstrument = True
+    if args.orderings is not None:
+        if args.gpu or args.load is not None or args.analyze or args.sssp is not None:
+            parser.error("--orderings can't be combined with -G, -L, -A or --sssp")
+        if len(dijkstraEngines) > 1:
+            parser.error("--orderings runs a single Dijkstra engine")
+        orderings = orderingChoices if args.orderings == "all" else args.orderings.split(",")
+        for o in orderings:
+            if o not in orderingChoices:
+                parser.error("unknown node ordering '%s'" % o)
+        doInstrument = True
     outFile = args.outfile if args.outfile is not None else outFile
 
     run()
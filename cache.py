@@ -0,0 +1,120 @@
+# Content-addressed cache for reference solver outputs and baseline timings
+# Entries are keyed by a hash of the graph file contents, the solver binary and the run options,
+# so a regenerated graph or a rebuilt solver never reuses a stale entry.
+# Total size is capped, evicting the least recently used entries first.
+
+import hashlib
+import json
+import os
+import os.path
+import tempfile
+
+# Directory holding cache entries
+cacheDir = "./result-cache"
+
+# Limit on total size of cache entries (bytes)
+cacheLimit = 2 << 30
+
+# Read size when hashing files
+hashBlock = 1 << 20
+
+# Entries this process has looked up or stored.  Callers use the returned paths later, so
+# eviction leaves them alone even if that keeps the cache above cacheLimit for a while.
+inUse = set()
+
+# (path, size, mtime) -> digest, so large graphs are hashed once per process
+digestMemo = {}
+
+def fileDigest(path):
+    st = os.stat(path)
+    memoKey = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if memoKey not in digestMemo:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(hashBlock), b""):
+                h.update(block)
+        digestMemo[memoKey] = h.hexdigest()
+    return digestMemo[memoKey]
+
+# Key for the output of running the given program files with args on a graph
+def cacheKey(graphFileName, programs, *args):
+    if isinstance(programs, str):
+        programs = [programs]
+    h = hashlib.sha256()
+    h.update(fileDigest(graphFileName).encode())
+    for prog in programs:
+        h.update(fileDigest(prog).encode())
+    h.update(json.dumps([str(a) for a in args]).encode())
+    return h.hexdigest()
+
+def entryPath(key, suffix):
+    return os.path.join(cacheDir, key[:2], key + suffix)
+
+# Path of a cached entry, or None.  A hit marks the entry as recently used.
+def lookup(key, suffix):
+    path = entryPath(key, suffix)
+    try:
+        os.utime(path)
+    except OSError:
+        return None
+    inUse.add(os.path.abspath(path))
+    return path
+
+# Move a freshly written file into the cache, returning its new path
+def store(key, suffix, path):
+    dest = entryPath(key, suffix)
+    os.makedirs(os.path.dirname(dest), exist_ok = True)
+    os.replace(path, dest)
+    inUse.add(os.path.abspath(dest))
+    evict()
+    return dest
+
+def lookupJSON(key):
+    path = lookup(key, ".json")
+    if path is None:
+        return None
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def storeJSON(key, value):
+    os.makedirs(cacheDir, exist_ok = True)
+    fd, tmpPath = tempfile.mkstemp(dir = cacheDir, suffix = ".tmp")
+    with os.fdopen(fd, 'w') as f:
+        json.dump(value, f)
+    return store(key, ".json", tmpPath)
+
+# Temporary file inside the cache directory, to be passed to store()
+def scratchPath(suffix):
+    os.makedirs(cacheDir, exist_ok = True)
+    fd, path = tempfile.mkstemp(dir = cacheDir, suffix = suffix + ".tmp")
+    os.close(fd)
+    return path
+
+# Remove least recently used entries, other than those in use, until the cache fits in cacheLimit
+def evict():
+    entries = []
+    total = 0
+    for root, dirs, files in os.walk(cacheDir):
+        for name in files:
+            if name.endswith(".tmp"):
+                continue
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            total += st.st_size
+            if os.path.abspath(path) not in inUse:
+                entries.append((st.st_mtime, st.st_size, path))
+    entries.sort()
+    for _, size, path in entries:
+        if total <= cacheLimit:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
@@ -0,0 +1,71 @@
+#include "johnson.hpp"
+#include "libjohnson.h"
+#include <string.h>
+
+// Index of name in names, -1 if absent; NULL selects def
+static int FindName(const char *name, const char **names, int count, int def) {
+    if (name == NULL)
+        return def;
+    for (int i = 0; i < count; i++)
+        if (strcmp(name, names[i]) == 0)
+            return i;
+    return -1;
+}
+
+extern "C" int johnson_solve(int nnode, int nedge, const int *node, const int *edge, const int *weight,
+                             int *distance, const char *algorithm, const char *engine, int threads,
+                             johnson_stats *stats) {
+    int a = FindName(algorithm, apsp_algorithm_name, APSP_ALGORITHM_COUNT, APSP_AUTO);
+    int e = FindName(engine, dijkstra_engine_name, DIJKSTRA_ENGINE_COUNT, DIJKSTRA_SCAN);
+    if (a < 0 || e < 0)
+        return JOHNSON_BAD_OPTION;
+    if (!ValidCSR(nnode, nedge, node, edge, weight) || (nnode > 0 && distance == NULL))
+        return JOHNSON_BAD_GRAPH;
+    apsp_algorithm = (apsp_algorithm_t)a;
+    dijkstra_engine = (dijkstra_engine_t)e;
+    #if OMP
+    if (threads > 0)
+        omp_set_num_threads(threads);
+    #endif
+
+    // The caller's arrays are used in place, like a mapped graph file, and never freed here
+    Graph graph;
+    graph.nnode = nnode;
+    graph.nedge = nedge;
+    graph.node = (int *)node;
+    graph.edge = (int *)edge;
+    graph.weight = (int *)weight;
+    graph.new_weight = (int *)malloc((nedge > 0 ? nedge : 1) * sizeof(int));
+    graph.potential = (int *)malloc((nnode > 0 ? nnode : 1) * sizeof(int));
+    graph.distance = (int **)malloc((nnode > 0 ? nnode : 1) * sizeof(int *));
+    for (int nid = 0; nid < nnode; nid++)
+        graph.distance[nid] = distance + (size_t)nid * nnode;
+    graph.mapping = NULL;
+    graph.mapping_size = 0;
+    graph.delta = 0;
+    graph.delta_bins = 0;
+    graph.order = NULL;
+    graph.rank = NULL;
+
+    apsp_algorithm_t chosen = ChooseAlgorithm(&graph);
+    double start = currentSeconds();
+    bool ok = BellmanFord(&graph);
+    double middle = currentSeconds();
+    if (ok) {
+        if (chosen == APSP_FLOYD)
+            FloydWarshall(&graph);
+        else
+            AllPairsDijkstra(&graph, NULL);
+    }
+    double end = currentSeconds();
+
+    if (stats != NULL) {
+        stats->bellman_ford_ms = (middle - start) * 1000.0;
+        stats->all_pairs_ms = ok ? (end - middle) * 1000.0 : 0.0;
+        stats->algorithm = chosen == APSP_FLOYD ? 1 : 0;
+    }
+    free(graph.new_weight);
+    free(graph.potential);
+    free(graph.distance);
+    return ok ? JOHNSON_OK : JOHNSON_NEGATIVE_CYCLE;
+}
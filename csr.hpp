@@ -0,0 +1,24 @@
+/* Consistency check of CSR graph arrays, shared by the solvers, the library and the CUDA solver
+ */
+
+#ifndef CSR_H
+#define CSR_H
+
+#include <stddef.h>
+
+// CSR offsets must be non-decreasing from 0 to nedge and edges must name existing nodes
+static inline bool ValidCSR(int nnode, int nedge, const int *node, const int *edge, const int *weight) {
+    if (nnode < 0 || nedge < 0 || node == NULL || (nedge > 0 && (edge == NULL || weight == NULL)))
+        return false;
+    if (node[0] != 0 || node[nnode] != nedge)
+        return false;
+    for (int u = 0; u < nnode; u++)
+        if (node[u] > node[u+1])
+            return false;
+    for (int eid = 0; eid < nedge; eid++)
+        if (edge[eid] < 0 || edge[eid] >= nnode)
+            return false;
+    return true;
+}
+
+#endif /* CSR_H */
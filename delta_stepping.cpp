@@ -0,0 +1,180 @@
+#include "johnson.hpp"
+#include <algorithm>
+#include <vector>
+
+// Bucket width of delta-stepping (--delta); 0 picks it from the reweighted edges
+int delta_width = 0;
+
+// A thread keeps working on its own share of the current bucket without a barrier
+// while the share stays below this size
+#define DeltaLocalBin 1000
+
+// Unreached bucket index
+#define DeltaNoBin ((size_t)-1)
+
+// Current tentative distance of v, which other threads may be lowering
+static inline int LoadDistance(const int *tmp_distance, int v) {
+    #if OMP
+    return __atomic_load_n(&tmp_distance[v], __ATOMIC_RELAXED);
+    #else
+    return tmp_distance[v];
+    #endif
+}
+
+// Lower tmp_distance[v] to value if smaller; true if it changed
+static inline bool AtomicMin(int *tmp_distance, int v, int value) {
+    #if OMP
+    int old = __atomic_load_n(&tmp_distance[v], __ATOMIC_RELAXED);
+    while (value < old) {
+        if (__atomic_compare_exchange_n(&tmp_distance[v], &old, value, true, __ATOMIC_RELAXED, __ATOMIC_RELAXED))
+            return true;
+    }
+    return false;
+    #else
+    if (value >= tmp_distance[v]) return false;
+    tmp_distance[v] = value;
+    return true;
+    #endif
+}
+
+// Bucket width and bucket count of delta-stepping for the reweighted edges.
+// The width is --delta, or twice the mean of the positive reweighted edges, about the largest
+// typical edge.  Meyer and Sanders' max weight / average degree came out at 1 or 2 on graph.py's
+// sparse families, where 16 was fastest even on one thread; wider buckets also mean fewer rounds
+// between barriers.  Tight (zero) edges are left out of the mean.
+// Relaxing a node of bucket b reaches at most bucket b + max weight / width + 1, so that many
+// buckets plus one, used as a ring, hold everything not yet settled.
+void DeltaSetup(Graph *graph) {
+    long long total = 0, positive = 0;
+    int max_weight = 0;
+    #if OMP
+    #pragma omp parallel for schedule(static) reduction(+:total, positive) reduction(max:max_weight)
+    #endif
+    for (int eid = 0; eid < graph->nedge; eid++)
+        if (graph->new_weight[eid] > 0) {
+            total += graph->new_weight[eid];
+            positive++;
+            max_weight = std::max(max_weight, graph->new_weight[eid]);
+        }
+    int delta = delta_width;
+    if (delta <= 0) {
+        double width = positive > 0 ? 2.0 * total / positive : 1.0;
+        delta = width < 1.0 ? 1 : width > IntMax / 2 ? IntMax / 2 : (int)width;
+    }
+    graph->delta = delta;
+    graph->delta_bins = max_weight / delta + 2;
+}
+
+// Relax the out-edges of u, filing every improved node in the bucket of its new distance
+static inline void RelaxNode(Graph *graph, int u, int *tmp_distance, int delta, std::vector<std::vector<int> > &bins) {
+    int du = LoadDistance(tmp_distance, u);
+    for (int eid = graph->node[u]; eid < graph->node[u+1]; eid++) {
+        int v = graph->edge[eid];
+        int dv = du + graph->new_weight[eid];
+        if (AtomicMin(tmp_distance, v, dv))
+            bins[(size_t)(dv / delta) % bins.size()].push_back(v);
+    }
+}
+
+// Single-source distances with the work of one source spread over the threads.
+// Nodes are kept in buckets of width graph->delta of their reweighted distance; all nodes of the
+// lowest non-empty bucket are relaxed in parallel, and a node that improves again is simply
+// filed again, so stale entries are skipped by checking them against the current bucket.
+// Each thread keeps graph->delta_bins buckets as a ring indexed by bucket number.
+void DeltaStepping(Graph *graph, int src_nid, int *distance) {
+    int nnode = graph->nnode;
+    int delta = graph->delta;
+    int *tmp_distance = (int *)malloc(nnode * sizeof(int));
+    std::vector<int> frontier(1, src_nid);
+    // Current bucket and frontier length, and the next ones being collected, by round parity
+    size_t bin_index[2] = { 0, DeltaNoBin };
+    size_t frontier_size[2] = { 1, 0 };
+
+    #if OMP
+    #pragma omp parallel for schedule(static)
+    #endif
+    for (int nid = 0; nid < nnode; nid++)
+        tmp_distance[nid] = IntMax;
+    tmp_distance[src_nid] = 0;
+
+    #if OMP
+    #pragma omp parallel
+    #endif
+    {
+        START_LOCAL_ACTIVITY(DIJKSTRA);
+        std::vector<std::vector<int> > bins(graph->delta_bins);
+        size_t nbin = bins.size();
+        size_t round = 0;
+        while (bin_index[round & 1] != DeltaNoBin) {
+            size_t &bin = bin_index[round & 1];
+            size_t &next_bin = bin_index[(round + 1) & 1];
+            size_t &size = frontier_size[round & 1];
+            size_t &next_size = frontier_size[(round + 1) & 1];
+            long long low = (long long)bin * delta;
+            std::vector<int> &current = bins[bin % nbin];
+
+            #if OMP
+            #pragma omp for schedule(dynamic, 64) nowait
+            #endif
+            for (size_t i = 0; i < size; i++) {
+                int u = frontier[i];
+                if (LoadDistance(tmp_distance, u) >= low)
+                    RelaxNode(graph, u, tmp_distance, delta, bins);
+            }
+            // Nodes this thread put back into the current bucket
+            while (!current.empty() && current.size() < DeltaLocalBin) {
+                std::vector<int> again;
+                again.swap(current);
+                for (size_t i = 0; i < again.size(); i++)
+                    RelaxNode(graph, again[i], tmp_distance, delta, bins);
+            }
+            for (size_t b = bin; b < bin + nbin; b++)
+                if (!bins[b % nbin].empty()) {
+                    #if OMP
+                    #pragma omp critical(delta_next_bin)
+                    #endif
+                    next_bin = std::min(next_bin, b);
+                    break;
+                }
+            #if OMP
+            #pragma omp barrier
+            #endif
+
+            // Collect every thread's share of the next bucket into the frontier
+            size_t share = next_bin != DeltaNoBin ? bins[next_bin % nbin].size() : 0;
+            size_t start = 0;
+            #if OMP
+            start = __atomic_fetch_add(&next_size, share, __ATOMIC_RELAXED);
+            #pragma omp barrier
+            #pragma omp single
+            #else
+            next_size = share;
+            #endif
+            {
+                if (frontier.size() < next_size)
+                    frontier.resize(next_size);
+                bin = DeltaNoBin;
+                size = 0;
+            }
+            if (share > 0) {
+                std::vector<int> &next = bins[next_bin % nbin];
+                std::copy(next.begin(), next.end(), frontier.begin() + start);
+                next.clear();
+            }
+            round++;
+            #if OMP
+            #pragma omp barrier
+            #endif
+        }
+        FINISH_LOCAL_ACTIVITY(DIJKSTRA);
+    }
+
+    // Undo the reweighting
+    int ps = graph->potential[src_nid];
+    #if OMP
+    #pragma omp parallel for schedule(static)
+    #endif
+    for (int nid = 0; nid < nnode; nid++)
+        distance[nid] = tmp_distance[nid] == IntMax ? IntMax : tmp_distance[nid] - ps + graph->potential[nid];
+    free(tmp_distance);
+}
@@ -1,4 +1,9 @@
 #include "johnson.hpp"
+#include <vector>
+
+dijkstra_engine_t dijkstra_engine = DIJKSTRA_SCAN;
+
+const char *dijkstra_engine_name[DIJKSTRA_ENGINE_COUNT] = { "scan", "heap", "radix", "delta" };
 
 // Functionality is explaned by function name
 int FindIndexOfUnvisitedNodeWithMinDistance(int nnode, int *distance, char *visited) {
@@ -14,8 +19,8 @@ int FindIndexOfUnvisitedNodeWithMinDistance(int nnode, int *distance, char *visi
     return min_nid;
 }
 
-void Dijkstra(Graph *graph, int src_nid) {
-    int *distance = graph->distance[src_nid];
+// O(V^2) per source: linear scan for the closest unvisited node
+static void DijkstraScan(Graph *graph, int src_nid, int *distance) {
     int tmp_distance[graph->nnode];
     char visited[graph->nnode];
 
@@ -43,13 +48,276 @@ void Dijkstra(Graph *graph, int src_nid) {
     }
 }
 
-void AllPairsDijkstra(Graph *graph) {
-    #if OMP
-    #pragma omp parallel for schedule(dynamic, 32)
-    #endif
-    for (int nid = 0; nid < graph->nnode; nid++) {
+// Indexed binary min-heap of node ids keyed by key[], supporting decrease-key
+typedef struct {
+    int size;
+    int *heap;      // node ids, heap ordered
+    int *pos;       // position of each node in heap, -1 if absent
+    int *key;
+} NodeHeap;
+
+static void HeapSwap(NodeHeap *h, int i, int j) {
+    int a = h->heap[i], b = h->heap[j];
+    h->heap[i] = b;
+    h->heap[j] = a;
+    h->pos[b] = i;
+    h->pos[a] = j;
+}
+
+static void HeapSiftUp(NodeHeap *h, int i) {
+    while (i > 0) {
+        int parent = (i - 1) / 2;
+        if (h->key[h->heap[parent]] <= h->key[h->heap[i]]) break;
+        HeapSwap(h, i, parent);
+        i = parent;
+    }
+}
+
+static void HeapSiftDown(NodeHeap *h, int i) {
+    while (true) {
+        int left = 2 * i + 1, right = left + 1, min = i;
+        if (left < h->size && h->key[h->heap[left]] < h->key[h->heap[min]]) min = left;
+        if (right < h->size && h->key[h->heap[right]] < h->key[h->heap[min]]) min = right;
+        if (min == i) break;
+        HeapSwap(h, i, min);
+        i = min;
+    }
+}
+
+// Insert nid, or move it up after its key decreased
+static void HeapPushOrDecrease(NodeHeap *h, int nid) {
+    if (h->pos[nid] < 0) {
+        h->heap[h->size] = nid;
+        h->pos[nid] = h->size++;
+    }
+    HeapSiftUp(h, h->pos[nid]);
+}
+
+static int HeapPop(NodeHeap *h) {
+    int nid = h->heap[0];
+    h->pos[nid] = -1;
+    h->size--;
+    if (h->size > 0) {
+        h->heap[0] = h->heap[h->size];
+        h->pos[h->heap[0]] = 0;
+        HeapSiftDown(h, 0);
+    }
+    return nid;
+}
+
+// O((V + E) log V) per source
+static void DijkstraHeap(Graph *graph, int src_nid, int *distance) {
+    int nnode = graph->nnode;
+    int *tmp_distance = (int *)malloc(nnode * sizeof(int));
+    NodeHeap h;
+    h.size = 0;
+    h.heap = (int *)malloc(nnode * sizeof(int));
+    h.pos = (int *)malloc(nnode * sizeof(int));
+    h.key = tmp_distance;
+
+    for (int nid = 0; nid < nnode; nid++) {
+        tmp_distance[nid] = IntMax;
+        distance[nid] = IntMax;
+        h.pos[nid] = -1;
+    }
+    tmp_distance[src_nid] = 0;
+    distance[src_nid] = 0;
+    HeapPushOrDecrease(&h, src_nid);
+
+    while (h.size > 0) {
+        int min_nid = HeapPop(&h);
+        for (int eid = graph->node[min_nid]; eid < graph->node[min_nid+1]; eid++) {
+            int neighbor_nid = graph->edge[eid];
+            if (tmp_distance[neighbor_nid] > graph->new_weight[eid] + tmp_distance[min_nid]) {
+                tmp_distance[neighbor_nid] = graph->new_weight[eid] + tmp_distance[min_nid];
+                distance[neighbor_nid] = graph->weight[eid] + distance[min_nid];
+                HeapPushOrDecrease(&h, neighbor_nid);
+            }
+        }
+    }
+
+    free(tmp_distance);
+    free(h.heap);
+    free(h.pos);
+}
+
+// Number of radix heap buckets: one for keys equal to the last popped key,
+// plus one per position of the highest bit in which a key differs from it
+#define RadixBuckets 33
+
+static inline int RadixBucket(unsigned key, unsigned last) {
+    return key == last ? 0 : 32 - __builtin_clz(key ^ last);
+}
+
+// Monotone radix heap over the reweighted (non-negative integer) distances.
+// Stale entries are left in place and skipped when popped.
+static void DijkstraRadix(Graph *graph, int src_nid, int *distance) {
+    int nnode = graph->nnode;
+    int *tmp_distance = (int *)malloc(nnode * sizeof(int));
+    char *visited = (char *)malloc(nnode * sizeof(char));
+    std::vector<std::pair<unsigned, int> > bucket[RadixBuckets];
+    unsigned last = 0;
+    int size = 0;
+
+    for (int nid = 0; nid < nnode; nid++) {
+        tmp_distance[nid] = IntMax;
+        distance[nid] = IntMax;
+        visited[nid] = 0;
+    }
+    tmp_distance[src_nid] = 0;
+    distance[src_nid] = 0;
+    bucket[0].push_back(std::make_pair(0u, src_nid));
+    size++;
+
+    while (size > 0) {
+        if (bucket[0].empty()) {
+            // Redistribute the first non-empty bucket around its minimum key
+            int b = 1;
+            while (bucket[b].empty()) b++;
+            unsigned new_last = bucket[b][0].first;
+            for (size_t i = 1; i < bucket[b].size(); i++)
+                if (bucket[b][i].first < new_last) new_last = bucket[b][i].first;
+            last = new_last;
+            for (size_t i = 0; i < bucket[b].size(); i++)
+                bucket[RadixBucket(bucket[b][i].first, last)].push_back(bucket[b][i]);
+            bucket[b].clear();
+        }
+        int min_nid = bucket[0].back().second;
+        unsigned key = bucket[0].back().first;
+        bucket[0].pop_back();
+        size--;
+        if (visited[min_nid] || key != (unsigned)tmp_distance[min_nid]) continue;
+
+        visited[min_nid] = 1;
+        for (int eid = graph->node[min_nid]; eid < graph->node[min_nid+1]; eid++) {
+            int neighbor_nid = graph->edge[eid];
+            if (tmp_distance[neighbor_nid] > graph->new_weight[eid] + tmp_distance[min_nid]) {
+                tmp_distance[neighbor_nid] = graph->new_weight[eid] + tmp_distance[min_nid];
+                distance[neighbor_nid] = graph->weight[eid] + distance[min_nid];
+                unsigned new_key = tmp_distance[neighbor_nid];
+                bucket[RadixBucket(new_key, last)].push_back(std::make_pair(new_key, neighbor_nid));
+                size++;
+            }
+        }
+    }
+
+    free(tmp_distance);
+    free(visited);
+}
+
+// Shortest distances from src_nid into distance[0..nnode)
+void Dijkstra(Graph *graph, int src_nid, int *distance) {
+    switch (dijkstra_engine) {
+        case DIJKSTRA_HEAP:
+            DijkstraHeap(graph, src_nid, distance);
+            break;
+        case DIJKSTRA_RADIX:
+            DijkstraRadix(graph, src_nid, distance);
+            break;
+        case DIJKSTRA_DELTA:
+            DeltaStepping(graph, src_nid, distance);
+            break;
+        default:
+            DijkstraScan(graph, src_nid, distance);
+    }
+}
+
+// Row of sink source nid in the original numbering, via scratch if the graph was reordered (-O)
+static void SinkRow(Graph *graph, int nid, int *row, int *scratch) {
+    int src_nid = graph->rank != NULL ? graph->rank[nid] : nid;
+    int *out = graph->rank != NULL ? scratch : row;
+    Dijkstra(graph, src_nid, out);
+    if (graph->rank != NULL)
+        RestoreRow(graph, scratch, row);
+}
+
+// Delta-stepping parallelises within each source, so sources run one after the other
+static void SerialSources(Graph *graph, RowSink *sink) {
+    if (display)
+        printf("Delta-stepping with bucket width %d\n", graph->delta);
+    int *row = sink != NULL ? (int *)malloc(graph->nnode * sizeof(int)) : NULL;
+    int *scratch = sink != NULL && graph->rank != NULL ? (int *)malloc(graph->nnode * sizeof(int)) : NULL;
+    int first = sink != NULL ? sink->first : 0;
+    int last = sink != NULL ? sink->last : graph->nnode;
+    for (int i = first; i < last; i++) {
+        int nid = sink != NULL ? SinkSource(sink, i) : i;
         if (display)
             printf("Dijkstra started for node %d\n", nid);
-        Dijkstra(graph, nid);
+        if (sink != NULL) {
+            SinkRow(graph, nid, row, scratch);
+            EmitRow(sink, nid, row);
+        } else
+            DeltaStepping(graph, nid, graph->distance[nid]);
+    }
+    free(row);
+    free(scratch);
+}
+
+// Rows of the sink's sources are computed into one scratch buffer per thread and handed to the sink,
+// so no nnode x nnode matrix is held
+static void StreamDijkstra(Graph *graph, RowSink *sink) {
+    #if OMP
+    #pragma omp parallel
+    #endif
+    {
+        START_LOCAL_ACTIVITY(DIJKSTRA);
+        int *row = (int *)malloc(graph->nnode * sizeof(int));
+        int *scratch = graph->rank != NULL ? (int *)malloc(graph->nnode * sizeof(int)) : NULL;
+        if (sink->ordered) {
+            #if OMP
+            #pragma omp for ordered schedule(dynamic, 1) nowait
+            #endif
+            for (int i = sink->first; i < sink->last; i++) {
+                int nid = SinkSource(sink, i);
+                if (display)
+                    printf("Dijkstra started for node %d\n", nid);
+                SinkRow(graph, nid, row, scratch);
+                #if OMP
+                #pragma omp ordered
+                #endif
+                EmitRow(sink, nid, row);
+            }
+        } else {
+            #if OMP
+            #pragma omp for schedule(dynamic, 32) nowait
+            #endif
+            for (int i = sink->first; i < sink->last; i++) {
+                int nid = SinkSource(sink, i);
+                if (display)
+                    printf("Dijkstra started for node %d\n", nid);
+                SinkRow(graph, nid, row, scratch);
+                EmitRow(sink, nid, row);
+            }
+        }
+        free(row);
+        free(scratch);
+        FINISH_LOCAL_ACTIVITY(DIJKSTRA);
+    }
+}
+
+// Fill graph->distance, or stream the rows to sink when it is given
+void AllPairsDijkstra(Graph *graph, RowSink *sink) {
+    if (dijkstra_engine == DIJKSTRA_DELTA) {
+        SerialSources(graph, sink);
+        return;
+    }
+    if (sink != NULL) {
+        StreamDijkstra(graph, sink);
+        return;
+    }
+    #if OMP
+    #pragma omp parallel
+    #endif
+    {
+        START_LOCAL_ACTIVITY(DIJKSTRA);
+        #if OMP
+        #pragma omp for schedule(dynamic, 32) nowait
+        #endif
+        for (int nid = 0; nid < graph->nnode; nid++) {
+            if (display)
+                printf("Dijkstra started for node %d\n", nid);
+            Dijkstra(graph, nid, graph->distance[nid]);
+        }
+        FINISH_LOCAL_ACTIVITY(DIJKSTRA);
     }
 }
@@ -0,0 +1,120 @@
+#include "johnson.hpp"
+#include <algorithm>
+
+apsp_algorithm_t apsp_algorithm = APSP_JOHNSON;
+
+const char *apsp_algorithm_name[APSP_ALGORITHM_COUNT] = { "johnson", "floyd", "auto" };
+
+// Edge density nedge / nnode^2 from which Floyd-Warshall beats Johnson with each
+// Dijkstra engine, measured with johnson_seq -I on 1024 and 2048 node random DAGs.
+// The scan engine is O(V^3) like Floyd-Warshall, with a slower inner loop.
+// Delta-stepping does the work of a binary heap per source and uses its threshold.
+static const double floyd_density[DIJKSTRA_ENGINE_COUNT] = { 0.0, 0.005, 0.01, 0.005 };
+
+// Side of the square tiles that are updated together, so that the three tiles
+// involved (64 x 64 ints each) stay in the L2 cache
+#define FloydBlock 64
+
+// Unreachable in the working matrix.  Reweighted edges are non-negative, so the sum of
+// two entries never overflows and never drops below this value once it is reached.
+#define FloydInf (IntMax / 2)
+
+apsp_algorithm_t ChooseAlgorithm(Graph *graph) {
+    if (apsp_algorithm != APSP_AUTO)
+        return apsp_algorithm;
+    double nnode = graph->nnode;
+    if (nnode == 0)
+        return APSP_JOHNSON;
+    return graph->nedge >= floyd_density[dijkstra_engine] * nnode * nnode ? APSP_FLOYD : APSP_JOHNSON;
+}
+
+// Relax tile (ib, jb) through the intermediate nodes of tile kb
+static void RelaxBlock(int *d, int n, int ib, int jb, int kb) {
+    int iend = std::min(ib + FloydBlock, n);
+    int jend = std::min(jb + FloydBlock, n);
+    int kend = std::min(kb + FloydBlock, n);
+    for (int k = kb; k < kend; k++) {
+        const int *dk = d + (size_t)k * n;
+        for (int i = ib; i < iend; i++) {
+            int *di = d + (size_t)i * n;
+            int dik = di[k];
+            if (dik >= FloydInf) continue;
+            for (int j = jb; j < jend; j++) {
+                int sum = dik + dk[j];
+                di[j] = sum < di[j] ? sum : di[j];
+            }
+        }
+    }
+}
+
+// All distances with a cache-blocked Floyd-Warshall over the reweighted edges.
+// graph->distance must be one contiguous matrix; BellmanFord must have filled new_weight.
+void FloydWarshall(Graph *graph) {
+    int n = graph->nnode;
+    if (n == 0)
+        return;
+    int *d = graph->distance[0];
+    int nblock = (n + FloydBlock - 1) / FloydBlock;
+
+    #if OMP
+    #pragma omp parallel for schedule(static)
+    #endif
+    for (int u = 0; u < n; u++) {
+        int *du = d + (size_t)u * n;
+        for (int v = 0; v < n; v++)
+            du[v] = FloydInf;
+        du[u] = 0;
+        // Parallel edges keep the cheapest weight
+        for (int eid = graph->node[u]; eid < graph->node[u+1]; eid++)
+            du[graph->edge[eid]] = std::min(du[graph->edge[eid]], graph->new_weight[eid]);
+    }
+
+    // Per round: the diagonal tile, then the tiles in its row and column, then the rest
+    #if OMP
+    #pragma omp parallel
+    #endif
+    {
+        START_LOCAL_ACTIVITY(FLOYD_WARSHALL);
+        for (int b = 0; b < nblock; b++) {
+            int kb = b * FloydBlock;
+            #if OMP
+            #pragma omp single
+            #endif
+            RelaxBlock(d, n, kb, kb, kb);
+
+            #if OMP
+            #pragma omp for schedule(dynamic, 1)
+            #endif
+            for (int t = 0; t < 2 * nblock; t++) {
+                int other = (t % nblock) * FloydBlock;
+                if (other == kb) continue;
+                if (t < nblock)
+                    RelaxBlock(d, n, kb, other, kb);
+                else
+                    RelaxBlock(d, n, other, kb, kb);
+            }
+
+            #if OMP
+            #pragma omp for schedule(dynamic, 1)
+            #endif
+            for (int t = 0; t < nblock * nblock; t++) {
+                int ib = (t / nblock) * FloydBlock;
+                int jb = (t % nblock) * FloydBlock;
+                if (ib == kb || jb == kb) continue;
+                RelaxBlock(d, n, ib, jb, kb);
+            }
+        }
+
+        // Undo the reweighting
+        #if OMP
+        #pragma omp for schedule(static) nowait
+        #endif
+        for (int u = 0; u < n; u++) {
+            int *du = d + (size_t)u * n;
+            int pu = graph->potential[u];
+            for (int v = 0; v < n; v++)
+                du[v] = du[v] >= FloydInf ? IntMax : du[v] - pu + graph->potential[v];
+        }
+        FINISH_LOCAL_ACTIVITY(FLOYD_WARSHALL);
+    }
+}
@@ -1,7 +1,16 @@
 # Helper script to generate random graphs
 
 import argparse
+import math
+import multiprocessing
+import os
 import random
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 DEFAULT_NNODE = 10
 DEFAULT_NEDGE = 20
@@ -9,8 +18,49 @@ DEFAULT_SEED = 1
 
 GRAPH_DIRECTORY = "./graphs"
 
+# Binary CSR graph file, read in place by LoadGraph (see johnson.hpp)
+BINARY_MAGIC = b"JCSR"
+BINARY_VERSION = 1
+BINARY_SUFFIX = ".csr"
+
+# Binary distance matrix written by the solvers' -B option (see johnson.hpp)
+DISTANCE_MAGIC = b"JDST"
+DISTANCE_VERSION = 1
+DISTANCE_SUFFIX = ".dist"
+
+# Rows of a source range (--sources with -B): same layout with the first source in place of
+# the reserved field
+DISTANCE_BLOCK_MAGIC = b"JDSB"
+
+# Edge update batches applied by the solvers' -U option (see update.cpp)
+UPDATE_SUFFIX = ".upd"
+
+# Graph families besides the random DAG of generate_graph, and their weight kinds:
+# "nonneg" weights are in [1, 10]; "mixed" weights are shifted by node potentials in
+# [0, MIXED_SHIFT] as w + p(u) - p(v), so they can be negative but every cycle keeps its
+# non-negative base weight
+FAMILIES = ("grid", "powerlaw", "geometric")
+WEIGHT_KINDS = ("nonneg", "mixed")
+MIXED_SHIFT = 5
+
+# Source nodes per random stream.  Each block of SEED_NODES sources draws from a generator
+# seeded by the block index, so the output is the same however the blocks are split into
+# work chunks.  Chunks hold at least MIN_CHUNK_BLOCKS blocks, and there are up to
+# CHUNKS_PER_WORKER of them per worker so that uneven chunks balance out.
+SEED_NODES = 1 << 10
+MIN_CHUNK_BLOCKS = 2
+CHUNKS_PER_WORKER = 4
+
+# Edges formatted per write() call, and size of the output file buffer
+WRITE_BLOCK = 1 << 16
+WRITE_BUFFER = 1 << 22
+
 # generate directed acyclic graph with both positive and negative weights
-def generate_graph(nnode, nedge, seed):
+def generate_graph(nnode, nedge, seed, stream=True):
+    if stream and np is not None:
+        generate_graph_stream(nnode, nedge, seed)
+        return
+
     all_edges = []
     for i in range(nnode):
         for j in range(i+1, nnode):
@@ -25,12 +75,324 @@ def generate_graph(nnode, nedge, seed):
         res.append((e[1], e[0], weight))
 
     gname = graphName(nnode, nedge, seed)
-    f = open(gname, "w")
+    tmp = temporaryName(gname)
+    f = open(tmp, "w")
     f.write("{}\n".format(nnode))
     f.write("{}\n".format(nedge))
     for r in sorted(res):
       f.write("{} {} {}\n".format(r[0], r[1], r[2]))
     f.close()
+    os.replace(tmp, gname)
+
+# Same graph as the list version above, byte for byte, without materializing
+# all nnode*(nnode-1)/2 candidate pairs.
+# random.sample only needs len() and indexing, so sampling range() draws the
+# exact same sequence of pair indices; those are then decoded to (i, j) in NumPy.
+def generate_graph_stream(nnode, nedge, seed):
+    random.seed(seed)
+    npair = nnode * (nnode - 1) // 2
+    pidx = np.array(random.sample(range(npair), nedge), dtype=np.int64)
+    randint = random.randint
+    weights = np.array([randint(-10, 10) for _ in range(nedge)], dtype=np.int64)
+
+    # pair index of (i, i+1) is i*(2*nnode - i - 1)/2 in the list version
+    rows = np.arange(nnode, dtype=np.int64)
+    offsets = rows * (2 * nnode - rows - 1) // 2
+    i = np.searchsorted(offsets, pidx, side="right") - 1
+    j = pidx - offsets[i] + i + 1
+    del pidx
+
+    # edges point from j to i; (src, dst) pairs are distinct so this is sorted(res)
+    order = np.lexsort((i, j))
+    res = np.empty((nedge, 3), dtype=np.int64)
+    res[:, 0] = j[order]
+    res[:, 1] = i[order]
+    res[:, 2] = weights[order]
+    del i, j, weights, order
+
+    gname = graphName(nnode, nedge, seed)
+    writeEdges(gname, nnode, nedge, res)
+    writeBinaryGraph(binaryName(gname), nnode, res[:, 0], res[:, 1], res[:, 2])
+
+# Graph files are written under this name and renamed into place when complete,
+# so an interrupted run never leaves a partial file under the real name
+def temporaryName(fname):
+    return "{}.tmp{}".format(fname, os.getpid())
+
+# Write the edge list in large blocks instead of one f.write per line
+def writeEdges(gname, nnode, nedge, res):
+    tmp = temporaryName(gname)
+    with open(tmp, "w", buffering=WRITE_BUFFER) as f:
+        f.write("{}\n{}\n".format(nnode, nedge))
+        for start in range(0, len(res), WRITE_BLOCK):
+            block = res[start:start+WRITE_BLOCK]
+            f.write(("%d %d %d\n" * len(block)) % tuple(block.ravel().tolist()))
+    os.replace(tmp, gname)
+
+# Write CSR arrays for edges sorted by source id
+def writeBinaryGraph(bname, nnode, src, dst, weight):
+    nedge = len(src)
+    node = np.zeros(nnode + 1, dtype="<i4")
+    np.cumsum(np.bincount(src, minlength=nnode), out=node[1:])
+    header = np.frombuffer(BINARY_MAGIC, dtype="<i4")
+    tmp = temporaryName(bname)
+    with open(tmp, "wb") as f:
+        f.write(header.tobytes())
+        f.write(np.array([BINARY_VERSION, nnode, nedge], dtype="<i4").tobytes())
+        f.write(node.tobytes())
+        f.write(np.asarray(dst, dtype="<i4").tobytes())
+        f.write(np.asarray(weight, dtype="<i4").tobytes())
+    os.replace(tmp, bname)
+
+# Parse a text edge list into (nnode, nedge, [src, dst, weight] rows)
+def readGraph(gname):
+    with open(gname, "rb") as f:
+        values = np.array(f.read().split(), dtype=np.int64)
+    nnode, nedge = int(values[0]), int(values[1])
+    res = values[2:2 + 3 * nedge].reshape(nedge, 3)
+    return nnode, nedge, res
+
+# Read a binary graph, returning (nnode, nedge, node, edge, weight) views of the file
+def readBinaryGraph(bname):
+    data = np.memmap(bname, dtype="<i4", mode="r")
+    if data[:1].tobytes() != BINARY_MAGIC or data[1] != BINARY_VERSION:
+        raise ValueError("{} is not a binary graph file".format(bname))
+    nnode, nedge = int(data[2]), int(data[3])
+    node = data[4:5 + nnode]
+    edge = data[5 + nnode:5 + nnode + nedge]
+    weight = data[5 + nnode + nedge:5 + nnode + 2 * nedge]
+    return nnode, nedge, node, edge, weight
+
+# Map a -B distance file as an nnode x nnode int32 matrix
+def readDistance(dname):
+    data = np.memmap(dname, dtype="<i4", mode="r")
+    if len(data) < 4 or data[:1].tobytes() != DISTANCE_MAGIC or data[1] != DISTANCE_VERSION:
+        raise ValueError("{} is not a distance file".format(dname))
+    nnode = int(data[2])
+    if len(data) != 4 + nnode * nnode:
+        raise ValueError("{} is truncated".format(dname))
+    return data[4:].reshape(nnode, nnode)
+
+# Map a distance block file, returning (nnode, first source, rows x nnode int32 matrix)
+def readDistanceBlock(dname):
+    data = np.memmap(dname, dtype="<i4", mode="r")
+    if len(data) < 4 or data[:1].tobytes() not in (DISTANCE_BLOCK_MAGIC, DISTANCE_MAGIC) or data[1] != DISTANCE_VERSION:
+        raise ValueError("{} is not a distance block file".format(dname))
+    nnode, first = int(data[2]), int(data[3])
+    if nnode == 0 or (len(data) - 4) % nnode != 0:
+        raise ValueError("{} is truncated".format(dname))
+    return nnode, first, data[4:].reshape(-1, nnode)
+
+# Write a distance matrix in the -B layout
+def writeDistance(dname, distance):
+    with open(dname, "wb") as f:
+        f.write(DISTANCE_MAGIC)
+        f.write(np.array([DISTANCE_VERSION, len(distance), 0], dtype="<i4").tobytes())
+        f.write(np.ascontiguousarray(distance, dtype="<i4").tobytes())
+
+# Convert an existing text graph into the binary format next to it
+def convertGraph(gname):
+    nnode, nedge, res = readGraph(gname)
+    order = np.argsort(res[:, 0], kind="stable")
+    res = res[order]
+    bname = binaryName(gname)
+    writeBinaryGraph(bname, nnode, res[:, 0], res[:, 1], res[:, 2])
+    return bname
+
+# Per-process state of the family chunk workers, set up once by initFamily
+familyState = {}
+
+def initFamily(family, nnode, nedge, seed, weights):
+    familyState.clear()
+    familyState.update(family=family, nnode=nnode, nedge=nedge, seed=seed, weights=weights)
+    if weights == "mixed":
+        familyState["potential"] = np.random.default_rng([seed, 1]).integers(0, MIXED_SHIFT + 1, nnode)
+    if family == "grid":
+        familyState["width"] = max(1, int(math.ceil(math.sqrt(nnode))))
+    elif family == "geometric":
+        # Expected number of node pairs closer than radius in the unit square is nedge/2
+        radius = math.sqrt(nedge / (math.pi * nnode * max(nnode - 1, 1)))
+        cells = max(1, int(1.0 / radius))
+        points = np.random.default_rng([seed, 0]).random((nnode, 2))
+        cell = np.minimum((points * cells).astype(np.int64), cells - 1)
+        cellId = cell[:, 0] * cells + cell[:, 1]
+        order = np.argsort(cellId, kind="stable")
+        start = np.zeros(cells * cells + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cellId, minlength=cells * cells), out=start[1:])
+        familyState.update(radius=radius, cells=cells, points=points, cell=cell, order=order, start=start)
+
+# Road-like grid: links to the right and lower neighbours, each kept so about nedge/2 links remain
+def gridPairs(rng, lo, hi):
+    nnode, width = familyState["nnode"], familyState["width"]
+    links = (nnode - nnode // width) + max(nnode - width, 0)
+    keep = min(1.0, familyState["nedge"] / 2.0 / max(links, 1))
+    v = np.arange(lo, hi, dtype=np.int64)
+    right = v[((v + 1) % width != 0) & (v + 1 < nnode)]
+    down = v[v + width < nnode]
+    src = np.concatenate((right, down))
+    dst = np.concatenate((right + 1, down + width))
+    mask = rng.random(len(src)) < keep
+    src, dst = src[mask], dst[mask]
+    return src, dst, rng.integers(1, 11, len(src))
+
+# Preferential attachment: node v links to k older nodes, where node u < v is picked with
+# probability proportional to its expected degree at time v, which grows as sqrt(v / u).
+# Picks are independent, so chunks need no shared degree counts.
+def powerlawPairs(rng, lo, hi):
+    k = max(1, int(round(familyState["nedge"] / (2.0 * familyState["nnode"]))))
+    v = np.repeat(np.arange(max(lo, 1), hi, dtype=np.int64), k)
+    u = np.minimum((v * rng.random(len(v)) ** 2).astype(np.int64), v - 1)
+    return v, u, rng.integers(1, 11, len(v))
+
+# Random geometric: nodes closer than the radius are linked, weight grows with distance
+def geometricPairs(rng, lo, hi):
+    st = familyState
+    cells, points, cell, order, start = st["cells"], st["points"], st["cell"], st["order"], st["start"]
+    v = np.arange(lo, hi, dtype=np.int64)
+    srcs, dsts, dists = [], [], []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            cx, cy = cell[v, 0] + dx, cell[v, 1] + dy
+            valid = (cx >= 0) & (cx < cells) & (cy >= 0) & (cy < cells)
+            nodes = v[valid]
+            c = cx[valid] * cells + cy[valid]
+            counts = start[c + 1] - start[c]
+            total = int(counts.sum())
+            if total == 0:
+                continue
+            first = np.repeat(start[c] - (np.cumsum(counts) - counts), counts)
+            cand = order[first + np.arange(total)]
+            src = np.repeat(nodes, counts)
+            mask = cand > src
+            src, cand = src[mask], cand[mask]
+            d = np.sqrt(((points[src] - points[cand]) ** 2).sum(axis=1))
+            mask = d <= st["radius"]
+            srcs.append(src[mask])
+            dsts.append(cand[mask])
+            dists.append(d[mask])
+    if len(srcs) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+    d = np.concatenate(dists)
+    weight = 1 + np.minimum((9 * d / st["radius"]).astype(np.int64), 9)
+    return np.concatenate(srcs), np.concatenate(dsts), weight
+
+# Edges of one seed block of source nodes, in both directions of every generated link
+def familyBlock(block):
+    st = familyState
+    rng = np.random.default_rng([st["seed"], FAMILIES.index(st["family"]) + 2, block])
+    lo = block * SEED_NODES
+    hi = min(lo + SEED_NODES, st["nnode"])
+    pairs = {"grid": gridPairs, "powerlaw": powerlawPairs, "geometric": geometricPairs}[st["family"]]
+    u, v, w = pairs(rng, lo, hi)
+    src = np.concatenate((u, v))
+    dst = np.concatenate((v, u))
+    weight = np.concatenate((w, w))
+    if st["weights"] == "mixed":
+        p = st["potential"]
+        weight = weight + p[src] - p[dst]
+    return src.astype(np.int32), dst.astype(np.int32), weight.astype(np.int32)
+
+# Edges of the seed blocks [first, last) of one work chunk
+def familyChunk(blocks):
+    parts = [familyBlock(b) for b in range(*blocks)]
+    return tuple(np.concatenate([p[i] for p in parts]) for i in range(3))
+
+# Generate a graph family in parallel chunks and write it sorted by (src, dst) with
+# duplicate links dropped.  nedge is a target; the file header has the actual count.
+def generate_family(family, nnode, nedge, seed, weights="mixed", workers=None):
+    nblock = max(1, (nnode + SEED_NODES - 1) // SEED_NODES)
+    args = (family, nnode, nedge, seed, weights)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    size = max(MIN_CHUNK_BLOCKS, -(-nblock // (workers * CHUNKS_PER_WORKER)))
+    chunks = [(b, min(b + size, nblock)) for b in range(0, nblock, size)]
+    workers = min(workers, len(chunks))
+    if workers > 1:
+        with multiprocessing.Pool(workers, initializer=initFamily, initargs=args) as pool:
+            parts = pool.map(familyChunk, chunks)
+    else:
+        initFamily(*args)
+        parts = [familyChunk(c) for c in chunks]
+        familyState.clear()
+
+    src = np.concatenate([p[0] for p in parts]).astype(np.int64)
+    dst = np.concatenate([p[1] for p in parts]).astype(np.int64)
+    weight = np.concatenate([p[2] for p in parts]).astype(np.int64)
+    del parts
+    order = np.lexsort((dst, src))
+    src, dst, weight = src[order], dst[order], weight[order]
+    keep = np.ones(len(src), dtype=bool)
+    keep[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+    res = np.empty((int(keep.sum()), 3), dtype=np.int64)
+    res[:, 0], res[:, 1], res[:, 2] = src[keep], dst[keep], weight[keep]
+    del src, dst, weight, order, keep
+
+    gname = familyName(family, nnode, nedge, seed, weights)
+    writeEdges(gname, nnode, len(res), res)
+    writeBinaryGraph(binaryName(gname), nnode, res[:, 0], res[:, 1], res[:, 2])
+    return gname
+
+def familyName(family, nnode, nedge, seed, weights):
+    return "{}/{}-{}-n{}-e{}-s{}.txt".format(GRAPH_DIRECTORY, family, weights, nnode, nedge, seed)
+
+# Random batch of edge inserts, deletes and weight changes for a graph.
+# Inserted edges point from a larger to a smaller node id like generated ones, so no cycle appears.
+def generate_updates(gname, count, seed):
+    nnode, nedge, res = readGraph(gname)
+    rng = random.Random(seed)
+    edges = {(int(r[0]), int(r[1])): int(r[2]) for r in res}
+    changed = set()
+    lines = []
+    while len(lines) < count:
+        op = rng.choice("+-=")
+        if op == "+":
+            u, v = rng.sample(range(nnode), 2)
+            if u < v:
+                u, v = v, u
+            if (u, v) in edges or (u, v) in changed:
+                continue
+            lines.append("+ {} {} {}\n".format(u, v, rng.randint(-10, 10)))
+        else:
+            if len(edges) == 0:
+                continue
+            u, v = rng.choice(list(edges))
+            del edges[(u, v)]
+            if op == "-":
+                lines.append("- {} {}\n".format(u, v))
+            else:
+                lines.append("= {} {} {}\n".format(u, v, rng.randint(-10, 10)))
+        changed.add((u, v))
+    uname = updateName(gname, count, seed)
+    with open(uname, "w") as f:
+        f.writelines(lines)
+    return uname
+
+# Write the graph obtained by applying an update batch, for checking against a full run
+def applyUpdates(gname, uname, outname):
+    nnode, nedge, res = readGraph(gname)
+    edges = {(int(r[0]), int(r[1])): int(r[2]) for r in res}
+    with open(uname, "r") as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 0 or fields[0].startswith("#"):
+                continue
+            key = (int(fields[1]), int(fields[2]))
+            if fields[0] == "-":
+                del edges[key]
+            else:
+                edges[key] = int(fields[3])
+    res = np.array([(u, v, w) for (u, v), w in sorted(edges.items())], dtype=np.int64).reshape(-1, 3)
+    writeEdges(outname, nnode, len(res), res)
+    return outname
+
+def updateName(gname, count, seed):
+    root, _ = os.path.splitext(gname)
+    return "{}-u{}-s{}{}".format(root, count, seed, UPDATE_SUFFIX)
+
+def binaryName(gname):
+    root, _ = os.path.splitext(gname)
+    return root + BINARY_SUFFIX
 
 # generate graph with all positive weights
 # def generate_graph(nnode, nedge, seed):
@@ -70,11 +432,44 @@ if __name__ == "__main__":
     parser.add_argument("-n", "--nnode", type=int, help="Number of nodes")
     parser.add_argument("-e", "--nedge", type=int, help="Number of edges")
     parser.add_argument("-s", "--seed", type=int, help="Random seed")
+    parser.add_argument("-L", "--legacy", action="store_true",
+                    help="Use the list-based generator (O(nnode^2) memory)")
+    parser.add_argument("-c", "--convert", type=str, nargs="+",
+                    help="Convert existing text graphs to the binary format")
+    parser.add_argument("-f", "--family", type=str, choices=FAMILIES,
+                    help="Generate a graph family instead of a random DAG (-e is then a target)")
+    parser.add_argument("-w", "--weights", type=str, choices=WEIGHT_KINDS, default="mixed",
+                    help="Weights of a graph family (default mixed)")
+    parser.add_argument("-j", "--jobs", type=int,
+                    help="Worker processes generating a graph family (default: number of processors)")
+    parser.add_argument("-u", "--updates", type=int,
+                    help="Generate a batch of this many edge updates for the graph instead")
+    parser.add_argument("-a", "--apply", type=str, nargs=2, metavar=("UFILE", "OUTFILE"),
+                    help="Write the graph with the updates in UFILE applied to OUTFILE")
 
     args = parser.parse_args()
 
+    if args.convert is not None:
+        for gname in args.convert:
+            print("{} -> {}".format(gname, convertGraph(gname)))
+        sys.exit(0)
+
     nnode = args.nnode or DEFAULT_NNODE
     nedge = args.nedge or DEFAULT_NEDGE
     seed = args.seed or DEFAULT_SEED
 
-    generate_graph(nnode, nedge, seed)
+    if args.family is not None:
+        print(generate_family(args.family, nnode, nedge, seed, args.weights, args.jobs))
+        sys.exit(0)
+
+    gname = graphName(nnode, nedge, seed)
+    if args.updates is not None or args.apply is not None:
+        if not os.path.exists(gname):
+            generate_graph(nnode, nedge, seed, stream=not args.legacy)
+        if args.updates is not None:
+            print(generate_updates(gname, args.updates, seed))
+        if args.apply is not None:
+            print(applyUpdates(gname, args.apply[0], args.apply[1]))
+        sys.exit(0)
+
+    generate_graph(nnode, nedge, seed, stream=not args.legacy)
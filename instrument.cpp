@@ -15,15 +15,20 @@
 #define MAX_THREAD 64
 
 /* Instrument different sections of program */
-static const char *activity_name[ACTIVITY_COUNT] = { "load_graph", "print_graph", "bellman_ford", "dijkstra", "johnson", "overhead"};
+static const char *activity_name[ACTIVITY_COUNT] = { "load_graph", "print_graph", "bellman_ford", "dijkstra", "floyd_warshall", "johnson", "update_graph", "reorder_graph", "overhead"};
+
+static const char *counter_name[COUNTER_COUNT] = { "bellman_ford_passes", "update_rows" };
 
 static bool tracking = false;
 static double global_start_time = 0.0;
 
 static activity_t current_activity = ACTIVITY_OVERHEAD;
 static double current_start_time = 0.0;
+static double local_start_time[MAX_THREAD];
 static double accum[MAX_THREAD][ACTIVITY_COUNT];
 static double global_accum[ACTIVITY_COUNT];
+static long counter[COUNTER_COUNT];
+static bool counter_set[COUNTER_COUNT];
 
 void track_activity(bool enable) {
     tracking = enable;
@@ -31,13 +36,47 @@ void track_activity(bool enable) {
     current_start_time = global_start_time;
     memset(accum, 0, ACTIVITY_COUNT * MAX_THREAD * sizeof(double));
     memset(global_accum, 0, ACTIVITY_COUNT * sizeof(double));
+    memset(counter, 0, COUNTER_COUNT * sizeof(long));
+    memset(counter_set, 0, COUNTER_COUNT * sizeof(bool));
     current_activity = ACTIVITY_OVERHEAD;
 }
 
+void record_counter(counter_t c, long value) {
+    if (!tracking) return;
+    counter[c] = value;
+    counter_set[c] = true;
+}
+
+static int thread_id() {
+    #if OMP
+    int tid = omp_get_thread_num();
+    #else
+    int tid = 0;
+    #endif
+    return tid < MAX_THREAD ? tid : -1;
+}
+
 void start_activity(activity_t a) {
     if (!tracking) return;
     current_start_time = currentSeconds();
     current_activity = a;
+    for (int t = 0; t < MAX_THREAD; t++)
+        local_start_time[t] = current_start_time;
+}
+
+void start_local_activity(activity_t a) {
+    if (!tracking) return;
+    int tid = thread_id();
+    if (tid >= 0)
+        local_start_time[tid] = currentSeconds();
+}
+
+// Time this thread spent on the activity since START_ACTIVITY or its START_LOCAL_ACTIVITY
+void finish_local_activity(activity_t a) {
+    if (!tracking) return;
+    int tid = thread_id();
+    if (tid >= 0)
+        accum[tid][a] += currentSeconds() - local_start_time[tid];
 }
 
 void finish_activity(activity_t a) {
@@ -68,4 +107,15 @@ void show_activity(FILE *f, bool enable) {
     double upct = unknown / elapsed * 100.0;
     fprintf(f, "    %8.2f ms    %5.1f %%    unknown\n", ums, upct);
     fprintf(f, "    %8.2f ms    %5.1f %%    elapsed\n", (elapsed * 1000.0), 100.0);
+    // Busy time of each thread, as a percentage of the activity's global time
+    for (a = 0; a < (int) ACTIVITY_COUNT; a++)
+        for (int t = 0; t < MAX_THREAD; t++) {
+            if (accum[t][a] == 0.0) continue;
+            double pct = global_accum[a] > 0.0 ? accum[t][a] / global_accum[a] * 100.0 : 0.0;
+            fprintf(f, "    %8.2f ms    %5.1f %%    %s@%d\n", accum[t][a] * 1000.0, pct, activity_name[a], t);
+        }
+    for (int c = 0; c < (int) COUNTER_COUNT; c++) {
+        if (!counter_set[c]) continue;
+        fprintf(f, "    %8ld                 %s\n", counter[c], counter_name[c]);
+    }
 }
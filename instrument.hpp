@@ -19,29 +19,42 @@ With OMP:
   The call to START_ACTIVITY should take occur before the parallel activity begins
   The call to FINISH_LOCAL_ACTIVITY should occur before the global synchronization point (if it exists)
   and the call to FINISH_ACTIVITY should occur after the parallel activity ends
+An activity made of several parallel regions calls START_LOCAL_ACTIVITY(a) at the start of each
+region, so every thread only accumulates the time it spent inside the regions.
+Per-thread times are shown as lines for activity "a@thread".
 */
 
 /* Categories of activities */
 
-typedef enum { LOAD_GRAPH, PRINT_GRAPH, BELLMAN_FORD, DIJKSTRA, JOHNSON_BOOST, ACTIVITY_OVERHEAD, ACTIVITY_COUNT } activity_t;
+typedef enum { LOAD_GRAPH, PRINT_GRAPH, BELLMAN_FORD, DIJKSTRA, FLOYD_WARSHALL, JOHNSON_BOOST, UPDATE_GRAPH, REORDER_GRAPH, ACTIVITY_OVERHEAD, ACTIVITY_COUNT } activity_t;
+
+/* Counters reported alongside the activity times */
+
+typedef enum { BELLMAN_FORD_PASSES, UPDATE_ROWS, COUNTER_COUNT } counter_t;
 
 void track_activity(bool enable);
 void start_activity(activity_t a);
+void start_local_activity(activity_t a);
 void finish_local_activity(activity_t a);
 void finish_activity(activity_t a);
 void show_activity(FILE *f, bool enable);
+void record_counter(counter_t c, long value);
 
 #if TRACK
 #define START_ACTIVITY(a) start_activity(a)
+#define START_LOCAL_ACTIVITY(a) start_local_activity(a)
 #define FINISH_LOCAL_ACTIVITY(a) finish_local_activity(a)
 #define FINISH_ACTIVITY(a) finish_activity(a)
 #define SHOW_ACTIVITY(f,e) show_activity(f,e)
+#define RECORD_COUNTER(c,v) record_counter(c,v)
 #else
 #define TRACK_ACTIVITY(e)  /* Optimized out */
 #define START_ACTIVITY(a)   /* Optimized out */
+#define START_LOCAL_ACTIVITY(a)  /* Optimized out */
 #define FINISH_LOCAL_ACTIVITY(a)  /* Optimized out */
 #define FINISH_ACTIVITY(a)  /* Optimized out */
 #define SHOW_ACTIVITY(f,e)  /* Optimized out */
+#define RECORD_COUNTER(c,v)  /* Optimized out */
 #endif
 
 #define INSTRUMENT_H
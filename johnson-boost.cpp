@@ -8,10 +8,10 @@
 int main(int argc, char *argv[]){
   int c;
   FILE *gfile = NULL;
-  bool instrument = false;
   bool doPrint = false;
+  char *distance_fname = NULL;
   // parse command line arguments
-  while ((c = getopt(argc, argv, "g:IP")) != -1) {
+  while ((c = getopt(argc, argv, "g:IPB:")) != -1) {
     switch(c) {
       case 'g':
         gfile = fopen(optarg, "r");
@@ -19,11 +19,14 @@ int main(int argc, char *argv[]){
           printf("Couldn't open graph file %s\n", optarg);
         break;
       case 'I':
-        instrument = true;
+        // accepted for compatibility with the other solvers; nothing is instrumented
         break;
       case 'P':
         doPrint = true;
         break;
+      case 'B':
+        distance_fname = optarg;
+        break;
       default:
       printf("Unknown option '%c'\n", c);
     }
@@ -122,6 +125,23 @@ int main(int argc, char *argv[]){
     // FINISH_ACTIVITY(PRINT_GRAPH);
   }
 
+  if (distance_fname != NULL) {
+    // header, then all rows with one bulk write
+    int header[DistanceHeaderInts] = { DistanceMagic, DistanceVersion, V, 0 };
+    FILE *dfile = fopen(distance_fname, "wb");
+    if (dfile == NULL) {
+      printf("Couldn't open distance file %s\n", distance_fname);
+      return -1;
+    }
+    size_t cells = (size_t)V * V;
+    bool ok = fwrite(header, sizeof(int), DistanceHeaderInts, dfile) == DistanceHeaderInts
+      && fwrite(DD, sizeof(int), cells, dfile) == cells;
+    if (fclose(dfile) != 0 || !ok) {
+      printf("Couldn't write distance file %s\n", distance_fname);
+      return -1;
+    }
+  }
+
   // SHOW_ACTIVITY(stderr, instrument);
 
   return 0;
@@ -10,3 +10,8 @@
 #include <string>
 
 #define MAXLINELEN 1024
+
+// Binary distance matrix (-B), same layout as in johnson.hpp
+#define DistanceMagic 0x5453444A
+#define DistanceVersion 1
+#define DistanceHeaderInts 4
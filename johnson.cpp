@@ -1,100 +1,516 @@
 #include "johnson.hpp"
-#include <iomanip>
+#include <string.h>
+#include <limits.h>
+#include <vector>
+#include <getopt.h>
 
 char display;
 
+// Default size of the query server's row cache in MB
+#define DefaultCacheMB 256
+
+// Only the command line programs have a main, not the shared library (capi.cpp)
+#ifndef JOHNSON_LIBRARY
 static void Usage(char *name) {
     char use_string[] = "-g GFILE [-v]";
     printf("Usage: %s %s\n", name, use_string);
     printf("   -h        Print this message\n");
-    printf("   -g GFILE  Graph file\n");
+    printf("   -g GFILE  Graph file (text edge list or binary .csr)\n");
     printf("   -v        Operate in verbose mode\n");
+    printf("   -P        Print distance matrix as text\n");
+    printf("   -B DFILE  Write distance matrix in binary to DFILE\n");
+    printf("   -S        Stream rows to the -B file or -P output instead of keeping the matrix;\n");
+    printf("             with neither, print summary statistics of all distances\n");
+    printf("   --sources A:B     Compute only the rows of sources A..B-1 (streams; -B writes a row block)\n");
+    printf("   --sources S1,S2,...  Compute only the rows of the listed sources, in order (-P or summary)\n");
+    printf("   --save-potentials PFILE  Only run Bellman-Ford and write its potentials to PFILE\n");
+    printf("   --potentials PFILE       Use the potentials in PFILE instead of running Bellman-Ford\n");
+    printf("   -U UFILE  Apply the edge updates in UFILE after computing distances (repeatable)\n");
+    printf("   -Q SOCK   Serve distance queries on Unix socket SOCK until shut down (see query.py)\n");
+    printf("   -M MB     Memory for the query server's row cache (default %d)\n", DefaultCacheMB);
     printf("   -t THD    Set number of threads for OMP (default is number of processors)\n");
+    printf("   -d ENG    Dijkstra priority queue: scan (default), heap or radix;\n");
+    printf("             or delta: delta-stepping, parallel within each source\n");
+    printf("   --delta W Bucket width of delta-stepping (default chosen from the edge weights)\n");
+    printf("   -a ALG    All-pairs algorithm: johnson (default), floyd or auto (by edge density)\n");
+    printf("   -b MODE   Bellman-Ford variant: full, early (default) or queue\n");
+    printf("   -O ORD    Renumber nodes for locality before solving: none (default), rcm, degree or reuse\n");
     exit(0);
 }
+#endif
+
+// Allocate the per-run arrays that are not part of the graph file
+static void AllocateResults(Graph *graph) {
+    graph->new_weight = (int *)malloc(graph->nedge * sizeof(int));
+    graph->potential = (int *)malloc(graph->nnode * sizeof(int));
+    graph->distance = NULL;
+    graph->delta = 0;
+    graph->delta_bins = 0;
+    graph->order = NULL;
+    graph->rank = NULL;
+}
+
+#ifndef JOHNSON_LIBRARY
+// Full distance matrix, only needed when rows are not streamed.
+// Rows are contiguous so that Floyd-Warshall can work on the matrix in tiles.
+static void AllocateDistance(Graph *graph) {
+    int nnode = graph->nnode;
+    graph->distance = (int **)malloc((nnode > 0 ? nnode : 1) * sizeof(int *));
+    graph->distance[0] = (int *)malloc(((size_t)nnode * nnode > 0 ? (size_t)nnode * nnode : 1) * sizeof(int));
+    for (int nid = 1; nid < nnode; nid++)
+        graph->distance[nid] = graph->distance[0] + (size_t)nid * nnode;
+}
+#endif
+
+// Check for the binary graph magic, leaving the file position unchanged
+bool IsBinaryGraph(FILE *graph_file) {
+    int magic = 0;
+    long pos = ftell(graph_file);
+    size_t nread = fread(&magic, sizeof(int), 1, graph_file);
+    fseek(graph_file, pos, SEEK_SET);
+    return nread == 1 && magic == GraphMagic;
+}
+
+// Map a binary graph file; node, edge and weight are used in place
+Graph *MapGraph(FILE *graph_file) {
+    struct stat st;
+    int fd = fileno(graph_file);
+    if (fstat(fd, &st) < 0 || st.st_size < (off_t)(GraphHeaderInts * sizeof(int))) {
+        printf("ERROR. Malformed binary graph file header\n");
+        return NULL;
+    }
+
+    void *mapping = mmap(NULL, st.st_size, PROT_READ, MAP_PRIVATE, fd, 0);
+    if (mapping == MAP_FAILED) {
+        printf("ERROR. Couldn't map binary graph file\n");
+        return NULL;
+    }
+    int *header = (int *)mapping;
+    int nnode = header[2];
+    int nedge = header[3];
+    size_t expected = (GraphHeaderInts + (size_t)nnode + 1 + 2 * (size_t)nedge) * sizeof(int);
+    if (header[1] != GraphVersion || nnode < 0 || nedge < 0 || (size_t)st.st_size != expected) {
+        printf("ERROR. Malformed binary graph file header\n");
+        munmap(mapping, st.st_size);
+        return NULL;
+    }
+    madvise(mapping, st.st_size, MADV_WILLNEED);
+    // The solvers index by these arrays without further checks
+    int *node = header + GraphHeaderInts;
+    if (!ValidCSR(nnode, nedge, node, node + nnode + 1, node + nnode + 1 + nedge)) {
+        printf("ERROR. Binary graph file has inconsistent node offsets or edge targets\n");
+        munmap(mapping, st.st_size);
+        return NULL;
+    }
 
-Graph *LoadGraph(FILE *graph_file) {
     Graph *graph = (Graph *)malloc(sizeof(Graph));
-    char linebuf[MaxLineLength];
-    int src_id, dst_id, weight;
-    int prev_src_id = 0;
-    int lineno = 0;
+    graph->nnode = nnode;
+    graph->nedge = nedge;
+    graph->node = node;
+    graph->edge = graph->node + nnode + 1;
+    graph->weight = graph->edge + nedge;
+    graph->mapping = mapping;
+    graph->mapping_size = st.st_size;
+    AllocateResults(graph);
 
-    //  Load number of nodes and edges
-    fgets(linebuf, MaxLineLength, graph_file);
-    if (sscanf(linebuf, "%d", &graph->nnode) < 1) {
-        printf("ERROR. Malformed graph file header (line 1)\n");
+    return graph;
+}
+
+// Parse a decimal integer at *p, skipping blanks before it; false if there is none or it overflows
+static inline bool ParseInt(const char **p, const char *end, int *value) {
+    const char *s = *p;
+    while (s < end && (*s == ' ' || *s == '\t'))
+        s++;
+    bool negative = s < end && *s == '-';
+    if (negative)
+        s++;
+    const char *digits = s;
+    long long v = 0;
+    while (s < end && *s >= '0' && *s <= '9' && s - digits < 11)
+        v = v * 10 + (*s++ - '0');
+    if (s == digits || (s < end && *s >= '0' && *s <= '9'))
+        return false;
+    v = negative ? -v : v;
+    if (v < -IntMax - 1LL || v > IntMax)
+        return false;
+    *value = (int)v;
+    *p = s;
+    return true;
+}
+
+// Skip trailing blanks and the newline of a line; false if anything else is left on it
+static inline bool EndLine(const char **p, const char *end) {
+    const char *s = *p;
+    while (s < end && (*s == ' ' || *s == '\t' || *s == '\r'))
+        s++;
+    if (s < end && *s != '\n')
+        return false;
+    *p = s < end ? s + 1 : s;
+    return true;
+}
+
+// True if the line at s holds only blanks; *next is set to the start of the following line
+static inline bool BlankLine(const char *s, const char *end, const char **next) {
+    const char *nl = (const char *)memchr(s, '\n', end - s);
+    const char *stop = nl == NULL ? end : nl;
+    *next = nl == NULL ? end : nl + 1;
+    while (s < stop && (*s == ' ' || *s == '\t' || *s == '\r'))
+        s++;
+    return s == stop;
+}
+
+// Exclusive prefix sum of count[0..n) in place, in one block per thread; returns the total
+static int PrefixSum(int *count, int n) {
+    int nblock = 1;
+    #if OMP
+    nblock = omp_get_max_threads();
+    #endif
+    std::vector<long long> block_sum(nblock + 1, 0);
+    #if OMP
+    #pragma omp parallel num_threads(nblock)
+    #endif
+    {
+        int b = 0;
+        #if OMP
+        b = omp_get_thread_num();
+        #endif
+        int lo = (long long)n * b / nblock, hi = (long long)n * (b+1) / nblock;
+        long long sum = 0;
+        for (int i = lo; i < hi; i++)
+            sum += count[i];
+        block_sum[b+1] = sum;
+        #if OMP
+        #pragma omp barrier
+        #pragma omp single
+        #endif
+        for (int i = 0; i < nblock; i++)
+            block_sum[i+1] += block_sum[i];
+        long long offset = block_sum[b];
+        for (int i = lo; i < hi; i++) {
+            int c = count[i];
+            count[i] = (int)offset;
+            offset += c;
+        }
+    }
+    return (int)block_sum[nblock];
+}
+
+// Load a text edge list: "nnode", "nedge", then one "src dst weight" line per edge.
+// The file is mapped and split at line boundaries into one chunk per thread; the chunks are parsed
+// in parallel into edge arrays at offsets given by their line counts.  Edges need not be sorted
+// by source: the node offsets come from a counting sort on source id, and edges are only moved
+// when they are out of order.
+Graph *LoadGraph(FILE *graph_file) {
+    struct stat st;
+    int fd = fileno(graph_file);
+    if (fstat(fd, &st) < 0) {
+        printf("ERROR. Couldn't read graph file\n");
+        return NULL;
+    }
+    size_t size = st.st_size;
+    void *mapping = size > 0 ? mmap(NULL, size, PROT_READ, MAP_PRIVATE, fd, 0) : NULL;
+    if (mapping == MAP_FAILED) {
+        printf("ERROR. Couldn't map graph file\n");
         return NULL;
     }
+    if (size > 0)
+        madvise(mapping, size, MADV_WILLNEED);
+    const char *text = (const char *)mapping;
+    const char *end = text + size;
 
-    fgets(linebuf, MaxLineLength, graph_file);
-    if (sscanf(linebuf, "%d", &graph->nedge) < 1) {
+    //  Load number of nodes and edges
+    int nnode, nedge;
+    const char *p = text;
+    if (!ParseInt(&p, end, &nnode) || !EndLine(&p, end) || nnode < 0) {
         printf("ERROR. Malformed graph file header (line 1)\n");
+        if (mapping != NULL) munmap(mapping, size);
+        return NULL;
+    }
+    if (!ParseInt(&p, end, &nedge) || !EndLine(&p, end) || nedge < 0) {
+        printf("ERROR. Malformed graph file header (line 2)\n");
+        if (mapping != NULL) munmap(mapping, size);
         return NULL;
     }
 
-    //  Initialize graph
-    graph->node = (int *)calloc(graph->nnode+1, sizeof(int));
-    graph->node[graph->nnode] = graph->nedge;
-    graph->edge = (int *)malloc(graph->nedge * sizeof(int));
-    graph->weight = (int *)malloc(graph->nedge * sizeof(int));
-    graph->new_weight = (int *)malloc(graph->nedge * sizeof(int));
-    graph->distance = (int **)malloc(graph->nnode * sizeof(int *));
-    graph->predecessor = (int **)malloc(graph->nnode * sizeof(int *));
-    for (int nid = 0; nid < graph->nnode; nid++) {
-        graph->distance[nid] = (int *)malloc(graph->nnode * sizeof(int));
-        graph->predecessor[nid] = (int *)malloc(graph->nnode * sizeof(int));
-    }
-
-    //  Load edges
-    while (fgets(linebuf, MaxLineLength, graph_file) != NULL) {
-        if (sscanf(linebuf, "%d %d %d", &src_id, &dst_id, &weight) < 3) {
-            printf("ERROR. Malformed graph file header (line 1)\n");
-            return NULL;
+    //  Split the edge lines into chunks that start after a newline
+    int nchunk = 1;
+    #if OMP
+    nchunk = omp_get_max_threads();
+    #endif
+    size_t body = p - text;
+    std::vector<const char *> chunk(nchunk + 1);
+    chunk[0] = p;
+    chunk[nchunk] = end;
+    for (int c = 1; c < nchunk; c++) {
+        const char *s = text + body + (size - body) * c / nchunk;
+        if (s < chunk[c-1])
+            s = chunk[c-1];
+        else if (s > p && s[-1] != '\n') {
+            s = (const char *)memchr(s, '\n', end - s);
+            s = s == NULL ? end : s + 1;
         }
+        chunk[c] = s;
+    }
 
-        if (prev_src_id != src_id) {
-            for (int i = prev_src_id+1; i <= src_id; i++)
-                graph->node[i] = lineno;
-            prev_src_id = src_id;
+    //  Count the edge lines of each chunk, skipping blank ones; their prefix sum gives each
+    //  chunk's first edge, and the prefix sum of all lines its first file line for error messages
+    std::vector<int> first_line(nchunk + 1, 0);
+    std::vector<long long> first_row(nchunk + 1, 0);
+    #if OMP
+    #pragma omp parallel for schedule(static, 1)
+    #endif
+    for (int c = 0; c < nchunk; c++) {
+        long long lines = 0, rows = 0;
+        const char *next;
+        for (const char *s = chunk[c]; s < chunk[c+1]; s = next) {
+            if (!BlankLine(s, chunk[c+1], &next))
+                lines++;
+            rows++;
         }
+        first_line[c] = lines > IntMax ? IntMax : (int)lines;
+        first_row[c] = rows;
+    }
+    long long nline = 0, nrow = 0;
+    for (int c = 0; c < nchunk; c++) {
+        int lines = first_line[c];
+        long long rows = first_row[c];
+        first_line[c] = (int)nline;
+        first_row[c] = nrow;
+        nline += lines;
+        nrow += rows;
+    }
+    if (nline != nedge) {
+        printf("ERROR. Graph file has %lld edge lines, header says %d\n", nline, nedge);
+        if (mapping != NULL) munmap(mapping, size);
+        return NULL;
+    }
+    first_line[nchunk] = nedge;
 
-        graph->edge[lineno] = dst_id;
-        graph->weight[lineno] = weight;
-
-        lineno++;
+    //  Parse the chunks and count the out-degree of every node, one count array per chunk
+    int *src = (int *)malloc((nedge > 0 ? nedge : 1) * sizeof(int));
+    int *dst = (int *)malloc((nedge > 0 ? nedge : 1) * sizeof(int));
+    int *wgt = (int *)malloc((nedge > 0 ? nedge : 1) * sizeof(int));
+    std::vector<int *> counts(nchunk);
+    for (int c = 0; c < nchunk; c++)
+        counts[c] = (int *)calloc(nnode + 1, sizeof(int));
+    long long bad_line = LLONG_MAX;
+    bool sorted = true;
+    #if OMP
+    #pragma omp parallel for schedule(static, 1) reduction(min:bad_line) reduction(&&:sorted)
+    #endif
+    for (int c = 0; c < nchunk; c++) {
+        const char *s = chunk[c];
+        const char *next;
+        int *local = counts[c];
+        long long row = first_row[c];
+        for (int eid = first_line[c]; eid < first_line[c+1]; eid++, row++) {
+            while (BlankLine(s, end, &next)) {
+                s = next;
+                row++;
+            }
+            int u, v, w;
+            if (!ParseInt(&s, end, &u) || !ParseInt(&s, end, &v) || !ParseInt(&s, end, &w) || !EndLine(&s, end)
+                || u < 0 || u >= nnode || v < 0 || v >= nnode) {
+                bad_line = row;
+                break;
+            }
+            src[eid] = u;
+            dst[eid] = v;
+            wgt[eid] = w;
+            if (eid > first_line[c] && src[eid-1] > u)
+                sorted = false;
+            local[u]++;
+        }
     }
+    if (mapping != NULL)
+        munmap(mapping, size);
+    int *count = counts[0];
+    if (bad_line != LLONG_MAX) {
+        printf("ERROR. Malformed graph file edge (line %lld)\n", bad_line + 3);
+        free(src); free(dst); free(wgt);
+        for (int c = 0; c < nchunk; c++)
+            free(counts[c]);
+        return NULL;
+    }
+    if (nchunk > 1) {
+        #if OMP
+        #pragma omp parallel for schedule(static)
+        #endif
+        for (int nid = 0; nid < nnode; nid++)
+            for (int c = 1; c < nchunk; c++)
+                count[nid] += counts[c][nid];
+        for (int c = 1; c < nchunk; c++)
+            free(counts[c]);
+    }
+    for (int c = 1; c < nchunk; c++)
+        if (first_line[c] > 0 && first_line[c] < nedge && src[first_line[c]-1] > src[first_line[c]])
+            sorted = false;
+
+    Graph *graph = (Graph *)malloc(sizeof(Graph));
+    graph->nnode = nnode;
+    graph->nedge = nedge;
+    graph->mapping = NULL;
+    graph->mapping_size = 0;
 
-    // Pad all later nodes with 0 out degree
-    for (int nid = src_id+1; nid < graph->nnode; nid++) graph->node[nid] = graph->nedge;
+    //  Node offsets are the prefix sum of the degrees
+    PrefixSum(count, nnode + 1);
+    graph->node = count;
+    if (sorted) {
+        graph->edge = dst;
+        graph->weight = wgt;
+    } else {
+        // Stable counting sort on source id
+        graph->edge = (int *)malloc((nedge > 0 ? nedge : 1) * sizeof(int));
+        graph->weight = (int *)malloc((nedge > 0 ? nedge : 1) * sizeof(int));
+        int *fill = (int *)malloc((nnode > 0 ? nnode : 1) * sizeof(int));
+        memcpy(fill, count, nnode * sizeof(int));
+        for (int eid = 0; eid < nedge; eid++) {
+            int i = fill[src[eid]]++;
+            graph->edge[i] = dst[eid];
+            graph->weight[i] = wgt[eid];
+        }
+        free(fill);
+        free(dst);
+        free(wgt);
+    }
+    free(src);
+    AllocateResults(graph);
 
     return graph;
 }
 
 void freeGraph(Graph* graph) {
-    for (int nid = 0; nid < graph->nnode; nid++) {
-        free(graph->distance[nid]);
-        free(graph->predecessor[nid]);
+    if (graph->distance != NULL) {
+        free(graph->distance[0]);
+        free(graph->distance);
+    }
+    if (graph->mapping != NULL) {
+        munmap(graph->mapping, graph->mapping_size);
+    } else {
+        free(graph->node);
+        free(graph->edge);
+        free(graph->weight);
     }
-    free(graph->node);
-    free(graph->edge);
-    free(graph->weight);
     free(graph->new_weight);
-    free(graph->distance);
-    free(graph->predecessor);
+    free(graph->potential);
+    free(graph->order);
+    free(graph->rank);
     free(graph);
 }
 
-void Johnson(Graph *graph) {
+// Write the distance matrix into a mapped output file, one row copy at a time
+bool WriteDistance(const char *fname, Graph *graph) {
+    int nnode = graph->nnode;
+    size_t size = (DistanceHeaderInts + (size_t)nnode * nnode) * sizeof(int);
+    int fd = open(fname, O_RDWR | O_CREAT | O_TRUNC, 0644);
+    if (fd < 0) {
+        printf("Couldn't open distance file %s\n", fname);
+        return false;
+    }
+    if (ftruncate(fd, size) < 0) {
+        printf("Couldn't resize distance file %s\n", fname);
+        close(fd);
+        return false;
+    }
+    int *out = (int *)mmap(NULL, size, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+    if (out == MAP_FAILED) {
+        printf("Couldn't map distance file %s\n", fname);
+        close(fd);
+        return false;
+    }
+
+    out[0] = DistanceMagic;
+    out[1] = DistanceVersion;
+    out[2] = nnode;
+    out[3] = 0;
+    int *rows = out + DistanceHeaderInts;
+    for (int nid = 0; nid < nnode; nid++)
+        memcpy(rows + (size_t)nid * nnode, graph->distance[nid], nnode * sizeof(int));
+
+    munmap(out, size);
+    close(fd);
+    return true;
+}
+
+bool WritePotential(const char *fname, Graph *graph) {
+    FILE *f = fopen(fname, "wb");
+    if (f == NULL) {
+        printf("Couldn't open potential file %s\n", fname);
+        return false;
+    }
+    int header[PotentialHeaderInts] = { PotentialMagic, PotentialVersion, graph->nnode, 0 };
+    bool ok = fwrite(header, sizeof(int), PotentialHeaderInts, f) == PotentialHeaderInts
+        && fwrite(graph->potential, sizeof(int), graph->nnode, f) == (size_t)graph->nnode;
+    if (fclose(f) != 0 || !ok) {
+        printf("Couldn't write potential file %s\n", fname);
+        return false;
+    }
+    return true;
+}
+
+// Load potentials computed for this graph and reweight its edges with them
+bool ReadPotential(const char *fname, Graph *graph) {
+    FILE *f = fopen(fname, "rb");
+    if (f == NULL) {
+        printf("Couldn't open potential file %s\n", fname);
+        return false;
+    }
+    int header[PotentialHeaderInts];
+    bool ok = fread(header, sizeof(int), PotentialHeaderInts, f) == PotentialHeaderInts
+        && header[0] == PotentialMagic && header[1] == PotentialVersion && header[2] == graph->nnode
+        && fread(graph->potential, sizeof(int), graph->nnode, f) == (size_t)graph->nnode;
+    fclose(f);
+    if (!ok) {
+        printf("ERROR. Malformed potential file %s\n", fname);
+        return false;
+    }
+    if (!Reweight(graph)) {
+        printf("ERROR. Potentials in %s don't fit the graph\n", fname);
+        return false;
+    }
+    return true;
+}
+
+// False if the graph has a negative cycle
+bool Johnson(Graph *graph, RowSink *sink) {
     START_ACTIVITY(BELLMAN_FORD);
-    BellmanFord(graph);
+    bool ok = BellmanFord(graph);
     FINISH_ACTIVITY(BELLMAN_FORD);
+    if (!ok)
+        return false;
 
     START_ACTIVITY(DIJKSTRA);
-    AllPairsDijkstra(graph);
+    AllPairsDijkstra(graph, sink);
     FINISH_ACTIVITY(DIJKSTRA);
+    return true;
+}
+
+// Floyd-Warshall runs on the reweighted edges, so it also starts with Bellman-Ford
+bool Floyd(Graph *graph) {
+    START_ACTIVITY(BELLMAN_FORD);
+    bool ok = BellmanFord(graph);
+    FINISH_ACTIVITY(BELLMAN_FORD);
+    if (!ok)
+        return false;
+
+    START_ACTIVITY(FLOYD_WARSHALL);
+    FloydWarshall(graph);
+    FINISH_ACTIVITY(FLOYD_WARSHALL);
+    return true;
 }
 
+#ifndef JOHNSON_LIBRARY
+// Options without a short form
+enum { OPT_SOURCES = 256, OPT_POTENTIALS, OPT_SAVE_POTENTIALS, OPT_DELTA };
+
+static struct option long_options[] = {
+    { "sources", required_argument, NULL, OPT_SOURCES },
+    { "potentials", required_argument, NULL, OPT_POTENTIALS },
+    { "save-potentials", required_argument, NULL, OPT_SAVE_POTENTIALS },
+    { "delta", required_argument, NULL, OPT_DELTA },
+    { NULL, 0, NULL, 0 }
+};
+
 int main(int argc, char *argv[]) {
     int c;
     FILE *graph_file = NULL;
@@ -105,9 +521,20 @@ int main(int argc, char *argv[]) {
     #endif
     bool instrument = false;
     bool doPrint = false;
+    char *distance_fname = NULL;
+    bool stream = false;
+    char *socket_path = NULL;
+    std::vector<char *> update_fnames;
+    long cache_mb = DefaultCacheMB;
+    // Source range, to the last node when source_last < 0, or a list of sources
+    bool sources = false;
+    int source_first = 0, source_last = -1;
+    std::vector<int> source_list;
+    char *potential_fname = NULL;
+    char *save_potential_fname = NULL;
 
     // parse command line arguments
-    while ((c = getopt(argc, argv, "hg:t:vIP")) != -1) {
+    while ((c = getopt_long(argc, argv, "hg:t:d:b:a:vIPB:SQ:M:U:O:", long_options, NULL)) != -1) {
         switch(c) {
             case 'g':
                 graph_file = fopen(optarg, "r");
@@ -117,6 +544,50 @@ int main(int argc, char *argv[]) {
             case 'v':
                 display = 1;
                 break;
+            case 'd': {
+                int e;
+                for (e = 0; e < DIJKSTRA_ENGINE_COUNT; e++)
+                    if (strcmp(optarg, dijkstra_engine_name[e]) == 0) break;
+                if (e == DIJKSTRA_ENGINE_COUNT) {
+                    printf("Unknown Dijkstra engine '%s'\n", optarg);
+                    Usage(argv[0]);
+                }
+                dijkstra_engine = (dijkstra_engine_t)e;
+                break;
+            }
+            case 'b': {
+                int m;
+                for (m = 0; m < BELLMAN_FORD_MODE_COUNT; m++)
+                    if (strcmp(optarg, bellman_ford_mode_name[m]) == 0) break;
+                if (m == BELLMAN_FORD_MODE_COUNT) {
+                    printf("Unknown Bellman-Ford variant '%s'\n", optarg);
+                    Usage(argv[0]);
+                }
+                bellman_ford_mode = (bellman_ford_mode_t)m;
+                break;
+            }
+            case 'O': {
+                int o;
+                for (o = 0; o < ORDER_COUNT; o++)
+                    if (strcmp(optarg, node_order_name[o]) == 0) break;
+                if (o == ORDER_COUNT) {
+                    printf("Unknown node order '%s'\n", optarg);
+                    Usage(argv[0]);
+                }
+                node_order = (node_order_t)o;
+                break;
+            }
+            case 'a': {
+                int a;
+                for (a = 0; a < APSP_ALGORITHM_COUNT; a++)
+                    if (strcmp(optarg, apsp_algorithm_name[a]) == 0) break;
+                if (a == APSP_ALGORITHM_COUNT) {
+                    printf("Unknown all-pairs algorithm '%s'\n", optarg);
+                    Usage(argv[0]);
+                }
+                apsp_algorithm = (apsp_algorithm_t)a;
+                break;
+            }
             case 't':
                 #if OMP
                 thread_count = atoi(optarg);
@@ -133,6 +604,63 @@ int main(int argc, char *argv[]) {
             case 'P':
                 doPrint = true;
                 break;
+            case 'B':
+                distance_fname = optarg;
+                break;
+            case 'S':
+                stream = true;
+                break;
+            case 'Q':
+                socket_path = optarg;
+                break;
+            case 'M':
+                cache_mb = atol(optarg);
+                break;
+            case 'U':
+                update_fnames.push_back(optarg);
+                break;
+            case OPT_SOURCES: {
+                char *end;
+                if (strchr(optarg, ':') == NULL) {
+                    // S1,S2,...
+                    for (char *item = optarg; ; item = end + 1) {
+                        source_list.push_back(strtol(item, &end, 10));
+                        if (end == item || (*end != ',' && *end != '\0')) {
+                            printf("Sources must be A:B or a list S1,S2,...\n");
+                            Usage(argv[0]);
+                        }
+                        if (*end == '\0') break;
+                    }
+                    sources = true;
+                    break;
+                }
+                source_first = strtol(optarg, &end, 10);
+                if (end == optarg || *end != ':') {
+                    printf("Source range must be A:B\n");
+                    Usage(argv[0]);
+                }
+                char *last = end + 1;
+                source_last = *last == '\0' ? -1 : strtol(last, &end, 10);
+                if (*last != '\0' && *end != '\0') {
+                    printf("Source range must be A:B\n");
+                    Usage(argv[0]);
+                }
+                sources = true;
+                break;
+            }
+            case OPT_POTENTIALS:
+                potential_fname = optarg;
+                break;
+            case OPT_SAVE_POTENTIALS:
+                save_potential_fname = optarg;
+                break;
+            case OPT_DELTA:
+                delta_width = atoi(optarg);
+                if (delta_width <= 0) {
+                    printf("Bucket width must be positive\n");
+                    Usage(argv[0]);
+                }
+                break;
             default:
                 printf("Unknown option '%c'\n", c);
                 Usage(argv[0]);
@@ -145,6 +673,47 @@ int main(int argc, char *argv[]) {
         return 0;
     }
 
+    // A source range is computed like a stream: its rows are never kept together
+    if (sources)
+        stream = true;
+
+    if (stream && socket_path != NULL) {
+        printf("The query server (-Q) answers for all sources, not with -S or --sources\n");
+        Usage(argv[0]);
+    }
+
+    if (potential_fname != NULL && !stream) {
+        printf("Potentials (--potentials) are only used with -S or --sources\n");
+        Usage(argv[0]);
+    }
+
+    if (!update_fnames.empty() && (stream || socket_path != NULL)) {
+        printf("Updates need the full distance matrix, not -S or -Q\n");
+        Usage(argv[0]);
+    }
+
+    if (apsp_algorithm == APSP_FLOYD && (stream || socket_path != NULL)) {
+        printf("Floyd-Warshall needs the full distance matrix, not -S or -Q\n");
+        Usage(argv[0]);
+    }
+
+    // Updates, queries and potential files name nodes by their original ids
+    if (node_order != ORDER_NONE && (!update_fnames.empty() || socket_path != NULL
+                                     || potential_fname != NULL || save_potential_fname != NULL)) {
+        printf("Node reordering (-O) can't be combined with -U, -Q or potential files\n");
+        Usage(argv[0]);
+    }
+
+    if (!source_list.empty() && distance_fname != NULL) {
+        printf("A source list is printed (-P) or summarised; -B needs a range A:B\n");
+        Usage(argv[0]);
+    }
+
+    if (stream && doPrint && distance_fname != NULL) {
+        printf("Streaming mode writes either -P or -B output, not both\n");
+        Usage(argv[0]);
+    }
+
     track_activity(instrument);
 
     START_ACTIVITY(ACTIVITY_OVERHEAD);
@@ -154,26 +723,148 @@ int main(int argc, char *argv[]) {
     FINISH_ACTIVITY(ACTIVITY_OVERHEAD);
 
     START_ACTIVITY(LOAD_GRAPH);
-    graph = LoadGraph(graph_file);
+    if (IsBinaryGraph(graph_file))
+        graph = MapGraph(graph_file);
+    else
+        graph = LoadGraph(graph_file);
     FINISH_ACTIVITY(LOAD_GRAPH);
 
-    Johnson(graph);
+    if (graph == NULL)
+        return 1;
 
-    if (doPrint) {
+    START_ACTIVITY(REORDER_GRAPH);
+    ReorderGraph(graph);
+    FINISH_ACTIVITY(REORDER_GRAPH);
+
+    if (save_potential_fname != NULL) {
+        START_ACTIVITY(BELLMAN_FORD);
+        bool ok = BellmanFord(graph);
+        FINISH_ACTIVITY(BELLMAN_FORD);
+        if (!ok) {
+            printf("Graph contains negative weight cycle\n");
+            return 0;
+        }
         START_ACTIVITY(PRINT_GRAPH);
-        for (int i = 0; i < graph->nnode; ++i) {
-            for (int j = 0; j < graph->nnode; ++j) {
-                if (graph->distance[i][j] == IntMax)
-                    std::cout << std::setw(5) << "inf";
-                else
-                    std::cout << std::setw(5) << graph->distance[i][j];
-            }
-            std::cout << std::endl;
+        ok = WritePotential(save_potential_fname, graph);
+        FINISH_ACTIVITY(PRINT_GRAPH);
+        SHOW_ACTIVITY(stderr, instrument);
+        freeGraph(graph);
+        return ok ? 0 : 1;
+    }
+
+    if (source_last < 0)
+        source_last = graph->nnode;
+    if (source_first < 0 || source_first > source_last || source_last > graph->nnode) {
+        printf("Source range %d:%d is outside the %d nodes\n", source_first, source_last, graph->nnode);
+        return 1;
+    }
+    for (size_t i = 0; i < source_list.size(); i++)
+        if (source_list[i] < 0 || source_list[i] >= graph->nnode) {
+            printf("Source %d is outside the %d nodes\n", source_list[i], graph->nnode);
+            return 1;
+        }
+    if (!source_list.empty()) {
+        source_first = 0;
+        source_last = source_list.size();
+    }
+
+    if (socket_path != NULL) {
+        // Only the reweighted graph stays resident; rows are computed per query
+        START_ACTIVITY(BELLMAN_FORD);
+        bool ok = BellmanFord(graph);
+        FINISH_ACTIVITY(BELLMAN_FORD);
+        if (!ok) {
+            printf("Graph contains negative weight cycle\n");
+            return 0;
+        }
+        ok = Serve(graph, socket_path, (size_t)cache_mb << 20);
+        SHOW_ACTIVITY(stderr, instrument);
+        freeGraph(graph);
+        return ok ? 0 : 1;
+    }
+
+    if (stream) {
+        // Output happens while Dijkstra runs, so its time is part of DIJKSTRA
+        RowSink sink;
+        row_sink_t kind = doPrint ? SINK_TEXT : distance_fname != NULL ? SINK_BINARY : SINK_REDUCE;
+        if (!OpenRowSink(&sink, kind, graph->nnode, distance_fname, source_first, source_last))
+            return 1;
+        if (!source_list.empty())
+            sink.list = source_list.data();
+        if (potential_fname != NULL) {
+            START_ACTIVITY(LOAD_GRAPH);
+            bool ok = ReadPotential(potential_fname, graph);
+            FINISH_ACTIVITY(LOAD_GRAPH);
+            if (!ok)
+                return 1;
+            START_ACTIVITY(DIJKSTRA);
+            AllPairsDijkstra(graph, &sink);
+            FINISH_ACTIVITY(DIJKSTRA);
+        } else if (!Johnson(graph, &sink)) {
+            printf("Graph contains negative weight cycle\n");
+            return 0;
+        }
+        if (!CloseRowSink(&sink))
+            return 1;
+        SHOW_ACTIVITY(stderr, instrument);
+        freeGraph(graph);
+        return 0;
+    }
+
+    AllocateDistance(graph);
+    bool ok;
+    if (ChooseAlgorithm(graph) == APSP_FLOYD) {
+        if (display)
+            printf("Using Floyd-Warshall for %d nodes and %d edges\n", graph->nnode, graph->nedge);
+        ok = Floyd(graph);
+    } else
+        ok = Johnson(graph, NULL);
+    if (!ok) {
+        printf("Graph contains negative weight cycle\n");
+        return 0;
+    }
+    START_ACTIVITY(REORDER_GRAPH);
+    RestoreDistance(graph);
+    FINISH_ACTIVITY(REORDER_GRAPH);
+
+    long update_rows = 0;
+    for (size_t i = 0; i < update_fnames.size(); i++) {
+        START_ACTIVITY(UPDATE_GRAPH);
+        FILE *update_file = fopen(update_fnames[i], "r");
+        if (update_file == NULL) {
+            printf("Couldn't open update file %s\n", update_fnames[i]);
+            return 1;
         }
+        int count;
+        EdgeUpdate *updates = LoadUpdates(update_file, &count);
+        fclose(update_file);
+        int nrows = updates == NULL ? -1 : UpdateGraph(graph, updates, count);
+        free(updates);
+        FINISH_ACTIVITY(UPDATE_GRAPH);
+        if (nrows < 0)
+            return 1;
+        update_rows += nrows;
+    }
+    if (!update_fnames.empty())
+        RECORD_COUNTER(UPDATE_ROWS, update_rows);
+
+    if (doPrint) {
+        START_ACTIVITY(PRINT_GRAPH);
+        for (int i = 0; i < graph->nnode; ++i)
+            PrintRow(graph->distance[i], graph->nnode);
+        FINISH_ACTIVITY(PRINT_GRAPH);
+    }
+
+    if (distance_fname != NULL) {
+        START_ACTIVITY(PRINT_GRAPH);
+        ok = WriteDistance(distance_fname, graph);
         FINISH_ACTIVITY(PRINT_GRAPH);
+        if (!ok)
+            return 1;
     }
 
     SHOW_ACTIVITY(stderr, instrument);
 
     freeGraph(graph);
 }
+#endif
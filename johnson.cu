@@ -4,6 +4,12 @@
 #include <stdio.h>
 #include <stdlib.h>
 #include <getopt.h>
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+#include "csr.hpp"
 
 #include <cuda.h>
 #include <cuda_runtime.h>
@@ -14,6 +20,16 @@
 
 #define MaxLineLength 1024
 #define IntMax __INT32_MAX__
+
+// Binary CSR graph file, same layout as in johnson.hpp
+#define GraphMagic 0x5253434A
+#define GraphVersion 1
+#define GraphHeaderInts 4
+
+// Binary distance matrix (-B), same layout as in johnson.hpp
+#define DistanceMagic 0x5453444A
+#define DistanceVersion 1
+#define DistanceHeaderInts 4
 #define cudaCheckErrors(msg) \
     do { \
         cudaError_t __err = cudaGetLastError(); \
@@ -57,10 +73,70 @@ typedef struct {
 
     int *distance;
     int *predecessor;
+
+    // Set when node/edge/weight point into a mapped binary graph file
+    void *mapping;
+    size_t mapping_size;
 } Graph;
 
 __constant__ GlobalConstants constGraphParams;
 
+// Check for the binary graph magic, leaving the file position unchanged
+bool IsBinaryGraph(FILE *graph_file) {
+    int magic = 0;
+    long pos = ftell(graph_file);
+    size_t nread = fread(&magic, sizeof(int), 1, graph_file);
+    fseek(graph_file, pos, SEEK_SET);
+    return nread == 1 && magic == GraphMagic;
+}
+
+// Map a binary graph file; node, edge and weight are used in place
+Graph *MapGraph(FILE *graph_file) {
+    struct stat st;
+    int fd = fileno(graph_file);
+    if (fstat(fd, &st) < 0 || st.st_size < (off_t)(GraphHeaderInts * sizeof(int))) {
+        printf("ERROR. Malformed binary graph file header\n");
+        return NULL;
+    }
+
+    void *mapping = mmap(NULL, st.st_size, PROT_READ, MAP_PRIVATE, fd, 0);
+    if (mapping == MAP_FAILED) {
+        printf("ERROR. Couldn't map binary graph file\n");
+        return NULL;
+    }
+    int *header = (int *)mapping;
+    int nnode = header[2];
+    int nedge = header[3];
+    size_t expected = (GraphHeaderInts + (size_t)nnode + 1 + 2 * (size_t)nedge) * sizeof(int);
+    if (header[1] != GraphVersion || nnode < 0 || nedge < 0 || (size_t)st.st_size != expected) {
+        printf("ERROR. Malformed binary graph file header\n");
+        munmap(mapping, st.st_size);
+        return NULL;
+    }
+    madvise(mapping, st.st_size, MADV_WILLNEED);
+    // The solvers index by these arrays without further checks
+    int *node = header + GraphHeaderInts;
+    if (!ValidCSR(nnode, nedge, node, node + nnode + 1, node + nnode + 1 + nedge)) {
+        printf("ERROR. Binary graph file has inconsistent node offsets or edge targets\n");
+        munmap(mapping, st.st_size);
+        return NULL;
+    }
+
+    Graph *graph = (Graph *)malloc(sizeof(Graph));
+    graph->nnode = nnode;
+    graph->nedge = nedge;
+    graph->node = node;
+    graph->edge = graph->node + nnode + 1;
+    graph->weight = graph->edge + nedge;
+    graph->new_weight = (int *)malloc(graph->nedge * sizeof(int));
+    graph->distance = (int *)malloc(graph->nnode * graph->nnode * sizeof(int));
+    graph->predecessor = (int *)malloc(graph->nnode * graph->nnode * sizeof(int));
+    graph->mapping = mapping;
+    graph->mapping_size = st.st_size;
+
+    return graph;
+}
+
 Graph *LoadGraph(FILE *graph_file) {
     Graph *graph = (Graph *)malloc(sizeof(Graph));
     char linebuf[MaxLineLength];
@@ -89,6 +165,8 @@ Graph *LoadGraph(FILE *graph_file) {
     graph->new_weight = (int *)malloc(graph->nedge * sizeof(int));
     graph->distance = (int *)malloc(graph->nnode * graph->nnode * sizeof(int));
     graph->predecessor = (int *)malloc(graph->nnode * graph->nnode * sizeof(int));
+    graph->mapping = NULL;
+    graph->mapping_size = 0;
 
     //  Load edges
     while (fgets(linebuf, MaxLineLength, graph_file) != NULL) {
@@ -116,15 +194,38 @@ Graph *LoadGraph(FILE *graph_file) {
 }
 
 void freeGraph(Graph* graph) {
-    free(graph->node);
-    free(graph->edge);
-    free(graph->weight);
+    if (graph->mapping != NULL) {
+        munmap(graph->mapping, graph->mapping_size);
+    } else {
+        free(graph->node);
+        free(graph->edge);
+        free(graph->weight);
+    }
     free(graph->new_weight);
     free(graph->distance);
     free(graph->predecessor);
     free(graph);
 }
 
+// Write the distance matrix as a header followed by one bulk write of the rows
+bool WriteDistance(const char *fname, Graph *graph) {
+    int nnode = graph->nnode;
+    int header[DistanceHeaderInts] = { DistanceMagic, DistanceVersion, nnode, 0 };
+    FILE *f = fopen(fname, "wb");
+    if (f == NULL) {
+        printf("Couldn't open distance file %s\n", fname);
+        return false;
+    }
+    size_t cells = (size_t)nnode * nnode;
+    bool ok = fwrite(header, sizeof(int), DistanceHeaderInts, f) == DistanceHeaderInts
+        && fwrite(graph->distance, sizeof(int), cells, f) == cells;
+    if (fclose(f) != 0 || !ok) {
+        printf("Couldn't write distance file %s\n", fname);
+        return false;
+    }
+    return true;
+}
+
 ///////////////////////////////////////////////////////////////////////////////
 // Start of kernels
 ///////////////////////////////////////////////////////////////////////////////
@@ -357,8 +458,10 @@ static void Usage(char *name) {
     char use_string[] = "-g GFILE [-v]";
     printf("Usage: %s %s\n", name, use_string);
     printf("   -h        Print this message\n");
-    printf("   -g GFILE  Graph file\n");
+    printf("   -g GFILE  Graph file (text edge list or binary .csr)\n");
     printf("   -v        Operate in verbose mode\n");
+    printf("   -P        Print distance matrix as text\n");
+    printf("   -B DFILE  Write distance matrix in binary to DFILE\n");
     exit(0);
 }
 
@@ -373,9 +476,10 @@ int main(int argc, char *argv[]) {
     bool instrument = false;
     bool showMem = false;
     bool doPrint = false;
+    char *distance_fname = NULL;
 
     // parse command line arguments
-    while ((c = getopt(argc, argv, "hg:vIMP")) != -1) {
+    while ((c = getopt(argc, argv, "hg:vIMPB:")) != -1) {
         switch(c) {
             case 'g':
                 graph_file = fopen(optarg, "r");
@@ -397,6 +501,9 @@ int main(int argc, char *argv[]) {
             case 'P':
                 doPrint = true;
                 break;
+            case 'B':
+                distance_fname = optarg;
+                break;
             default:
                 printf("Unknown option '%c'\n", c);
                 Usage(argv[0]);
@@ -429,9 +536,15 @@ int main(int argc, char *argv[]) {
     track_activity(instrument);
 
     START_ACTIVITY(LOAD_GRAPH);
-    graph = LoadGraph(graph_file);
+    if (IsBinaryGraph(graph_file))
+        graph = MapGraph(graph_file);
+    else
+        graph = LoadGraph(graph_file);
     FINISH_ACTIVITY(LOAD_GRAPH);
 
+    if (graph == NULL)
+        return 1;
+
     johnson_host(graph);
 
     if (doPrint) {
@@ -449,6 +562,14 @@ int main(int argc, char *argv[]) {
         FINISH_ACTIVITY(PRINT_GRAPH);
     }
 
+    if (distance_fname != NULL) {
+        START_ACTIVITY(PRINT_GRAPH);
+        bool ok = WriteDistance(distance_fname, graph);
+        FINISH_ACTIVITY(PRINT_GRAPH);
+        if (!ok)
+            return 1;
+    }
+
     SHOW_ACTIVITY(stderr, instrument);
 
     freeGraph(graph);
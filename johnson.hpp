@@ -7,7 +7,12 @@
 #include <stdio.h>
 #include <stdlib.h>
 #include <getopt.h>
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
 
+#include "csr.hpp"
 #include "cycletimer.hpp"
 #include "instrument.hpp"
 
@@ -18,8 +23,65 @@
 #define MaxLineLength 1024
 #define IntMax __INT32_MAX__
 
+// Binary CSR graph file (written by graph.py), all fields little-endian int32:
+//   magic "JCSR", version, nnode, nedge, node[nnode+1], edge[nedge], weight[nedge]
+#define GraphMagic 0x5253434A
+#define GraphVersion 1
+#define GraphHeaderInts 4
+
+// Binary distance matrix (-B), little-endian int32:
+//   magic "JDST", version, nnode, reserved, then nnode rows of nnode distances (IntMax if unreachable)
+#define DistanceMagic 0x5453444A
+#define DistanceVersion 1
+#define DistanceHeaderInts 4
+
+// Block of distance rows for a source range (--sources with -B), little-endian int32:
+//   magic "JDSB", version, nnode, first source, then the rows of sources first, first+1, ...
+#define DistanceBlockMagic 0x4253444A
+
+// Bellman-Ford potentials (--save-potentials, --potentials), little-endian int32:
+//   magic "JPOT", version, nnode, reserved, then nnode potentials
+#define PotentialMagic 0x544F504A
+#define PotentialVersion 1
+#define PotentialHeaderInts 4
+
 extern char display;
 
+// Priority queue used by Dijkstra to find the next node, or delta-stepping, which runs
+// one source at a time with the threads sharing the work of each source
+typedef enum { DIJKSTRA_SCAN, DIJKSTRA_HEAP, DIJKSTRA_RADIX, DIJKSTRA_DELTA, DIJKSTRA_ENGINE_COUNT } dijkstra_engine_t;
+
+extern dijkstra_engine_t dijkstra_engine;
+
+extern const char *dijkstra_engine_name[DIJKSTRA_ENGINE_COUNT];
+
+// Bucket width of delta-stepping, 0 to choose it from the edge weights
+extern int delta_width;
+
+// Bellman-Ford variant: all nnode passes, stop after a pass without improvements,
+// or relax only out-edges of nodes whose distance changed (work-list)
+typedef enum { BELLMAN_FORD_FULL, BELLMAN_FORD_EARLY, BELLMAN_FORD_QUEUE, BELLMAN_FORD_MODE_COUNT } bellman_ford_mode_t;
+
+extern bellman_ford_mode_t bellman_ford_mode;
+
+extern const char *bellman_ford_mode_name[BELLMAN_FORD_MODE_COUNT];
+
+// All-pairs algorithm: Johnson (Bellman-Ford, then Dijkstra from every source),
+// cache-blocked Floyd-Warshall on the full matrix, or chosen from the graph's density
+typedef enum { APSP_JOHNSON, APSP_FLOYD, APSP_AUTO, APSP_ALGORITHM_COUNT } apsp_algorithm_t;
+
+extern apsp_algorithm_t apsp_algorithm;
+
+extern const char *apsp_algorithm_name[APSP_ALGORITHM_COUNT];
+
+// Node renumbering applied after loading (-O) to improve cache locality: Reverse Cuthill-McKee,
+// decreasing degree, or a greedy ordering that keeps neighbouring nodes' ids close (Gorder)
+typedef enum { ORDER_NONE, ORDER_RCM, ORDER_DEGREE, ORDER_REUSE, ORDER_COUNT } node_order_t;
+
+extern node_order_t node_order;
+
+extern const char *node_order_name[ORDER_COUNT];
+
 typedef struct {
     int nnode;
     int nedge;
@@ -28,15 +90,116 @@ typedef struct {
     int *edge;
     int *weight;
     int *new_weight;
+    // Bellman-Ford potentials used to compute new_weight
+    int *potential;
+    // Bucket width of delta-stepping and the number of buckets it keeps, set by Reweight
+    // with the delta engine (see DeltaSetup)
+    int delta;
+    int delta_bins;
 
+    // nnode rows of nnode distances in one contiguous block, NULL when rows are streamed (-S)
     int **distance;
-    int **predecessor;
+
+    // Set when node/edge/weight point into a mapped binary graph file
+    void *mapping;
+    size_t mapping_size;
+
+    // After ReorderGraph: node i is original node order[i], original node u is rank[u]; else NULL
+    int *order;
+    int *rank;
 } Graph;
 
+// Destination of distance rows in streaming mode (-S): summary statistics,
+// rows written at their offset in a binary distance file, or text on stdout
+typedef enum { SINK_REDUCE, SINK_BINARY, SINK_TEXT, SINK_COUNT } row_sink_t;
+
+typedef struct {
+    row_sink_t kind;
+    int nnode;
+    // Rows must be emitted in source order (text output)
+    bool ordered;
+    // Rows of sources first..last-1; a partial range is written as a distance block
+    int first;
+    int last;
+    // Explicit sources (--sources with a list): rows first..last-1 are those of list[first..last)
+    const int *list;
+
+    // SINK_BINARY
+    int fd;
+
+    // SINK_REDUCE totals over finite distances
+    long long reachable;
+    long long total;
+    int min;
+    int max;
+} RowSink;
+
+bool OpenRowSink(RowSink *sink, row_sink_t kind, int nnode, const char *fname, int first, int last);
+
+// Safe to call concurrently from several threads
+void EmitRow(RowSink *sink, int src_nid, const int *row);
+
+bool CloseRowSink(RowSink *sink);
+
+// Source of the i-th row of the sink
+static inline int SinkSource(const RowSink *sink, int i) {
+    return sink->list != NULL ? sink->list[i] : i;
+}
+
+void PrintRow(const int *row, int nnode);
+
+bool IsBinaryGraph(FILE *graph_file);
+
 Graph *LoadGraph(FILE *graph_file);
 
-void BellmanFord(Graph *g);
+Graph *MapGraph(FILE *graph_file);
+
+bool BellmanFord(Graph *g);
+
+bool RepairPotential(Graph *graph, const int *start, int nstart);
+
+bool Reweight(Graph *graph);
+
+void Dijkstra(Graph *graph, int src_nid, int *distance);
+
+void AllPairsDijkstra(Graph *graph, RowSink *sink);
+
+void DeltaSetup(Graph *graph);
+
+void ReorderGraph(Graph *graph);
+
+void RestoreRow(Graph *graph, const int *row, int *out);
+
+void RestoreDistance(Graph *graph);
+
+void DeltaStepping(Graph *graph, int src_nid, int *distance);
+
+bool Johnson(Graph *graph, RowSink *sink);
+
+apsp_algorithm_t ChooseAlgorithm(Graph *graph);
+
+void FloydWarshall(Graph *graph);
+
+bool Floyd(Graph *graph);
+
+bool WriteDistance(const char *fname, Graph *graph);
+
+bool WritePotential(const char *fname, Graph *graph);
+
+bool ReadPotential(const char *fname, Graph *graph);
+
+// Edge change read from an update file (-U)
+typedef enum { UPDATE_INSERT, UPDATE_DELETE, UPDATE_WEIGHT } update_kind_t;
+
+typedef struct {
+    update_kind_t kind;
+    int src;
+    int dst;
+    int weight;
+} EdgeUpdate;
+
+EdgeUpdate *LoadUpdates(FILE *update_file, int *count);
 
-void AllPairsDijkstra(Graph *graph);
+int UpdateGraph(Graph *graph, const EdgeUpdate *updates, int count);
 
-void Johnson(Graph *graph);
+bool Serve(Graph *graph, const char *socket_path, size_t cache_bytes);
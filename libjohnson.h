@@ -0,0 +1,41 @@
+/* C interface of libjohnson.so, the solvers built as a shared library (see solver.py)
+ */
+
+#ifndef LIBJOHNSON_H
+#define LIBJOHNSON_H
+
+#ifdef __cplusplus
+extern "C" {
+#endif
+
+/* Return codes of johnson_solve */
+#define JOHNSON_OK 0
+#define JOHNSON_NEGATIVE_CYCLE 1
+#define JOHNSON_BAD_GRAPH 2
+#define JOHNSON_BAD_OPTION 3
+
+/* Phase times of one call in milliseconds, and the algorithm that ran (0 Johnson, 1 Floyd-Warshall) */
+typedef struct {
+    double bellman_ford_ms;
+    double all_pairs_ms;
+    int algorithm;
+} johnson_stats;
+
+/*
+All-pairs shortest distances of a CSR graph: the out-edges of node u are
+edge[node[u]..node[u+1]) with weights weight[node[u]..node[u+1]).
+Row s of distance (nnode x nnode ints, row-major) receives the distances from s,
+INT32_MAX for unreachable nodes.  The graph arrays are only read.
+algorithm ("johnson", "floyd", "auto") and engine ("scan", "heap", "radix", "delta") may be NULL
+for the defaults; threads <= 0 keeps the OpenMP default.  stats may be NULL.
+Calls must not overlap: the options are process-wide settings of the solvers.
+*/
+int johnson_solve(int nnode, int nedge, const int *node, const int *edge, const int *weight,
+                  int *distance, const char *algorithm, const char *engine, int threads,
+                  johnson_stats *stats);
+
+#ifdef __cplusplus
+}
+#endif
+
+#endif
@@ -0,0 +1,146 @@
+#!/usr/bin/python
+# Build every graph used by benchmark.py and regress.py ahead of time, in parallel.
+# Each file is written under a temporary name and renamed into place, then its size and
+# content hash are recorded in a manifest.  The test drivers check graphs against the
+# manifest at startup instead of generating them in the middle of a timed sweep.
+
+import argparse
+import concurrent.futures
+import json
+import os
+import os.path
+import sys
+import tempfile
+
+import cache
+import graph
+
+# Manifest of prepared graphs: path -> size, sha256 digest and generation parameters
+manifestName = os.path.join(graph.GRAPH_DIRECTORY, "manifest.json")
+manifestVersion = 1
+
+# Graph parameters: (nnode, nedge, seed) for random DAGs,
+# (nnode, nedge, seed, family, weights) for graph families
+def graphFiles(params):
+    if len(params) > 3:
+        gname = graph.familyName(params[3], params[0], params[1], params[2], params[4])
+    else:
+        gname = graph.graphName(*params)
+    return [gname, graph.binaryName(gname)]
+
+# Parameters of every graph referenced by the test drivers, without duplicates
+def referencedGraphs():
+    import benchmark
+    import regress
+    specs = [benchmark.benchmarkDict[t] for t in benchmark.benchmarkDict]
+    specs += [benchmark.benchmarkDict[t] for t in benchmark.scalingList]
+    specs += regress.regressionList
+    unique = []
+    for p in specs:
+        if tuple(p) not in unique:
+            unique.append(tuple(p))
+    return unique
+
+def loadManifest():
+    try:
+        with open(manifestName, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("version") != manifestVersion:
+        return {}
+    return manifest.get("graphs", {})
+
+def saveManifest(entries):
+    os.makedirs(graph.GRAPH_DIRECTORY, exist_ok = True)
+    fd, tmpPath = tempfile.mkstemp(dir = graph.GRAPH_DIRECTORY, suffix = ".tmp")
+    with os.fdopen(fd, 'w') as f:
+        json.dump({"version": manifestVersion, "graphs": entries}, f, indent = 1, sort_keys = True)
+    os.replace(tmpPath, manifestName)
+
+def manifestKey(fname):
+    return os.path.normpath(fname)
+
+# Problems with the files of one graph, empty if they all match the manifest
+def checkGraph(params, entries):
+    problems = []
+    for fname in graphFiles(params):
+        entry = entries.get(manifestKey(fname))
+        if entry is None:
+            # generators without NumPy write no binary file
+            if not fname.endswith(graph.BINARY_SUFFIX) or os.path.exists(fname):
+                problems.append("%s is not in the manifest" % fname)
+            continue
+        try:
+            size = os.path.getsize(fname)
+        except OSError:
+            problems.append("%s is missing" % fname)
+            continue
+        if size != entry["size"]:
+            problems.append("%s has %d bytes, expected %d" % (fname, size, entry["size"]))
+        elif cache.fileDigest(fname) != entry["sha256"]:
+            problems.append("%s doesn't match its recorded hash" % fname)
+    return problems
+
+# Problems with the given graphs, empty if all are prepared
+def validate(specs):
+    entries = loadManifest()
+    problems = []
+    for p in specs:
+        problems += checkGraph(p, entries)
+    return problems
+
+# Generate one graph in a worker process, returning its manifest entries
+def buildGraph(params):
+    if len(params) > 3:
+        nnode, nedge, seed, family, weights = params
+        # already running in a pool worker
+        graph.generate_family(family, nnode, nedge, seed, weights, workers = 1)
+    else:
+        graph.generate_graph(*params)
+    entries = {}
+    for fname in graphFiles(params):
+        if os.path.exists(fname):
+            entries[manifestKey(fname)] = {"size": os.path.getsize(fname), "sha256": cache.fileDigest(fname),
+                                           "params": list(params)}
+    return entries
+
+# Build the graphs that don't match the manifest (all of them with force), jobs at a time
+def prepare(specs, jobs = None, force = False):
+    entries = loadManifest()
+    todo = [p for p in specs if force or len(checkGraph(p, entries)) > 0]
+    if len(todo) == 0:
+        sys.stderr.write("All %d graphs are prepared\n" % len(specs))
+        return True
+    ok = True
+    with concurrent.futures.ProcessPoolExecutor(max_workers = jobs) as pool:
+        futures = {pool.submit(buildGraph, p): p for p in todo}
+        for future in concurrent.futures.as_completed(futures):
+            p = futures[future]
+            try:
+                entries.update(future.result())
+                sys.stderr.write("Prepared %s\n" % graphFiles(p)[0])
+            except Exception as e:
+                sys.stderr.write("Couldn't generate %s: %s\n" % (graphFiles(p)[0], e))
+                ok = False
+    saveManifest(entries)
+    return ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Generate all benchmark and regression graphs")
+    parser.add_argument("-j", "--jobs", type=int,
+                    help="Worker processes (default: number of processors)")
+    parser.add_argument("-f", "--force", action="store_true",
+                    help="Regenerate graphs even if they match the manifest")
+    parser.add_argument("-c", "--check", action="store_true",
+                    help="Only check graphs against the manifest")
+    args = parser.parse_args()
+
+    specs = referencedGraphs()
+    if args.check:
+        problems = validate(specs)
+        for msg in problems:
+            sys.stderr.write(msg + "\n")
+        sys.stderr.write("%d graphs, %d problems\n" % (len(specs), len(problems)))
+        sys.exit(1 if problems else 0)
+    sys.exit(0 if prepare(specs, args.jobs, args.force) else 1)
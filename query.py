@@ -0,0 +1,113 @@
+#!/usr/bin/python
+# Client for the distance query server started with johnson_seq/johnson_omp -Q SOCKET
+# Requests are text lines; replies are "OK n" followed by n native int32 values (see server.cpp)
+
+import argparse
+import array
+import socket
+import sys
+import time
+
+# Distance of unreachable nodes
+IntMax = 2147483647
+
+class QueryError(Exception):
+    pass
+
+class QueryClient:
+    def __init__(self, socketPath):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socketPath)
+        self.reader = self.sock.makefile('rb')
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Send one request line and return the int32 values of the reply
+    def request(self, line):
+        self.sock.sendall((line + "\n").encode())
+        reply = self.reader.readline().decode().split(None, 1)
+        if len(reply) == 0:
+            raise QueryError("server closed the connection")
+        if reply[0] != "OK":
+            raise QueryError(reply[1].strip() if len(reply) > 1 else "malformed reply")
+        count = int(reply[1])
+        values = array.array('i')
+        data = self.reader.read(count * values.itemsize)
+        if len(data) != count * values.itemsize:
+            raise QueryError("short reply")
+        values.frombytes(data)
+        return values
+
+    def info(self):
+        nnode, nedge, cached, hitsLow, hitsHigh, missesLow, missesHigh = self.request("INFO")
+        # 64-bit counters come as low and high 32-bit halves
+        hits = (hitsHigh << 32) | (hitsLow & 0xffffffff)
+        misses = (missesHigh << 32) | (missesLow & 0xffffffff)
+        return {"nnode": nnode, "nedge": nedge, "cached": cached, "hits": hits, "misses": misses}
+
+    # Distances from src to every node (IntMax if unreachable)
+    def row(self, src):
+        return self.request("ROW %d" % src)
+
+    def rows(self, sources):
+        if len(sources) == 0:
+            return []
+        values = self.request("ROWS " + " ".join(str(s) for s in sources))
+        n = len(values) // len(sources)
+        return [values[i * n:(i + 1) * n] for i in range(len(sources))]
+
+    def distance(self, src, dst):
+        return self.request("DIST %d %d" % (src, dst))[0]
+
+    def shutdown(self):
+        self.request("SHUTDOWN")
+
+# Connect to a server that may still be loading its graph
+def waitForServer(socketPath, timeout = 60.0, process = None):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            return QueryClient(socketPath)
+        except OSError:
+            if process is not None and process.poll() is not None:
+                raise QueryError("server exited with return code %d" % process.returncode)
+            if time.perf_counter() > deadline:
+                raise QueryError("no server listening on %s" % socketPath)
+            time.sleep(0.05)
+
+def formatDistance(d):
+    return "inf" if d == IntMax else str(d)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Query a running distance server")
+    parser.add_argument("-s", "--socket", type=str, required=True,
+                    help="Unix socket of the server")
+    parser.add_argument("request", choices=["row", "rows", "dist", "info", "shutdown"])
+    parser.add_argument("nodes", type=int, nargs="*")
+    args = parser.parse_args()
+
+    try:
+        with QueryClient(args.socket) as client:
+            if args.request == "row" or args.request == "rows":
+                for row in client.rows(args.nodes):
+                    print(" ".join(formatDistance(d) for d in row))
+            elif args.request == "dist":
+                if len(args.nodes) != 2:
+                    parser.error("dist needs a source and a destination")
+                print(formatDistance(client.distance(*args.nodes)))
+            elif args.request == "info":
+                for k, v in client.info().items():
+                    print("%s: %d" % (k, v))
+            else:
+                client.shutdown()
+    except (OSError, QueryError) as e:
+        sys.stderr.write("Query failed: %s\n" % e)
+        sys.exit(1)
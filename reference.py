@@ -0,0 +1,101 @@
+#!/usr/bin/python
+# In-process Johnson's algorithm in NumPy, used as a reference solver by regress.py
+# Bellman-Ford relaxes the whole edge array per pass, Dijkstra uses a binary heap over the CSR arrays
+
+import argparse
+import heapq
+import sys
+
+import numpy as np
+
+from graph import readGraph, readBinaryGraph, BINARY_SUFFIX
+
+# Same marker the solvers use for unreachable nodes
+IntMax = 2**31 - 1
+
+# Load a .txt or .csr graph as CSR arrays (node offsets, edge targets, weights)
+def loadCSR(gname):
+    if gname.endswith(BINARY_SUFFIX):
+        nnode, nedge, node, edge, weight = readBinaryGraph(gname)
+        return nnode, np.asarray(node, dtype=np.int64), np.asarray(edge, dtype=np.int64), np.asarray(weight, dtype=np.int64)
+    nnode, nedge, res = readGraph(gname)
+    order = np.argsort(res[:, 0], kind="stable")
+    res = res[order]
+    node = np.zeros(nnode + 1, dtype=np.int64)
+    np.cumsum(np.bincount(res[:, 0], minlength=nnode), out=node[1:])
+    return nnode, node, res[:, 1].copy(), res[:, 2].copy()
+
+# Potentials from a virtual source with 0-weight edges to every node.
+# Edges are grouped by target so each pass is one gather and one minimum.reduceat.
+def bellmanFord(nnode, node, edge, weight):
+    src = np.repeat(np.arange(nnode, dtype=np.int64), np.diff(node))
+    order = np.argsort(edge, kind="stable")
+    src, dst, w = src[order], edge[order], weight[order]
+    targets, starts = np.unique(dst, return_index=True)
+
+    distance = np.zeros(nnode, dtype=np.int64)
+    for _ in range(nnode + 1):
+        if len(dst) == 0:
+            return distance
+        best = np.minimum.reduceat(distance[src] + w, starts)
+        improved = best < distance[targets]
+        if not improved.any():
+            return distance
+        distance[targets[improved]] = best[improved]
+    raise ValueError("Graph contains negative weight cycle")
+
+# Single-source distances over the reweighted (non-negative) edges
+def dijkstra(nnode, node, edge, new_weight, src_nid):
+    tmp_distance = [IntMax] * nnode
+    tmp_distance[src_nid] = 0
+    visited = [False] * nnode
+    heap = [(0, src_nid)]
+    while heap:
+        d, u = heapq.heappop(heap)
+        if visited[u]:
+            continue
+        visited[u] = True
+        for eid in range(node[u], node[u+1]):
+            v = edge[eid]
+            nd = d + new_weight[eid]
+            if nd < tmp_distance[v]:
+                tmp_distance[v] = nd
+                heapq.heappush(heap, (nd, v))
+    return tmp_distance
+
+# All-pairs distance matrix (int64, IntMax where unreachable)
+def johnson(gname):
+    return johnsonCSR(*loadCSR(gname))
+
+# Same for int64 CSR arrays
+def johnsonCSR(nnode, node, edge, weight):
+    h = bellmanFord(nnode, node, edge, weight)
+    src = np.repeat(np.arange(nnode, dtype=np.int64), np.diff(node))
+    new_weight = weight + h[src] - h[edge]
+
+    nodeList, edgeList, newWeightList = node.tolist(), edge.tolist(), new_weight.tolist()
+    distance = np.full((nnode, nnode), IntMax, dtype=np.int64)
+    for s in range(nnode):
+        row = np.array(dijkstra(nnode, nodeList, edgeList, newWeightList, s), dtype=np.int64)
+        reached = row != IntMax
+        # undo the reweighting: d(s, v) = d'(s, v) - h[s] + h[v]
+        distance[s, reached] = row[reached] - h[s] + h[reached]
+    return distance
+
+# Same text layout as the solvers' -P output
+def printMatrix(distance, f=sys.stdout):
+    for row in distance:
+        f.write("".join("  inf" if d == IntMax else "%5d" % d for d in row) + "\n")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-g", "--graphFileName", type=str, required=True,
+                    help="Graph file (.txt or .csr)")
+    parser.add_argument("-P", "--print", action="store_true",
+                    help="Print the distance matrix")
+
+    args = parser.parse_args()
+
+    distance = johnson(args.graphFileName)
+    if args.print:
+        printMatrix(distance)
@@ -3,21 +3,36 @@
 # Code adapted from https://github.com/cmu15418/asst3-s20/blob/master/code/regress.py
 
 import argparse
+import concurrent.futures
 import subprocess
 import sys
 import math
+import mmap
 import os
 import os.path
 import getopt
+import threading
 from datetime import datetime
 
-from graph import generate_graph, graphName
+import cache
+import graph
+import prepare
+from graph import graphName, readDistance, writeDistance, DISTANCE_SUFFIX
 
 # General information
 
 # Gold-standard reference program
 standardProg = "./johnson_boost"
 
+# Compare -P text outputs with checkFiles instead of -B matrices (-P)
+textOutput = False
+
+# Suffix of solver outputs
+TEXT_SUFFIX = ".out"
+
+# Reference backend: "boost" runs standardProg, "numpy" solves in-process with reference.py
+referenceBackend = "boost"
+
 # Simulator being tested
 testProg = "./johnson_seq"
 ompTestProg = "./johnson_omp"
@@ -32,6 +47,9 @@ cacheDir = "./regression-cache"
 # Limit on how many mismatches get reported
 mismatchLimit = 5
 
+# Bytes compared at a time by checkFiles and compareMatrices
+compareBlock = 1 << 20
+
 # Series of tests to perform.
 # Each defined by:
 #  nnode, nnedge, seed
@@ -49,9 +67,14 @@ def regressionName(params, standard = True, short = False, graphFileName = None)
         name = "n{}-e{}-s{}.txt".format(nnode, nedge, seed)
     if short:
         return name
+    # solver outputs are binary distance matrices, or text with -P
+    name = os.path.splitext(name)[0] + outputSuffix()
     return ("ref" if standard else "tst") +  "-" + name
 
-def regressionCommand(graphFileName, standard = True, threadCount = 1, gpu = False):
+def outputSuffix():
+    return TEXT_SUFFIX if textOutput else DISTANCE_SUFFIX
+
+def regressionCommand(graphFileName, standard = True, threadCount = 1, gpu = False, ompThreads = None, distanceFileName = None):
     #nnode, nedge, seed = params
 
     #graphFileName = graphName(nnode, nedge, seed)
@@ -75,95 +98,245 @@ def regressionCommand(graphFileName, standard = True, threadCount = 1, gpu = Fal
     elif gpu:
         pass # any additional arg goes here
     elif threadCount > 1:
-        cmd += ["-t", str(threadCount)]
+        cmd += ["-t", str(ompThreads or threadCount)]
 
-    cmd += ["-P"]
+    if distanceFileName is not None:
+        cmd += ["-B", distanceFileName]
+    else:
+        cmd += ["-P"]
 
     return cmd
 
-def runImpl(params, standard = True, threadCount = 1, gpu = False, graphFileName=None):
+# Graphs of regressionList are built by prepare.py and checked against its manifest in run
+def regressionGraph(params, graphFileName = None):
     if graphFileName is None:
         nnode, nedge, seed = params
         graphFileName = graphName(nnode, nedge, seed)
+    return graphFileName
 
-        if not os.path.exists(graphFileName):
-            # generate graph
-            sys.stderr.write("Generating graph: %s \n" % str(graphFileName))
-            generate_graph(nnode, nedge, seed)
+# When log is given, messages and the child's stderr go to it instead of sys.stderr
+def runImpl(params, standard = True, threadCount = 1, gpu = False, graphFileName=None, ompThreads = None, log = None):
+    write = sys.stderr.write if log is None else log.append
+    if graphFileName is None:
+        graphFileName = regressionGraph(params)
 
         pname = cacheDir + "/" + regressionName(params, standard)
     else:
         pname = cacheDir + "/" + regressionName(params, standard, graphFileName=graphFileName)
 
-    cmd = regressionCommand(graphFileName, standard, threadCount, gpu)
+    cmd = regressionCommand(graphFileName, standard, threadCount, gpu, ompThreads, None if textOutput else pname)
     cmdLine = " ".join(cmd)
+    env = None
+    if ompThreads is not None:
+        env = dict(os.environ, OMP_NUM_THREADS = str(ompThreads))
 
     try:
-        outFile = open(pname, 'w')
+        # never leave a stale result behind if the solver fails
+        if os.path.exists(pname):
+            os.remove(pname)
+        write("[" + datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f") + "] " + "Executing " + cmdLine + (" > " + pname if textOutput else "") + "\n")
+        pipe = None if log is None else subprocess.PIPE
+        outFile = open(pname, 'wb') if textOutput else None
+        try:
+            graphProcess = subprocess.Popen(cmd, env = env, stdout = outFile or pipe, stderr = pipe)
+            output, errors = graphProcess.communicate()
+        finally:
+            if outFile is not None:
+                outFile.close()
+        for text in (output, errors):
+            if text:
+                write(text.decode("utf-8", "ignore"))
     except Exception as e:
-        sys.stderr.write("Couldn't open file '%s' to write.  %s\n" % (pname, e))
+        write("Couldn't execute " + cmdLine + " " + str(e) + "\n")
         return False
-    try:
-        sys.stderr.write("[" + datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f") + "] " + "Executing " + cmdLine + " > " + regressionName(params, standard, graphFileName=graphFileName) + "\n")
-        graphProcess = subprocess.Popen(cmd, stdout = outFile)
-        graphProcess.wait()
-        outFile.close()
-    except Exception as e:
-        sys.stderr.write("Couldn't execute " + cmdLine + " > " + regressionName(params, standard, graphFileName=graphFileName) + " " + str(e) + "\n")
-        outFile.close()
+    if graphProcess.returncode != 0 or not os.path.exists(pname):
+        write("Execution of " + cmdLine + " gave return code %d\n" % graphProcess.returncode)
         return False
     return True
 
+# Parse text rows of a -P output into int64 values, with "inf" as IntMax
+def parseRows(text):
+    import numpy as np
+    from reference import IntMax
+    return [np.array(line.replace(b"inf", str(IntMax).encode()).split(), dtype=np.int64)
+            for line in text.split(b"\n")[:-1]]
+
+# Report differing cells of parsed rows, returning the number of mismatched cells
+def compareRows(refRows, testRows, firstRow, reported):
+    import numpy as np
+    bad = 0
+    for i, (rrow, trow) in enumerate(zip(refRows, testRows)):
+        if len(rrow) != len(trow):
+            if reported + bad < mismatchLimit:
+                sys.stderr.write("Mismatch at row %d.  Expected %d columns, got %d\n" % (firstRow + i, len(rrow), len(trow)))
+            bad += max(len(rrow), len(trow))
+            continue
+        for col in np.flatnonzero(rrow != trow):
+            bad += 1
+            if reported + bad <= mismatchLimit:
+                sys.stderr.write("Mismatch at row %d, column %d.  Expected %d, got %d\n" % (firstRow + i, col, rrow[col], trow[col]))
+    if len(refRows) != len(testRows):
+        if reported + bad < mismatchLimit:
+            sys.stderr.write("Mismatch at row %d.  Expected %d rows, got %d\n" % (firstRow + min(len(refRows), len(testRows)), firstRow + len(refRows), firstRow + len(testRows)))
+        bad += abs(len(refRows) - len(testRows))
+    return bad
+
+# Offset just past the count-th newline at or after start, or -1
+def skipLines(m, start, count):
+    pos = start
+    for _ in range(count):
+        pos = m.find(b"\n", pos)
+        if pos < 0:
+            return -1
+        pos += 1
+    return pos
+
+# Compare two -P outputs.  Both files are mapped and compared in blocks of whole rows;
+# only rows of differing blocks are parsed into integers to locate mismatching cells.
 def checkFiles(refPath, testPath):
-    badLines = 0
-    lineNumber = 0
     try:
-        rf = open(refPath, 'r')
+        rf = open(refPath, 'rb')
     except:
-        sys.sterr.write("Couldn't open reference file '%s'\n" % refPath);
+        sys.stderr.write("Couldn't open reference file '%s'\n" % refPath);
         return False
     try:
-        tf = open(testPath, 'r')
+        tf = open(testPath, 'rb')
     except:
         sys.stderr.write("Couldn't open test file '%s'\n" % testPath);
+        rf.close()
         return False
-    while True:
-        rline = rf.readline()
-        tline = tf.readline()
-        lineNumber +=1
-        if rline == "":
-            if tline == "":
-                break
-            else:
-                badLines += 1
-                sys.stderr.write("Mismatch at line %d.  File %s ended prematurely\n" % (lineNumber, refPath))
-                break
-        elif tline == "":
-            badLines += 1
-            sys.stderr.write("Mismatch at line %d.  File %s ended prematurely\n" % (lineNumber, testPath))
-            break
-        if rline[-1] == '\n':
-            rline = rline[:-1]
-        if tline[-1] == '\n':
-            tline = tline[:-1]
-        if rline != tline:
-            badLines += 1
-            if badLines <= mismatchLimit:
-                sys.stderr.write("Mismatch at line %d.\n" % (lineNumber))
-                # sys.stderr.write("Mismatch at line %d.  File %s:'%s'.  File %s:'%s'\n" % (lineNumber, refPath, rline, testPath, tline))
-    rf.close()
-    tf.close()
-    if badLines > 0:
-        sys.stderr.write("%d total mismatches.  Files %s, %s\n" % (badLines, refPath, testPath))
-    return badLines == 0
+    with rf, tf:
+        rsize = os.fstat(rf.fileno()).st_size
+        tsize = os.fstat(tf.fileno()).st_size
+        if rsize == 0 or tsize == 0:
+            same = rsize == tsize
+            if not same:
+                sys.stderr.write("Mismatch at row 0.  File %s ended prematurely\n" % (refPath if rsize == 0 else testPath))
+            return same
+        rm = mmap.mmap(rf.fileno(), 0, access = mmap.ACCESS_READ)
+        tm = mmap.mmap(tf.fileno(), 0, access = mmap.ACCESS_READ)
+        with rm, tm:
+            badCells = 0
+            row = 0
+            rpos, tpos = 0, 0
+            while rpos < rsize and tpos < tsize:
+                # end the block on a row boundary of the reference file
+                rend = rm.rfind(b"\n", rpos, min(rpos + compareBlock, rsize))
+                if rend < 0:
+                    rend = rm.find(b"\n", rpos)
+                rend = rsize if rend < 0 else rend + 1
+                block = rm[rpos:rend]
+                tend = tpos + len(block)
+                if tm[tpos:tend] == block:
+                    row += block.count(b"\n")
+                    rpos, tpos = rend, tend
+                    continue
+                # rows differ somewhere in this block
+                nrow = block.count(b"\n")
+                tend = skipLines(tm, tpos, nrow)
+                if tend < 0:
+                    tend = tsize
+                badCells += compareRows(parseRows(block), parseRows(tm[tpos:tend]), row, badCells)
+                row += nrow
+                rpos, tpos = rend, tend
+            if rpos < rsize or tpos < tsize:
+                badCells += 1
+                sys.stderr.write("Mismatch at row %d.  File %s ended prematurely\n" % (row, testPath if rpos < rsize else refPath))
+    if badCells > 0:
+        sys.stderr.write("%d total mismatches.  Files %s, %s\n" % (badCells, refPath, testPath))
+    return badCells == 0
+
+# Report the first mismatching cells of two distance matrices
+def compareMatrices(refMatrix, testMatrix, refPath, testPath):
+    import numpy as np
+    if testMatrix.shape != refMatrix.shape:
+        sys.stderr.write("Mismatch in matrix size %s vs %s.  Files %s, %s\n" % (refMatrix.shape, testMatrix.shape, refPath, testPath))
+        return False
+    badCells = 0
+    # compare a block of rows at a time to bound temporary memory
+    rowBlock = max(1, compareBlock // (4 * max(1, refMatrix.shape[1])))
+    for start in range(0, refMatrix.shape[0], rowBlock):
+        rows, cols = np.nonzero(refMatrix[start:start+rowBlock] != testMatrix[start:start+rowBlock])
+        for r, c in zip(rows[:max(0, mismatchLimit - badCells)], cols):
+            sys.stderr.write("Mismatch at row %d, column %d.  Expected %d, got %d\n" % (start + r, c, refMatrix[start + r, c], testMatrix[start + r, c]))
+        badCells += len(rows)
+    if badCells > 0:
+        sys.stderr.write("%d total mismatches.  Files %s, %s\n" % (badCells, refPath, testPath))
+    return badCells == 0
+
+# Compare two -B distance files as arrays
+def checkDistanceFiles(refPath, testPath):
+    try:
+        refMatrix = readDistance(refPath)
+    except Exception as e:
+        sys.stderr.write("Couldn't read reference file '%s'. %s\n" % (refPath, e))
+        return False
+    return checkMatrix(refMatrix, testPath, refPath)
+
+# Compare a reference distance matrix against a -B test output file
+def checkMatrix(refMatrix, testPath, refPath = "reference"):
+    try:
+        testMatrix = readDistance(testPath)
+    except Exception as e:
+        sys.stderr.write("Couldn't read test file '%s'. %s\n" % (testPath, e))
+        return False
+    return compareMatrices(refMatrix, testMatrix, refPath, testPath)
+
+def checkOutputs(refPath, testPath):
+    return checkFiles(refPath, testPath) if textOutput else checkDistanceFiles(refPath, testPath)
+
+# Result cache key of the reference answer for a graph, or None if a file can't be hashed
+def referenceKey(gname):
+    if referenceBackend == "numpy":
+        import reference
+        programs = [reference.__file__, graph.__file__]
+    else:
+        programs = [standardProg]
+    try:
+        return cache.cacheKey(gname, programs, referenceBackend)
+    except OSError:
+        return None
+
+# Path of the reference distance file for a graph, running the reference solver
+# only when the result cache has no valid entry.  Returns None on failure.
+def referenceResult(params, graphFileName = None, log = None):
+    write = sys.stderr.write if log is None else log.append
+    gname = regressionGraph(params, graphFileName)
+    key = referenceKey(gname)
+    if key is None:
+        write("Couldn't hash graph '%s' or reference solver\n" % gname)
+        return None
+    refPath = cache.lookup(key, outputSuffix())
+    if refPath is not None:
+        return refPath
+
+    if referenceBackend == "numpy":
+        from reference import johnson
+        write("[" + datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f") + "] " + "Solving " + gname + " in-process\n")
+        try:
+            distance = johnson(gname)
+        except Exception as e:
+            write("Reference solver failed. %s\n" % e)
+            return None
+        pname = cache.scratchPath(outputSuffix())
+        if textOutput:
+            from reference import printMatrix
+            with open(pname, 'w') as f:
+                printMatrix(distance, f)
+        else:
+            writeDistance(pname, distance)
+    else:
+        if not runImpl(params, standard = True, gpu = False, graphFileName = graphFileName, log = log):
+            return None
+        pname = cacheDir + "/" + regressionName(params, standard = True, graphFileName = graphFileName)
+    return cache.store(key, outputSuffix(), pname)
 
 def regress(params, threadCount, gpu, graphFileName=None):
     sys.stderr.write("+++++++++++++++++ Regression %s +++++++++++++++\n" % regressionName(params, standard=True, short=True, graphFileName=graphFileName))
-    refPath = cacheDir + "/" + regressionName(params, standard = True, graphFileName = graphFileName)
-    if not os.path.exists(refPath):
-        if not runImpl(params, standard = True, gpu = False, graphFileName = graphFileName):
-            sys.stderr.write("Failed to run with reference solver\n")
-            return False
+    refPath = referenceResult(params, graphFileName)
+    if refPath is None:
+        sys.stderr.write("Failed to run with reference solver\n")
+        return False
 
     if not runImpl(params, standard = False, threadCount = threadCount, gpu = gpu, graphFileName = graphFileName):
         sys.stderr.write("Failed to run with test solver\n")
@@ -171,22 +344,35 @@ def regress(params, threadCount, gpu, graphFileName=None):
 
     testPath = cacheDir + "/" + regressionName(params, standard = False, graphFileName = graphFileName)
 
-    return checkFiles(refPath, testPath)
+    return checkOutputs(refPath, testPath)
 
-def run(flushCache, threadCount, gpu=False, graphFileName=None):
+def run(flushCache, threadCount, gpu=False, graphFileName=None, jobCount=1):
 
-    if flushCache and os.path.exists(cacheDir):
-        try:
-            graphProcess = subprocess.Popen(["rm", "-rf", cacheDir])
-            graphProcess.wait()
-        except Exception as e:
-            sys.stderr.write("Could not flush old result cache: %s" % str(e))
+    if flushCache:
+        for d in (cacheDir, cache.cacheDir):
+            if not os.path.exists(d):
+                continue
+            try:
+                graphProcess = subprocess.Popen(["rm", "-rf", d])
+                graphProcess.wait()
+            except Exception as e:
+                sys.stderr.write("Could not flush old result cache: %s" % str(e))
     if not os.path.exists(cacheDir):
         try:
             os.mkdir(cacheDir)
         except Exception as e:
             sys.stderr.write("Couldn't create directory '%s'" % cacheDir)
             sys.exit(1)
+    if graphFileName is None:
+        problems = prepare.validate(regressionList)
+        if len(problems) > 0:
+            for msg in problems:
+                sys.stderr.write(msg + "\n")
+            sys.stderr.write("Graphs are not prepared.  Run 'python3 prepare.py' first\n")
+            sys.exit(1)
+    if jobCount > 1:
+        runParallel(jobCount, threadCount, gpu, graphFileName)
+        return
     goodCount = 0
     allCount = 0
     if graphFileName is not None:
@@ -210,6 +396,166 @@ def run(flushCache, threadCount, gpu=False, graphFileName=None):
     message = "SUCCESS" if goodCount == totalCount else "FAILED"
     sys.stderr.write("Regression set size %d.  %d/%d tests successful. %s\n" % (totalCount, goodCount, allCount, message))
 
+# Randomized in-process cases (--random): small directed graphs with cycles, self loops and
+# parallel edges, solved through libjohnson.so with every algorithm and engine and compared
+# with the NumPy reference.  Most graphs get negative edges without negative cycles by
+# shifting non-negative weights with random potentials; the rest may contain negative cycles,
+# which every solver must then report.
+randomMaxNodes = 40
+
+def randomGraph(rng, maxNodes):
+    import numpy as np
+    nnode = int(rng.integers(1, maxNodes + 1))
+    nedge = int(rng.integers(0, 4 * nnode + 1))
+    src = np.sort(rng.integers(0, nnode, nedge))
+    dst = rng.integers(0, nnode, nedge)
+    if rng.random() < 0.8:
+        h = rng.integers(-10, 11, nnode)
+        weight = rng.integers(0, 20, nedge) + h[src] - h[dst]
+    else:
+        weight = rng.integers(-3, 20, nedge)
+    node = np.zeros(nnode + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=nnode), out=node[1:])
+    return nnode, node, dst.astype(np.int64), weight.astype(np.int64)
+
+def randomRegress(count, seed, threadCount):
+    import numpy as np
+    import reference
+    import solver
+    solvers = [("johnson", e) for e in solver.engineChoices] + [("floyd", None)]
+    rng = np.random.default_rng(seed)
+    failed = 0
+    tstart = datetime.now()
+    for case in range(count):
+        nnode, node, edge, weight = randomGraph(rng, randomMaxNodes)
+        try:
+            expected = reference.johnsonCSR(nnode, node, edge, weight)
+        except ValueError:
+            expected = None
+        for algorithm, engine in solvers:
+            msg = None
+            try:
+                distance, _ = solver.solve(node, edge, weight, algorithm, engine, threadCount)
+                if expected is None:
+                    msg = "missed a negative cycle"
+                elif not np.array_equal(distance, expected):
+                    r, c = np.argwhere(distance != expected)[0]
+                    msg = "row %d, column %d: expected %d, got %d" % (r, c, expected[r, c], distance[r, c])
+            except solver.NegativeCycleError:
+                if expected is not None:
+                    msg = "reported a negative cycle"
+            if msg is not None:
+                failed += 1
+                gname = cacheDir + "/random-s%d-c%d.txt" % (seed, case)
+                src = np.repeat(np.arange(nnode), np.diff(node))
+                graph.writeEdges(gname, nnode, len(edge), np.stack([src, edge, weight], axis=1))
+                sys.stderr.write("Case %d (%s) failed with %s%s: %s\n" % (case, gname, algorithm, "/" + engine if engine else "", msg))
+                break
+    secs = (datetime.now() - tstart).total_seconds()
+    message = "SUCCESS" if failed == 0 else "FAILED"
+    sys.stderr.write("Random set size %d, seed %d.  %d/%d cases successful in %.2f secs. %s\n" % (count, seed, count - failed, count, secs, message))
+    return failed == 0
+
+# Hands out cores to jobs so that the running jobs never use more than the total
+class CoreBudget:
+    def __init__(self, cores):
+        self.free = cores
+        self.cond = threading.Condition()
+
+    def acquire(self, n):
+        with self.cond:
+            while self.free < n:
+                self.cond.wait()
+            self.free -= n
+
+    def release(self, n):
+        with self.cond:
+            self.free += n
+            self.cond.notify_all()
+
+# Run one solver under the core budget, returning (result, log lines).
+# The result is the reference file path (or None) for reference jobs, success for test jobs.
+def runJob(budget, cores, params, standard, threadCount, gpu, graphFileName):
+    log = []
+    budget.acquire(cores)
+    try:
+        if standard:
+            return referenceResult(params, graphFileName, log), log
+        ok = runImpl(params, standard, threadCount, gpu, graphFileName,
+                     ompThreads = None if standard or gpu else cores, log = log)
+        return ok, log
+    finally:
+        budget.release(cores)
+
+# Result and log of a finished job; a job that raised counts as failed, with the error in its log
+def jobResult(job):
+    try:
+        return job.result()
+    except Exception as e:
+        return None, ["Job failed: %s\n" % e]
+
+# Parallel version of run: reference and test runs are independent jobs on a pool of jobCount workers.
+# Each graph is checked as soon as both its jobs finish.
+def runParallel(jobCount, threadCount, gpu=False, graphFileName=None):
+    budget = CoreBudget(jobCount)
+    testCores = 1 if gpu else max(1, min(threadCount, jobCount))
+    if graphFileName is not None:
+        rlist = [None]
+    else:
+        rlist = regressionList
+
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers = jobCount)
+    refJobs = {}
+    pending = {}
+    for p in rlist:
+        key = referenceKey(regressionGraph(p, graphFileName))
+        refPath = cache.lookup(key, outputSuffix()) if key is not None else None
+        refJob = None
+        if refPath is None:
+            # graphs sharing a reference cache entry share its job
+            if key not in refJobs:
+                refJobs[key] = pool.submit(runJob, budget, 1, p, True, 1, False, graphFileName)
+            refJob = refJobs[key]
+        testJob = pool.submit(runJob, budget, testCores, p, False, threadCount, gpu, graphFileName)
+        pending[testJob] = (p, refPath, refJob)
+
+    goodCount = 0
+    printed = set()
+    waiting = set(pending) | set(refJobs.values())
+    while pending:
+        _, waiting = concurrent.futures.wait(waiting, return_when = concurrent.futures.FIRST_COMPLETED)
+        for testJob, (p, refPath, refJob) in list(pending.items()):
+            if not testJob.done() or (refJob is not None and not refJob.done()):
+                continue
+            del pending[testJob]
+            name = regressionName(p, standard = False, graphFileName = graphFileName)
+            sys.stderr.write("+++++++++++++++++ Regression %s +++++++++++++++\n" % regressionName(p, standard=True, short=True, graphFileName=graphFileName))
+            # a reference job shared by several graphs is logged with the first of them
+            for job in (refJob, testJob):
+                if job is not None and job not in printed:
+                    printed.add(job)
+                    sys.stderr.write("".join(jobResult(job)[1]))
+            testPath = cacheDir + "/" + name
+            if refJob is not None:
+                refPath = jobResult(refJob)[0]
+            if refPath is None:
+                sys.stderr.write("Failed to run with reference solver\n")
+                ok = False
+            elif not jobResult(testJob)[0]:
+                sys.stderr.write("Failed to run with test solver\n")
+                ok = False
+            else:
+                ok = checkOutputs(refPath, testPath)
+            if ok:
+                sys.stderr.write("Regression %s Passed\n" % name)
+                goodCount += 1
+            else:
+                sys.stderr.write("Regression %s Failed\n" % name)
+    pool.shutdown()
+    totalCount = len(rlist)
+    message = "SUCCESS" if goodCount == totalCount else "FAILED"
+    sys.stderr.write("Regression set size %d.  %d/%d tests successful. %s\n" % (totalCount, goodCount, totalCount, message))
+
 def str_to_bool(value):
     if isinstance(value, bool):
         return value
@@ -229,6 +575,16 @@ if __name__ == "__main__":
                     help="Run johnson-cuda")
     parser.add_argument("-g", "--graphFileName", type=str,
                     help="Specify graph to run")
+    parser.add_argument("-j", "--jobs", type=int,
+                    help="Run reference and test solvers in parallel on this many cores")
+    parser.add_argument("-R", "--reference", type=str, choices=["boost", "numpy"],
+                    help="Reference solver: johnson_boost binary (default) or in-process NumPy")
+    parser.add_argument("-P", "--text", action="store_true",
+                    help="Compare -P text outputs instead of binary -B matrices")
+    parser.add_argument("--random", type=int,
+                    help="Check this many random graphs in-process through libjohnson.so instead")
+    parser.add_argument("--seed", type=int, default=1,
+                    help="Seed of the random graphs (default 1)")
 
     args = parser.parse_args()
 
@@ -236,5 +592,14 @@ if __name__ == "__main__":
     flushCache = args.flushCache or False
     gpu = args.gpu or False
     graphFileName = args.graphFileName
+    referenceBackend = args.reference or referenceBackend
+    textOutput = args.text
+
+    jobCount = args.jobs or 1
+
+    if args.random is not None:
+        if not os.path.exists(cacheDir):
+            os.mkdir(cacheDir)
+        sys.exit(0 if randomRegress(args.random, args.seed, args.threadCount or 0) else 1)
 
-    run(flushCache, threadCount, gpu, graphFileName)
+    run(flushCache, threadCount, gpu, graphFileName, jobCount)
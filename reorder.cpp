@@ -0,0 +1,297 @@
+#include "johnson.hpp"
+#include <string.h>
+#include <algorithm>
+#include <vector>
+
+node_order_t node_order = ORDER_NONE;
+
+const char *node_order_name[ORDER_COUNT] = { "none", "rcm", "degree", "reuse" };
+
+// Nodes that stay in the window of the reuse ordering (Gorder's default)
+#define ReuseWindow 5
+
+// Out- and in-edges of every node as one CSR, for orderings that ignore direction
+static void Undirected(Graph *graph, std::vector<int> &adj_node, std::vector<int> &adj) {
+    int nnode = graph->nnode;
+    adj_node.assign(nnode + 1, 0);
+    for (int u = 0; u < nnode; u++)
+        for (int eid = graph->node[u]; eid < graph->node[u+1]; eid++) {
+            adj_node[u+1]++;
+            adj_node[graph->edge[eid]+1]++;
+        }
+    for (int u = 0; u < nnode; u++)
+        adj_node[u+1] += adj_node[u];
+    adj.resize(adj_node[nnode]);
+    std::vector<int> fill(adj_node.begin(), adj_node.end() - 1);
+    for (int u = 0; u < nnode; u++)
+        for (int eid = graph->node[u]; eid < graph->node[u+1]; eid++) {
+            int v = graph->edge[eid];
+            adj[fill[u]++] = v;
+            adj[fill[v]++] = u;
+        }
+}
+
+// Reverse Cuthill-McKee: breadth-first from a lowest-degree node of each component, visiting
+// neighbours by increasing degree, then reversed.  Nodes of one BFS level get nearby ids.
+static void OrderRCM(Graph *graph, int *order) {
+    int nnode = graph->nnode;
+    std::vector<int> adj_node, adj;
+    Undirected(graph, adj_node, adj);
+    std::vector<int> by_degree(nnode);
+    for (int u = 0; u < nnode; u++)
+        by_degree[u] = u;
+    std::stable_sort(by_degree.begin(), by_degree.end(), [&](int a, int b) {
+        return adj_node[a+1] - adj_node[a] < adj_node[b+1] - adj_node[b];
+    });
+    std::vector<char> visited(nnode, 0);
+    int tail = 0;
+    for (int i = 0; i < nnode; i++) {
+        int start = by_degree[i];
+        if (visited[start]) continue;
+        visited[start] = 1;
+        int head = tail;
+        order[tail++] = start;
+        while (head < tail) {
+            int u = order[head++];
+            int first = tail;
+            for (int k = adj_node[u]; k < adj_node[u+1]; k++)
+                if (!visited[adj[k]]) {
+                    visited[adj[k]] = 1;
+                    order[tail++] = adj[k];
+                }
+            std::stable_sort(order + first, order + tail, [&](int a, int b) {
+                return adj_node[a+1] - adj_node[a] < adj_node[b+1] - adj_node[b];
+            });
+        }
+    }
+    std::reverse(order, order + nnode);
+}
+
+// Highest total degree first, so the hubs that most edges lead to share cache lines
+static void OrderDegree(Graph *graph, int *order) {
+    int nnode = graph->nnode;
+    std::vector<int> degree(nnode, 0);
+    for (int u = 0; u < nnode; u++)
+        for (int eid = graph->node[u]; eid < graph->node[u+1]; eid++) {
+            degree[u]++;
+            degree[graph->edge[eid]]++;
+        }
+    for (int u = 0; u < nnode; u++)
+        order[u] = u;
+    std::stable_sort(order, order + nnode, [&](int a, int b) { return degree[a] > degree[b]; });
+}
+
+// Unplaced nodes in buckets by score, for +-1 score changes and taking a highest-scoring node
+typedef struct {
+    std::vector<int> key;
+    std::vector<int> prev;
+    std::vector<int> next;
+    std::vector<int> head;  // first node of each score, -1 if none
+    std::vector<char> placed;
+    int top;
+} ScoreBuckets;
+
+static void BucketRemove(ScoreBuckets *b, int v) {
+    if (b->prev[v] >= 0)
+        b->next[b->prev[v]] = b->next[v];
+    else
+        b->head[b->key[v]] = b->next[v];
+    if (b->next[v] >= 0)
+        b->prev[b->next[v]] = b->prev[v];
+}
+
+static void BucketInsert(ScoreBuckets *b, int v) {
+    int k = b->key[v];
+    if (k >= (int)b->head.size())
+        b->head.resize(k + 1, -1);
+    b->prev[v] = -1;
+    b->next[v] = b->head[k];
+    if (b->head[k] >= 0)
+        b->prev[b->head[k]] = v;
+    b->head[k] = v;
+    if (k > b->top)
+        b->top = k;
+}
+
+static inline void BucketChange(ScoreBuckets *b, int v, int delta) {
+    if (b->placed[v]) return;
+    BucketRemove(b, v);
+    b->key[v] += delta;
+    BucketInsert(b, v);
+}
+
+static int BucketTake(ScoreBuckets *b) {
+    while (b->top > 0 && b->head[b->top] < 0)
+        b->top--;
+    int v = b->head[b->top];
+    BucketRemove(b, v);
+    b->placed[v] = 1;
+    return v;
+}
+
+// Score changes of node u entering (+1) or leaving (-1) the window: its out- and in-neighbours,
+// and its siblings, the other out-neighbours of its in-neighbours (skipping hubs)
+static void WindowUpdate(Graph *graph, ScoreBuckets *b, const std::vector<int> &rev_node,
+                         const std::vector<int> &rev_edge, int hub, int u, int delta) {
+    for (int eid = graph->node[u]; eid < graph->node[u+1]; eid++)
+        BucketChange(b, graph->edge[eid], delta);
+    for (int k = rev_node[u]; k < rev_node[u+1]; k++) {
+        int w = rev_edge[k];
+        BucketChange(b, w, delta);
+        if (graph->node[w+1] - graph->node[w] > hub) continue;
+        for (int eid = graph->node[w]; eid < graph->node[w+1]; eid++)
+            BucketChange(b, graph->edge[eid], delta);
+    }
+}
+
+// Greedy reuse-distance ordering after Gorder (Wei et al., SIGMOD 2016): the next node is the one
+// sharing the most edges and in-neighbours with the last ReuseWindow placed nodes, so the
+// distances a node's edges touch were mostly touched just before
+static void OrderReuse(Graph *graph, int *order) {
+    int nnode = graph->nnode;
+    std::vector<int> rev_node(nnode + 1, 0), rev_edge(graph->nedge);
+    for (int eid = 0; eid < graph->nedge; eid++)
+        rev_node[graph->edge[eid]+1]++;
+    for (int v = 0; v < nnode; v++)
+        rev_node[v+1] += rev_node[v];
+    std::vector<int> fill(rev_node.begin(), rev_node.end() - 1);
+    for (int u = 0; u < nnode; u++)
+        for (int eid = graph->node[u]; eid < graph->node[u+1]; eid++)
+            rev_edge[fill[graph->edge[eid]]++] = u;
+    int hub = 1;
+    while ((long long)hub * hub < nnode)
+        hub++;
+
+    ScoreBuckets b;
+    b.key.assign(nnode, 0);
+    b.prev.assign(nnode, -1);
+    b.next.assign(nnode, -1);
+    b.head.assign(1, -1);
+    b.placed.assign(nnode, 0);
+    b.top = 0;
+    // Among equal scores the node inserted last is taken first: start from the most in-edges
+    std::vector<int> by_degree(nnode);
+    for (int u = 0; u < nnode; u++)
+        by_degree[u] = u;
+    std::stable_sort(by_degree.begin(), by_degree.end(), [&](int x, int y) {
+        return rev_node[x+1] - rev_node[x] < rev_node[y+1] - rev_node[y];
+    });
+    for (int i = 0; i < nnode; i++)
+        BucketInsert(&b, by_degree[i]);
+
+    for (int i = 0; i < nnode; i++) {
+        if (i > 0)
+            WindowUpdate(graph, &b, rev_node, rev_edge, hub, order[i-1], 1);
+        if (i > ReuseWindow)
+            WindowUpdate(graph, &b, rev_node, rev_edge, hub, order[i-1-ReuseWindow], -1);
+        order[i] = BucketTake(&b);
+    }
+}
+
+// Renumber the nodes with node_order; edges and weights move with their nodes and each node's
+// edges are sorted by target.  graph->order and graph->rank map between the numberings.
+void ReorderGraph(Graph *graph) {
+    if (node_order == ORDER_NONE)
+        return;
+    int nnode = graph->nnode;
+    int nedge = graph->nedge;
+    int *order = (int *)malloc((nnode > 0 ? nnode : 1) * sizeof(int));
+    int *rank = (int *)malloc((nnode > 0 ? nnode : 1) * sizeof(int));
+    switch (node_order) {
+        case ORDER_RCM:
+            OrderRCM(graph, order);
+            break;
+        case ORDER_DEGREE:
+            OrderDegree(graph, order);
+            break;
+        default:
+            OrderReuse(graph, order);
+    }
+    for (int i = 0; i < nnode; i++)
+        rank[order[i]] = i;
+
+    int *node = (int *)malloc((nnode + 1) * sizeof(int));
+    int *edge = (int *)malloc((nedge > 0 ? nedge : 1) * sizeof(int));
+    int *weight = (int *)malloc((nedge > 0 ? nedge : 1) * sizeof(int));
+    node[0] = 0;
+    for (int i = 0; i < nnode; i++)
+        node[i+1] = node[i] + graph->node[order[i]+1] - graph->node[order[i]];
+    #if OMP
+    #pragma omp parallel
+    #endif
+    {
+        std::vector<std::pair<int, int> > out;
+        #if OMP
+        #pragma omp for schedule(dynamic, 64)
+        #endif
+        for (int i = 0; i < nnode; i++) {
+            int u = order[i];
+            out.clear();
+            for (int eid = graph->node[u]; eid < graph->node[u+1]; eid++)
+                out.push_back(std::make_pair(rank[graph->edge[eid]], graph->weight[eid]));
+            std::sort(out.begin(), out.end());
+            for (size_t k = 0; k < out.size(); k++) {
+                edge[node[i] + k] = out[k].first;
+                weight[node[i] + k] = out[k].second;
+            }
+        }
+    }
+
+    if (graph->mapping != NULL) {
+        munmap(graph->mapping, graph->mapping_size);
+        graph->mapping = NULL;
+        graph->mapping_size = 0;
+    } else {
+        free(graph->node);
+        free(graph->edge);
+        free(graph->weight);
+    }
+    graph->node = node;
+    graph->edge = edge;
+    graph->weight = weight;
+    graph->order = order;
+    graph->rank = rank;
+}
+
+// Put a row computed on the reordered graph back into the original column order
+void RestoreRow(Graph *graph, const int *row, int *out) {
+    for (int j = 0; j < graph->nnode; j++)
+        out[graph->order[j]] = row[j];
+}
+
+// Put the distance matrix back into the original row and column order
+void RestoreDistance(Graph *graph) {
+    if (graph->order == NULL)
+        return;
+    int nnode = graph->nnode;
+    #if OMP
+    #pragma omp parallel
+    #endif
+    {
+        int *scratch = (int *)malloc(nnode * sizeof(int));
+        #if OMP
+        #pragma omp for schedule(static)
+        #endif
+        for (int i = 0; i < nnode; i++) {
+            memcpy(scratch, graph->distance[i], nnode * sizeof(int));
+            RestoreRow(graph, scratch, graph->distance[i]);
+        }
+        free(scratch);
+    }
+    // Row rank[k] moves to row k, one permutation cycle at a time
+    std::vector<char> done(nnode, 0);
+    int *saved = (int *)malloc((nnode > 0 ? nnode : 1) * sizeof(int));
+    for (int start = 0; start < nnode; start++) {
+        if (done[start] || graph->rank[start] == start) continue;
+        memcpy(saved, graph->distance[start], nnode * sizeof(int));
+        int k = start;
+        while (graph->rank[k] != start) {
+            memcpy(graph->distance[k], graph->distance[graph->rank[k]], nnode * sizeof(int));
+            done[k] = 1;
+            k = graph->rank[k];
+        }
+        memcpy(graph->distance[k], saved, nnode * sizeof(int));
+        done[k] = 1;
+    }
+    free(saved);
+}
@@ -0,0 +1,248 @@
+#!/usr/bin/python
+# Benchmark results store: every benchmark run is recorded as a row in an SQLite database,
+# and the compare subcommand flags statistically significant slowdowns between revisions.
+
+import argparse
+import json
+import math
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+
+import cache
+
+# Default database file
+defaultDatabase = "./benchmark-results.db"
+
+# Significance level and minimum relative slowdown to flag
+defaultAlpha = 0.05
+defaultThreshold = 0.05
+
+schema = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    session TEXT,
+    timestamp REAL,
+    revision TEXT,
+    host TEXT,
+    binary TEXT,
+    binary_hash TEXT,
+    test TEXT,
+    graph TEXT,
+    graph_hash TEXT,
+    nnode INTEGER,
+    nedge INTEGER,
+    seed INTEGER,
+    threads INTEGER,
+    gpu INTEGER,
+    engine TEXT,
+    run INTEGER,
+    wall_ms REAL,
+    instrument TEXT
+)
+"""
+
+# Git revision of the working tree, with a -dirty suffix for uncommitted changes
+def gitRevision():
+    try:
+        rev = subprocess.check_output(["git", "rev-parse", "HEAD"], stderr = subprocess.DEVNULL).decode().strip()
+        dirty = subprocess.check_output(["git", "status", "--porcelain", "-uno"], stderr = subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return rev + ("-dirty" if dirty else "")
+
+def openDatabase(path):
+    db = sqlite3.connect(path)
+    db.execute(schema)
+    return db
+
+# Fields shared by every run of one benchmark invocation
+def runContext(session, revision, binary, testId, graphFileName, params, threads, gpu, engine = None):
+    nnode, nedge, seed = params
+    try:
+        binaryHash = cache.fileDigest(binary)
+        graphHash = cache.fileDigest(graphFileName)
+    except OSError:
+        binaryHash, graphHash = None, None
+    return {"session": session, "revision": revision, "host": socket.gethostname(),
+            "binary": binary, "binary_hash": binaryHash, "test": testId,
+            "graph": graphFileName, "graph_hash": graphHash, "nnode": nnode,
+            "nedge": nedge, "seed": seed, "threads": threads, "gpu": int(gpu),
+            "engine": engine}
+
+# Record one run: wall time in ms and instrumentation columns (name -> ms)
+def recordRun(db, context, run, msecs, instDict):
+    row = dict(context, timestamp = time.time(), run = run, wall_ms = msecs,
+               instrument = json.dumps({k: float(v) for k, v in instDict.items()}))
+    names = sorted(row)
+    db.execute("INSERT INTO runs (%s) VALUES (%s)" % (", ".join(names), ", ".join("?" * len(names))),
+               [row[n] for n in names])
+    db.commit()
+
+###############################################################################
+# Statistics
+###############################################################################
+
+# Continued fraction for the regularized incomplete beta function (Numerical Recipes betacf)
+def betaFraction(a, b, x):
+    tiny = 1e-30
+    qab, qap, qam = a + b, a + 1.0, a - 1.0
+    c, d = 1.0, 1.0 - qab * x / qap
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    h = d
+    for m in range(1, 300):
+        m2 = 2 * m
+        aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+        d = 1.0 + aa * d
+        d = 1.0 / (d if abs(d) > tiny else tiny)
+        c = 1.0 + aa / c
+        c = c if abs(c) > tiny else tiny
+        h *= d * c
+        aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+        d = 1.0 + aa * d
+        d = 1.0 / (d if abs(d) > tiny else tiny)
+        c = 1.0 + aa / c
+        c = c if abs(c) > tiny else tiny
+        delta = d * c
+        h *= delta
+        if abs(delta - 1.0) < 1e-12:
+            break
+    return h
+
+def betaInc(a, b, x):
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+    lbeta = math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b)
+    front = math.exp(lbeta + a * math.log(x) + b * math.log(1.0 - x))
+    if x < (a + 1.0) / (a + b + 2.0):
+        return front * betaFraction(a, b, x) / a
+    return 1.0 - front * betaFraction(b, a, 1.0 - x) / b
+
+def mean(xs):
+    return sum(xs) / len(xs)
+
+def variance(xs):
+    m = mean(xs)
+    return sum((x - m) ** 2 for x in xs) / (len(xs) - 1)
+
+# One-sided Welch t-test that the candidate mean exceeds the baseline mean; returns the p-value
+def slowdownPValue(baseline, candidate):
+    if len(baseline) < 2 or len(candidate) < 2:
+        return None
+    vb, vc = variance(baseline) / len(baseline), variance(candidate) / len(candidate)
+    diff = mean(candidate) - mean(baseline)
+    if vb + vc == 0.0:
+        return 0.0 if diff > 0 else 1.0
+    t = diff / math.sqrt(vb + vc)
+    dof = (vb + vc) ** 2 / ((vb ** 2 / (len(baseline) - 1) if vb else 0.0) + (vc ** 2 / (len(candidate) - 1) if vc else 0.0))
+    tail = 0.5 * betaInc(dof / 2.0, 0.5, dof / (dof + t * t))
+    return tail if t > 0 else 1.0 - tail
+
+###############################################################################
+# Queries
+###############################################################################
+
+# Measurements per configuration for a revision: (host, binary, test, graph_hash, threads, gpu, engine) -> metric -> values
+def loadRevision(db, revision):
+    groups = {}
+    rows = db.execute("SELECT host, binary, test, graph_hash, threads, gpu, engine, wall_ms, instrument FROM runs WHERE revision = ?", (revision,))
+    for host, binary, test, graphHash, threads, gpu, engine, wall, inst in rows:
+        metrics = groups.setdefault((host, binary, test, graphHash, threads, gpu, engine), {})
+        metrics.setdefault("wall", []).append(wall)
+        for name, msecs in json.loads(inst or "{}").items():
+            metrics.setdefault(name, []).append(msecs)
+    return groups
+
+def latestRevision(db):
+    row = db.execute("SELECT revision FROM runs ORDER BY timestamp DESC LIMIT 1").fetchone()
+    return row[0] if row is not None else None
+
+# Print every metric of configurations measured in both revisions; returns the number of flagged slowdowns
+def compare(db, baseline, candidate, alpha, threshold):
+    base = loadRevision(db, baseline)
+    cand = loadRevision(db, candidate)
+    flagged = 0
+    print("Baseline %s, candidate %s" % (baseline, candidate))
+    print("{0:<14} {1:<16} {2:<8} {3:<14} {4:<12} {5:<12} {6:<9} {7:<8}".format(
+        "Binary", "Test", "Threads", "Metric", "Base (ms)", "Cand (ms)", "Change", "p"))
+    for key in sorted(set(base) & set(cand), key = str):
+        host, binary, test, graphHash, threads, gpu, engine = key
+        for metric in sorted(set(base[key]) & set(cand[key])):
+            b, c = base[key][metric], cand[key][metric]
+            # skip residual and idle phases
+            if metric == "unknown" or mean(b) <= 0.0:
+                continue
+            change = mean(c) / mean(b) - 1.0
+            p = slowdownPValue(b, c)
+            slow = p is not None and p < alpha and change > threshold
+            flagged += slow
+            print("{0:<14} {1:<16} {2:<8} {3:<14} {4:<12.2f} {5:<12.2f} {6:<+9.1%} {7:<8} {8}".format(
+                os.path.basename(binary) + ("/" + engine if engine else ""), test, "GPU" if gpu else threads, metric, mean(b), mean(c), change,
+                "-" if p is None else "%.3f" % p, "SLOWDOWN" if slow else ""))
+    return flagged
+
+def history(db, test, binary):
+    query = "SELECT revision, binary, test, threads, COUNT(*), MIN(wall_ms), AVG(wall_ms), MIN(timestamp) FROM runs"
+    clauses, args = [], []
+    if test is not None:
+        clauses.append("test = ?")
+        args.append(test)
+    if binary is not None:
+        clauses.append("binary LIKE ?")
+        args.append("%" + binary)
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    query += " GROUP BY revision, binary, test, threads ORDER BY MIN(timestamp)"
+    print("{0:<20} {1:<16} {2:<14} {3:<16} {4:<8} {5:<6} {6:<10} {7:<10}".format(
+        "Date", "Revision", "Binary", "Test", "Threads", "Runs", "Best (ms)", "Mean (ms)"))
+    for rev, binary, test, threads, count, best, avg, ts in db.execute(query, args):
+        print("{0:<20} {1:<16} {2:<14} {3:<16} {4:<8} {5:<6} {6:<10.2f} {7:<10.2f}".format(
+            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts)), rev[:14], os.path.basename(binary),
+            test, threads, count, best, avg))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-D", "--database", type=str, default=defaultDatabase,
+                    help="Results database")
+    commands = parser.add_subparsers(dest="command")
+    compareParser = commands.add_parser("compare", help="Flag slowdowns against a baseline revision")
+    compareParser.add_argument("baseline", type=str, help="Baseline git revision")
+    compareParser.add_argument("candidate", type=str, nargs="?",
+                    help="Candidate git revision (default: most recently recorded)")
+    compareParser.add_argument("-a", "--alpha", type=float, default=defaultAlpha,
+                    help="Significance level")
+    compareParser.add_argument("-m", "--threshold", type=float, default=defaultThreshold,
+                    help="Minimum relative slowdown to flag")
+    historyParser = commands.add_parser("history", help="List recorded results")
+    historyParser.add_argument("-T", "--test", type=str, help="Only this benchmark test")
+    historyParser.add_argument("-b", "--binary", type=str, help="Only this binary")
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        sys.stderr.write("No results database '%s'\n" % args.database)
+        sys.exit(1)
+    db = openDatabase(args.database)
+    if args.command == "compare":
+        revisions = [r for (r,) in db.execute("SELECT DISTINCT revision FROM runs")]
+        # accept abbreviated revisions; an exact match wins over longer ones such as "<sha>-dirty"
+        def resolve(rev):
+            if rev in revisions:
+                return rev
+            matches = [r for r in revisions if r.startswith(rev)]
+            if len(matches) != 1:
+                sys.stderr.write("Revision '%s' matches %d recorded revisions\n" % (rev, len(matches)))
+                sys.exit(1)
+            return matches[0]
+        baseline = resolve(args.baseline)
+        candidate = resolve(args.candidate) if args.candidate is not None else latestRevision(db)
+        flagged = compare(db, baseline, candidate, args.alpha, args.threshold)
+        print("%d significant slowdowns" % flagged)
+        sys.exit(1 if flagged > 0 else 0)
+    else:
+        history(db, getattr(args, "test", None), getattr(args, "binary", None))
@@ -0,0 +1,115 @@
+#include "johnson.hpp"
+#include <iomanip>
+
+// Same layout as the -P matrix printout
+void PrintRow(const int *row, int nnode) {
+    for (int j = 0; j < nnode; ++j) {
+        if (row[j] == IntMax)
+            std::cout << std::setw(5) << "inf";
+        else
+            std::cout << std::setw(5) << row[j];
+    }
+    std::cout << std::endl;
+}
+
+bool OpenRowSink(RowSink *sink, row_sink_t kind, int nnode, const char *fname, int first, int last) {
+    sink->kind = kind;
+    sink->nnode = nnode;
+    sink->ordered = kind == SINK_TEXT;
+    sink->first = first;
+    sink->last = last;
+    sink->list = NULL;
+    sink->fd = -1;
+    sink->reachable = 0;
+    sink->total = 0;
+    sink->min = IntMax;
+    sink->max = -IntMax - 1;
+
+    if (kind != SINK_BINARY)
+        return true;
+
+    size_t size = (DistanceHeaderInts + (size_t)(last - first) * nnode) * sizeof(int);
+    sink->fd = open(fname, O_WRONLY | O_CREAT | O_TRUNC, 0644);
+    if (sink->fd < 0) {
+        printf("Couldn't open distance file %s\n", fname);
+        return false;
+    }
+    bool partial = first > 0 || last < nnode;
+    int header[DistanceHeaderInts] = { partial ? DistanceBlockMagic : DistanceMagic, DistanceVersion, nnode, first };
+    if (ftruncate(sink->fd, size) < 0
+        || pwrite(sink->fd, header, sizeof(header), 0) != (ssize_t)sizeof(header)) {
+        printf("Couldn't resize distance file %s\n", fname);
+        close(sink->fd);
+        sink->fd = -1;
+        return false;
+    }
+    return true;
+}
+
+void EmitRow(RowSink *sink, int src_nid, const int *row) {
+    int nnode = sink->nnode;
+    switch (sink->kind) {
+        case SINK_BINARY: {
+            // Each row has a fixed offset, so threads write without coordination
+            off_t offset = (DistanceHeaderInts + (off_t)(src_nid - sink->first) * nnode) * sizeof(int);
+            size_t left = nnode * sizeof(int);
+            const char *buf = (const char *)row;
+            while (left > 0) {
+                ssize_t n = pwrite(sink->fd, buf, left, offset);
+                if (n <= 0) {
+                    printf("Couldn't write distance row %d\n", src_nid);
+                    exit(1);
+                }
+                buf += n;
+                offset += n;
+                left -= n;
+            }
+            break;
+        }
+        case SINK_TEXT:
+            PrintRow(row, nnode);
+            break;
+        default: {
+            long long reachable = 0, total = 0;
+            int min = IntMax, max = -IntMax - 1;
+            for (int nid = 0; nid < nnode; nid++) {
+                if (row[nid] == IntMax) continue;
+                reachable++;
+                total += row[nid];
+                if (row[nid] < min) min = row[nid];
+                if (row[nid] > max) max = row[nid];
+            }
+            #if OMP
+            #pragma omp critical(row_sink_reduce)
+            #endif
+            {
+                sink->reachable += reachable;
+                sink->total += total;
+                if (min < sink->min) sink->min = min;
+                if (max > sink->max) sink->max = max;
+            }
+        }
+    }
+}
+
+bool CloseRowSink(RowSink *sink) {
+    switch (sink->kind) {
+        case SINK_BINARY:
+            if (close(sink->fd) < 0) {
+                printf("Couldn't close distance file\n");
+                return false;
+            }
+            break;
+        case SINK_REDUCE:
+            printf("Reachable pairs: %lld\n", sink->reachable);
+            printf("Distance sum: %lld\n", sink->total);
+            if (sink->reachable > 0) {
+                printf("Min distance: %d\n", sink->min);
+                printf("Max distance: %d\n", sink->max);
+            }
+            break;
+        default:
+            break;
+    }
+    return true;
+}
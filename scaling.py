@@ -0,0 +1,167 @@
+# Speedup models and reports for the scaling analysis mode of benchmark.py (-A)
+# Measurements are rows of (nnode, nedge, density, threads, phase, msecs).
+# Per graph and phase, the serial fraction f of Amdahl's law T(p) = T(1) (f + (1 - f) / p)
+# is fitted by least squares, and the Karp-Flatt metric is computed for every thread count.
+
+import csv
+import html
+import math
+
+# Phases reported, as named by the solvers' instrumentation
+phases = ["bellman_ford", "dijkstra", "floyd_warshall"]
+
+# Karp-Flatt experimentally determined serial fraction for speedup s on p threads
+def karpFlatt(speedup, p):
+    if p <= 1 or speedup <= 0:
+        return None
+    return (1.0 / speedup - 1.0 / p) / (1.0 - 1.0 / p)
+
+# Least squares f for T(p)/T(1) - 1/p = f (1 - 1/p), over (threads, msecs) points including p = 1
+def amdahlFit(points):
+    base = [ms for p, ms in points if p == 1]
+    if len(base) == 0 or base[0] <= 0:
+        return None
+    t1 = base[0]
+    sxy, sxx = 0.0, 0.0
+    for p, ms in points:
+        if p <= 1:
+            continue
+        x = 1.0 - 1.0 / p
+        y = ms / t1 - 1.0 / p
+        sxy += x * y
+        sxx += x * x
+    if sxx == 0:
+        return None
+    return min(1.0, max(0.0, sxy / sxx))
+
+# Group measurements by (nnode, nedge, density, phase) into sorted (threads, msecs) points
+def series(rows):
+    groups = {}
+    for nnode, nedge, density, threads, phase, ms in rows:
+        groups.setdefault((nnode, nedge, density, phase), []).append((threads, ms))
+    for points in groups.values():
+        points.sort()
+    return groups
+
+# Amdahl serial fraction of every graph and phase
+def fitAll(rows):
+    return {key: amdahlFit(points) for key, points in series(rows).items()}
+
+def writeCSV(fname, rows):
+    fits = fitAll(rows)
+    groups = series(rows)
+    with open(fname, "w", newline = "") as f:
+        w = csv.writer(f)
+        w.writerow(["nnode", "nedge", "density", "phase", "threads", "msecs", "speedup", "efficiency",
+                    "karp_flatt", "amdahl_serial"])
+        for key in sorted(groups):
+            nnode, nedge, density, phase = key
+            t1 = dict(groups[key]).get(1)
+            for p, ms in groups[key]:
+                speedup = t1 / ms if t1 and ms > 0 else None
+                kf = karpFlatt(speedup, p) if speedup is not None else None
+                w.writerow([nnode, nedge, density, phase, p, "%.3f" % ms,
+                            "" if speedup is None else "%.3f" % speedup,
+                            "" if speedup is None else "%.3f" % (speedup / p),
+                            "" if kf is None else "%.4f" % kf,
+                            "" if fits[key] is None else "%.4f" % fits[key]])
+
+# Line colours for graph sizes, and dash patterns for densities
+palette = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd", "#8c564b", "#e377c2", "#7f7f7f"]
+dashes = ["", "6,3", "2,3", "8,3,2,3", "1,2"]
+
+# SVG chart of speedup against threads for one phase, with the ideal speedup as a grey line
+def speedupChart(groups, phase, width = 560, height = 360):
+    left, right, top, bottom = 50, 170, 20, 40
+    keys = sorted(k for k in groups if k[3] == phase)
+    pmax = max([p for k in keys for p, _ in groups[k]] + [2])
+    smax = float(pmax)
+    lines = []
+    for k in keys:
+        t1 = dict(groups[k]).get(1)
+        if not t1:
+            continue
+        pts = [(p, t1 / ms) for p, ms in groups[k] if ms > 0]
+        smax = max([smax] + [s for _, s in pts])
+        lines.append((k, pts))
+
+    def x(p):
+        return left + (p - 1) / float(pmax - 1) * (width - left - right)
+
+    def y(s):
+        return height - bottom - s / smax * (height - top - bottom)
+
+    sizes = sorted(set(k[0] for k in keys))
+    densities = sorted(set(k[2] for k in keys))
+    out = ['<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" font-family="sans-serif" font-size="11">' % (width, height)]
+    out.append('<line x1="%.1f" y1="%.1f" x2="%.1f" y2="%.1f" stroke="black"/>' % (left, y(0), width - right, y(0)))
+    out.append('<line x1="%.1f" y1="%.1f" x2="%.1f" y2="%.1f" stroke="black"/>' % (left, y(0), left, top))
+    for p in sorted(set(p for k in keys for p, _ in groups[k])):
+        out.append('<text x="%.1f" y="%.1f" text-anchor="middle">%d</text>' % (x(p), y(0) + 15, p))
+    step = max(1, int(math.ceil(smax / 8.0)))
+    for s in range(0, int(smax) + 1, step):
+        out.append('<text x="%.1f" y="%.1f" text-anchor="end">%d</text>' % (left - 5, y(s) + 4, s))
+    out.append('<text x="%.1f" y="%d" text-anchor="middle">threads</text>' % ((left + width - right) / 2.0, height - 5))
+    out.append('<text x="12" y="%.1f" transform="rotate(-90 12 %.1f)" text-anchor="middle">speedup</text>' % ((top + height - bottom) / 2.0, (top + height - bottom) / 2.0))
+    out.append('<line x1="%.1f" y1="%.1f" x2="%.1f" y2="%.1f" stroke="#bbb" stroke-dasharray="4,4"/>' % (x(1), y(1), x(pmax), y(min(pmax, smax))))
+    for k, pts in lines:
+        colour = palette[sizes.index(k[0]) % len(palette)]
+        dash = dashes[densities.index(k[2]) % len(dashes)]
+        coords = " ".join("%.1f,%.1f" % (x(p), y(s)) for p, s in pts)
+        out.append('<polyline fill="none" stroke="%s" stroke-width="1.5" stroke-dasharray="%s" points="%s"><title>%d nodes, density %g</title></polyline>'
+                   % (colour, dash, coords, k[0], k[2]))
+    ly = top
+    for i, n in enumerate(sizes):
+        out.append('<line x1="%d" y1="%d" x2="%d" y2="%d" stroke="%s" stroke-width="2"/><text x="%d" y="%d">%d nodes</text>'
+                   % (width - right + 10, ly, width - right + 30, ly, palette[i % len(palette)], width - right + 35, ly + 4, n))
+        ly += 15
+    for i, d in enumerate(densities):
+        out.append('<line x1="%d" y1="%d" x2="%d" y2="%d" stroke="black" stroke-dasharray="%s"/><text x="%d" y="%d">density %g</text>'
+                   % (width - right + 10, ly, width - right + 30, ly, dashes[i % len(dashes)], width - right + 35, ly + 4, d))
+        ly += 15
+    out.append('</svg>')
+    return "\n".join(out)
+
+# Cell colour from green (no serial fraction) to red (half or more serial)
+def fractionColour(f):
+    t = min(1.0, f / 0.5)
+    return "rgb(%d,%d,120)" % (int(120 + 135 * t), int(220 - 120 * t))
+
+# Table of serial fractions by graph size (rows) and density (columns) for one phase
+def fractionTable(fits, phase):
+    keys = [k for k in fits if k[3] == phase]
+    sizes = sorted(set(k[0] for k in keys))
+    densities = sorted(set(k[2] for k in keys))
+    out = ['<table><tr><th>nodes \\ density</th>' + "".join("<th>%g</th>" % d for d in densities) + '</tr>']
+    for n in sizes:
+        cells = []
+        for d in densities:
+            f = [fits[k] for k in keys if k[0] == n and k[2] == d]
+            if len(f) == 0 or f[0] is None:
+                cells.append("<td>-</td>")
+            else:
+                cells.append('<td style="background:%s">%.3f<br><small>max %.1fx</small></td>'
+                             % (fractionColour(f[0]), f[0], 1.0 / f[0] if f[0] > 0 else float("inf")))
+        out.append("<tr><th>%d</th>%s</tr>" % (n, "".join(cells)))
+    out.append("</table>")
+    return "\n".join(out)
+
+def writeHTML(fname, rows, title):
+    groups = series(rows)
+    fits = fitAll(rows)
+    out = ["<!DOCTYPE html>", "<html><head><meta charset=\"utf-8\"><title>%s</title>" % html.escape(title),
+           "<style>body{font-family:sans-serif;margin:2em} table{border-collapse:collapse;margin-bottom:2em}"
+           " td,th{border:1px solid #999;padding:4px 8px;text-align:center}</style></head><body>",
+           "<h1>%s</h1>" % html.escape(title),
+           "<p>Amdahl serial fraction f fitted per graph and phase from T(p) = T(1) (f + (1 - f) / p); "
+           "1/f bounds the speedup on any number of threads.</p>"]
+    for phase in phases:
+        if not any(k[3] == phase for k in groups):
+            continue
+        out.append("<h2>%s</h2>" % html.escape(phase))
+        out.append(speedupChart(groups, phase))
+        out.append("<h3>Serial fraction</h3>")
+        out.append(fractionTable(fits, phase))
+    out.append("</body></html>")
+    with open(fname, "w") as f:
+        f.write("\n".join(out))
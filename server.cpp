@@ -0,0 +1,252 @@
+#include "johnson.hpp"
+#include <errno.h>
+#include <string.h>
+#include <sys/socket.h>
+#include <sys/un.h>
+#include <atomic>
+#include <condition_variable>
+#include <list>
+#include <memory>
+#include <mutex>
+#include <set>
+#include <thread>
+#include <unordered_map>
+#include <vector>
+
+// Query protocol (see query.py): one request per line
+//   ROW s             distances from s
+//   ROWS s1 s2 ...    distances from each source, rows concatenated
+//   DIST s t          distance from s to t
+//   INFO              nnode, nedge, cached rows, cache hits, cache misses; the 64-bit
+//                     counts are sent as two values each, low 32 bits first
+//   SHUTDOWN          stop the server
+// Answered with "OK n\n" followed by n native int32 values, or "ERR message\n"
+
+typedef std::shared_ptr<std::vector<int> > Row;
+
+// Least recently used cache of distance rows, holding at most capacity rows
+typedef struct {
+    size_t capacity;
+    std::list<std::pair<int, Row> > lru;
+    std::unordered_map<int, std::list<std::pair<int, Row> >::iterator> index;
+    std::mutex lock;
+    long long hits;
+    long long misses;
+} RowCache;
+
+typedef struct {
+    Graph *graph;
+    RowCache cache;
+    int listen_fd;
+    std::atomic<bool> stopping;
+
+    // Connections being served, shut down on SHUTDOWN
+    std::set<int> clients;
+    std::mutex clients_lock;
+    std::condition_variable clients_done;
+} Server;
+
+static Row CacheGet(RowCache *cache, int src_nid) {
+    std::lock_guard<std::mutex> guard(cache->lock);
+    auto it = cache->index.find(src_nid);
+    if (it == cache->index.end()) {
+        cache->misses++;
+        return Row();
+    }
+    cache->hits++;
+    cache->lru.splice(cache->lru.begin(), cache->lru, it->second);
+    return it->second->second;
+}
+
+static void CachePut(RowCache *cache, int src_nid, Row row) {
+    std::lock_guard<std::mutex> guard(cache->lock);
+    if (cache->capacity == 0 || cache->index.count(src_nid))
+        return;
+    if (cache->lru.size() >= cache->capacity) {
+        cache->index.erase(cache->lru.back().first);
+        cache->lru.pop_back();
+    }
+    cache->lru.push_front(std::make_pair(src_nid, row));
+    cache->index[src_nid] = cache->lru.begin();
+}
+
+// Rows for all sources, computing the ones not cached in parallel
+static std::vector<Row> GetRows(Server *server, const std::vector<int> &sources) {
+    std::vector<Row> rows(sources.size());
+    std::vector<int> missing;
+    for (size_t i = 0; i < sources.size(); i++) {
+        rows[i] = CacheGet(&server->cache, sources[i]);
+        if (!rows[i])
+            missing.push_back(i);
+    }
+
+    #if OMP
+    #pragma omp parallel for schedule(dynamic, 1)
+    #endif
+    for (size_t m = 0; m < missing.size(); m++) {
+        int i = missing[m];
+        Row row = std::make_shared<std::vector<int> >(server->graph->nnode);
+        Dijkstra(server->graph, sources[i], row->data());
+        rows[i] = row;
+    }
+    for (size_t m = 0; m < missing.size(); m++)
+        CachePut(&server->cache, sources[missing[m]], rows[missing[m]]);
+    return rows;
+}
+
+static bool SendAll(int fd, const void *data, size_t size) {
+    const char *buf = (const char *)data;
+    while (size > 0) {
+        ssize_t n = send(fd, buf, size, MSG_NOSIGNAL);
+        if (n < 0 && errno == EINTR) continue;
+        if (n <= 0) return false;
+        buf += n;
+        size -= n;
+    }
+    return true;
+}
+
+static bool SendHeader(int fd, size_t count) {
+    char header[32];
+    int len = snprintf(header, sizeof(header), "OK %zu\n", count);
+    return SendAll(fd, header, len);
+}
+
+static bool SendError(int fd, const char *msg) {
+    char line[MaxLineLength];
+    int len = snprintf(line, sizeof(line), "ERR %s\n", msg);
+    return SendAll(fd, line, len);
+}
+
+// Parse node ids from the rest of a request line; false if any is out of range
+static bool ParseNodes(Graph *graph, char *args, std::vector<int> &nodes) {
+    char *save;
+    for (char *tok = strtok_r(args, " \t\r\n", &save); tok != NULL; tok = strtok_r(NULL, " \t\r\n", &save)) {
+        char *end;
+        long nid = strtol(tok, &end, 10);
+        if (*end != '\0' || nid < 0 || nid >= graph->nnode)
+            return false;
+        nodes.push_back(nid);
+    }
+    return true;
+}
+
+// Answer one request, false when the connection should be closed
+static bool HandleRequest(Server *server, int fd, char *line) {
+    Graph *graph = server->graph;
+    char *args = line + strcspn(line, " \t\r\n");
+    if (*args != '\0')
+        *args++ = '\0';
+    std::vector<int> nodes;
+    if (!ParseNodes(graph, args, nodes))
+        return SendError(fd, "node out of range");
+
+    if (strcmp(line, "ROW") == 0 || strcmp(line, "ROWS") == 0) {
+        if (nodes.empty() || (line[3] == '\0' && nodes.size() != 1))
+            return SendError(fd, "bad source list");
+        std::vector<Row> rows = GetRows(server, nodes);
+        if (!SendHeader(fd, rows.size() * graph->nnode))
+            return false;
+        for (size_t i = 0; i < rows.size(); i++)
+            if (!SendAll(fd, rows[i]->data(), graph->nnode * sizeof(int)))
+                return false;
+        return true;
+    }
+    if (strcmp(line, "DIST") == 0) {
+        if (nodes.size() != 2)
+            return SendError(fd, "DIST needs a source and a destination");
+        std::vector<int> src(1, nodes[0]);
+        int distance = (*GetRows(server, src)[0])[nodes[1]];
+        return SendHeader(fd, 1) && SendAll(fd, &distance, sizeof(int));
+    }
+    if (strcmp(line, "INFO") == 0) {
+        int info[7];
+        long long hits, misses;
+        {
+            std::lock_guard<std::mutex> guard(server->cache.lock);
+            info[0] = graph->nnode;
+            info[1] = graph->nedge;
+            info[2] = server->cache.lru.size();
+            hits = server->cache.hits;
+            misses = server->cache.misses;
+        }
+        info[3] = (int)(unsigned)hits;
+        info[4] = (int)(hits >> 32);
+        info[5] = (int)(unsigned)misses;
+        info[6] = (int)(misses >> 32);
+        return SendHeader(fd, 7) && SendAll(fd, info, sizeof(info));
+    }
+    if (strcmp(line, "SHUTDOWN") == 0) {
+        // Reply before the accept loop starts disconnecting clients, this one included
+        SendHeader(fd, 0);
+        server->stopping = true;
+        shutdown(server->listen_fd, SHUT_RDWR);
+        return false;
+    }
+    return SendError(fd, "unknown request");
+}
+
+static void HandleClient(Server *server, int fd) {
+    FILE *in = fdopen(dup(fd), "r");
+    char *line = NULL;
+    size_t cap = 0;
+    while (in != NULL && getline(&line, &cap, in) > 0)
+        if (!HandleRequest(server, fd, line))
+            break;
+    free(line);
+    if (in != NULL)
+        fclose(in);
+
+    std::lock_guard<std::mutex> guard(server->clients_lock);
+    close(fd);
+    server->clients.erase(fd);
+    server->clients_done.notify_all();
+}
+
+// Answer queries on a Unix socket until SHUTDOWN.  BellmanFord must have filled new_weight.
+bool Serve(Graph *graph, const char *socket_path, size_t cache_bytes) {
+    Server server;
+    server.graph = graph;
+    server.cache.capacity = graph->nnode > 0 ? cache_bytes / (graph->nnode * sizeof(int)) : 0;
+    server.cache.hits = 0;
+    server.cache.misses = 0;
+    server.stopping = false;
+
+    struct sockaddr_un addr;
+    memset(&addr, 0, sizeof(addr));
+    addr.sun_family = AF_UNIX;
+    if (strlen(socket_path) >= sizeof(addr.sun_path)) {
+        printf("Socket path %s is too long\n", socket_path);
+        return false;
+    }
+    strcpy(addr.sun_path, socket_path);
+    unlink(socket_path);
+    server.listen_fd = socket(AF_UNIX, SOCK_STREAM, 0);
+    if (server.listen_fd < 0 || bind(server.listen_fd, (struct sockaddr *)&addr, sizeof(addr)) < 0
+        || listen(server.listen_fd, 64) < 0) {
+        printf("Couldn't listen on socket %s\n", socket_path);
+        return false;
+    }
+    if (display)
+        printf("Serving %d nodes on %s with %zu cached rows\n", graph->nnode, socket_path, server.cache.capacity);
+
+    while (!server.stopping) {
+        int fd = accept(server.listen_fd, NULL, NULL);
+        if (fd < 0) {
+            if (errno == EINTR) continue;
+            break;
+        }
+        std::lock_guard<std::mutex> guard(server.clients_lock);
+        server.clients.insert(fd);
+        std::thread(HandleClient, &server, fd).detach();
+    }
+    close(server.listen_fd);
+    unlink(socket_path);
+
+    // Connected clients finish their current requests and are disconnected
+    std::unique_lock<std::mutex> guard(server.clients_lock);
+    for (std::set<int>::iterator it = server.clients.begin(); it != server.clients.end(); ++it)
+        shutdown(*it, SHUT_RDWR);
+    server.clients_done.wait(guard, [&server] { return server.clients.empty(); });
+    return true;
+}
@@ -0,0 +1,274 @@
+#!/usr/bin/python
+# All-pairs shortest paths split by source over several solver processes, local or on ssh hosts.
+# Bellman-Ford runs once (--save-potentials) and the potentials file is shipped to every shard,
+# which computes the rows of one source range (--sources A:B -B BLOCK).  Failed shards are retried
+# on any worker, and the row blocks are stitched into one distance matrix in the -B layout.
+# Remote hosts must have the solver and the graph at the same paths (a shared file system),
+# unless --remote-program / --remote-graph say otherwise.
+
+import argparse
+import os
+import os.path
+import queue
+import shlex
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from graph import readBinaryGraph, readDistanceBlock, BINARY_SUFFIX, DISTANCE_MAGIC, DISTANCE_VERSION
+
+defaultProgram = "./johnson_omp"
+
+# Shards per worker, so that faster workers take more of them
+shardsPerWorker = 4
+
+# Attempts of a shard beyond the first, and failures in a row after which a worker gives up
+retryLimit = 2
+workerFailureLimit = 2
+
+# Scratch directory on remote hosts
+remoteDirectory = "/tmp"
+
+def log(msg):
+    sys.stderr.write("[" + datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f") + "] " + msg + "\n")
+
+def graphSize(gname):
+    if gname.endswith(BINARY_SUFFIX):
+        return readBinaryGraph(gname)[0]
+    with open(gname) as f:
+        return int(f.readline().split()[0])
+
+# Source ranges [a, b) covering all nodes
+def splitSources(nnode, count):
+    count = max(1, min(count, nnode))
+    bounds = [nnode * i // count for i in range(count + 1)]
+    return [(bounds[i], bounds[i+1]) for i in range(count)]
+
+# One slot running shards, on this machine when host is None
+class Worker:
+    def __init__(self, host, slot):
+        self.host = host
+        self.slot = slot
+        self.done = 0
+        self.failures = 0
+
+    def name(self):
+        return "%s#%d" % (self.host or "local", self.slot)
+
+# Per-run settings and state shared by the worker threads
+class Coordinator:
+    def __init__(self, args, nnode, scratch):
+        self.args = args
+        self.nnode = nnode
+        self.scratch = scratch
+        self.potentialFile = os.path.join(scratch, "potentials.pot")
+        self.pending = queue.Queue()
+        self.attempts = {}
+        self.remaining = 0
+        self.failed = False
+        # workers that haven't retired
+        self.live = 0
+        self.lock = threading.Lock()
+        # hosts that already have the potentials file
+        self.shipped = {}
+        self.shipLock = threading.Lock()
+        self.rows = None
+
+    def solverCommand(self, program, graphFile, potentialFile, shard, blockFile):
+        cmd = [program, "-g", graphFile, "--potentials", potentialFile,
+               "--sources", "%d:%d" % shard, "-B", blockFile]
+        if self.args.threadCount:
+            cmd += ["-t", str(self.args.threadCount)]
+        if self.args.engine:
+            cmd += ["-d", self.args.engine]
+        return cmd
+
+    # Run a command, returning an error message or None
+    def execute(self, cmd, what):
+        try:
+            result = subprocess.run(cmd, stdout = subprocess.PIPE, stderr = subprocess.STDOUT,
+                                    timeout = self.args.timeout)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            return "%s failed: %s" % (what, e)
+        if result.returncode != 0:
+            return "%s gave return code %d: %s" % (what, result.returncode, result.stdout.decode("utf-8", "ignore").strip())
+        return None
+
+    def remotePotentials(self, host):
+        remote = "%s/johnson-%d-%s" % (remoteDirectory, os.getpid(), os.path.basename(self.potentialFile))
+        with self.shipLock:
+            if host not in self.shipped:
+                error = self.execute(["scp", "-q", self.potentialFile, "%s:%s" % (host, remote)], "copying potentials to " + host)
+                if error is not None:
+                    return None, error
+                self.shipped[host] = remote
+        return self.shipped[host], None
+
+    # Compute one shard on a worker into a local block file, returning an error message or None
+    def runShard(self, worker, shard, blockFile):
+        args = self.args
+        if worker.host is None:
+            cmd = self.solverCommand(args.program, args.graphFileName, self.potentialFile, shard, blockFile)
+            return self.execute(cmd, " ".join(cmd))
+        potentials, error = self.remotePotentials(worker.host)
+        if error is not None:
+            return error
+        remoteBlock = "%s/johnson-%d-%s" % (remoteDirectory, os.getpid(), os.path.basename(blockFile))
+        cmd = self.solverCommand(args.remote_program or os.path.abspath(args.program),
+                                 args.remote_graph or os.path.abspath(args.graphFileName), potentials, shard, remoteBlock)
+        remoteCmd = " ".join(shlex.quote(c) for c in cmd)
+        error = self.execute(["ssh", worker.host, remoteCmd], "%s on %s" % (remoteCmd, worker.host))
+        if error is None:
+            error = self.execute(["scp", "-q", "%s:%s" % (worker.host, remoteBlock), blockFile], "fetching " + remoteBlock)
+        self.execute(["ssh", worker.host, "rm -f " + shlex.quote(remoteBlock)], "removing " + remoteBlock)
+        return error
+
+    # Copy the rows of a block into the output matrix
+    def stitch(self, shard, blockFile):
+        nnode, first, block = readDistanceBlock(blockFile)
+        if nnode != self.nnode or first != shard[0] or len(block) != shard[1] - shard[0]:
+            return "block %s holds rows %d:%d of %d nodes, expected %d:%d" % (blockFile, first, first + len(block), nnode, shard[0], shard[1])
+        self.rows[shard[0]:shard[1]] = block
+        return None
+
+    def work(self, worker):
+        while True:
+            with self.lock:
+                if self.remaining == 0 or self.failed:
+                    return
+            try:
+                shard = self.pending.get(timeout = 0.1)
+            except queue.Empty:
+                continue
+            blockFile = os.path.join(self.scratch, "rows-%d-%d.dist" % shard)
+            start = time.perf_counter()
+            error = self.runShard(worker, shard, blockFile)
+            if error is None:
+                try:
+                    error = self.stitch(shard, blockFile)
+                except (OSError, ValueError) as e:
+                    error = str(e)
+            if os.path.exists(blockFile):
+                os.remove(blockFile)
+            with self.lock:
+                if error is None:
+                    worker.done += 1
+                    worker.failures = 0
+                    self.remaining -= 1
+                    log("Rows %d:%d done on %s in %.2f secs" % (shard + (worker.name(), time.perf_counter() - start)))
+                    continue
+                worker.failures += 1
+                self.attempts[shard] += 1
+                log("Rows %d:%d failed on %s: %s" % (shard + (worker.name(), error)))
+                if self.attempts[shard] > retryLimit:
+                    log("Giving up on rows %d:%d after %d attempts" % (shard + (self.attempts[shard],)))
+                    self.failed = True
+                    return
+                self.pending.put(shard)
+                # the last live worker keeps going, so that shards get all their retries
+                if worker.failures >= workerFailureLimit and self.live > 1:
+                    log("Retiring worker %s after %d failures in a row" % (worker.name(), worker.failures))
+                    self.live -= 1
+                    return
+
+    def run(self, workers):
+        args = self.args
+        cmd = [args.program, "-g", args.graphFileName, "--save-potentials", self.potentialFile]
+        start = time.perf_counter()
+        error = self.execute(cmd, " ".join(cmd))
+        if error is None and not os.path.exists(self.potentialFile):
+            error = "no potentials written (negative weight cycle?)"
+        if error is not None:
+            log(error)
+            return False
+        log("Potentials of %d nodes computed in %.2f secs" % (self.nnode, time.perf_counter() - start))
+
+        shards = splitSources(self.nnode, args.shards or shardsPerWorker * len(workers))
+        for shard in shards:
+            self.attempts[shard] = 0
+            self.pending.put(shard)
+        self.remaining = len(shards)
+
+        tmpName = args.outfile + ".tmp%d" % os.getpid()
+        out = np.memmap(tmpName, dtype = "<i4", mode = "w+", shape = (4 + self.nnode * self.nnode,))
+        out[:1] = np.frombuffer(DISTANCE_MAGIC, dtype = "<i4")
+        out[1:4] = [DISTANCE_VERSION, self.nnode, 0]
+        self.rows = out[4:].reshape(self.nnode, self.nnode)
+
+        start = time.perf_counter()
+        self.live = len(workers)
+        threads = [threading.Thread(target = self.work, args = (w,)) for w in workers]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        out.flush()
+        self.rows = None
+        del out
+        if self.remaining > 0:
+            log("%d of %d shards not computed" % (self.remaining, len(shards)))
+            os.remove(tmpName)
+            return False
+        os.replace(tmpName, args.outfile)
+        log("%d shards on %d workers in %.2f secs (%s), written to %s"
+            % (len(shards), len(workers), time.perf_counter() - start,
+               ", ".join("%s %d" % (w.name(), w.done) for w in workers), args.outfile))
+        return True
+
+# "host" or "host:slots" entries
+def parseHosts(spec):
+    workers = []
+    for entry in spec.split(","):
+        host, _, slots = entry.partition(":")
+        for slot in range(int(slots) if slots else 1):
+            workers.append(Worker(host, slot))
+    return workers
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Compute a distance matrix in source shards on several workers")
+    parser.add_argument("-g", "--graphFileName", type=str, required=True,
+                    help="Graph file (text edge list or binary .csr)")
+    parser.add_argument("-o", "--outfile", type=str, required=True,
+                    help="Binary distance matrix to write")
+    parser.add_argument("-w", "--workers", type=int,
+                    help="Local worker processes (default: number of processors, or none with --hosts)")
+    parser.add_argument("-H", "--hosts", type=str,
+                    help="Comma-separated ssh hosts, each as HOST or HOST:SLOTS")
+    parser.add_argument("-n", "--shards", type=int,
+                    help="Number of source shards (default %d per worker)" % shardsPerWorker)
+    parser.add_argument("-t", "--threadCount", type=int,
+                    help="OMP threads of each shard")
+    parser.add_argument("-d", "--engine", type=str, choices=["scan", "heap", "radix", "delta"],
+                    help="Dijkstra priority queue of the shards")
+    parser.add_argument("-p", "--program", type=str, default=defaultProgram,
+                    help="Solver binary (default %s)" % defaultProgram)
+    parser.add_argument("--remote-program", type=str,
+                    help="Solver binary on the hosts (default: absolute path of --program)")
+    parser.add_argument("--remote-graph", type=str,
+                    help="Graph file on the hosts (default: absolute path of -g)")
+    parser.add_argument("-r", "--retries", type=int,
+                    help="Attempts of a failed shard beyond the first (default %d)" % retryLimit)
+    parser.add_argument("--timeout", type=float,
+                    help="Seconds after which a shard counts as failed")
+    args = parser.parse_args()
+
+    retryLimit = args.retries if args.retries is not None else retryLimit
+    workers = parseHosts(args.hosts) if args.hosts else []
+    localCount = args.workers if args.workers is not None else (0 if workers else os.cpu_count())
+    workers += [Worker(None, slot) for slot in range(localCount)]
+    if len(workers) == 0:
+        parser.error("no workers")
+
+    try:
+        nnode = graphSize(args.graphFileName)
+    except (OSError, ValueError, IndexError) as e:
+        sys.stderr.write("Couldn't read graph '%s'. %s\n" % (args.graphFileName, e))
+        sys.exit(1)
+    with tempfile.TemporaryDirectory(prefix = "shard-") as scratch:
+        ok = Coordinator(args, nnode, scratch).run(workers)
+    sys.exit(0 if ok else 1)
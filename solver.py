@@ -0,0 +1,127 @@
+#!/usr/bin/python
+# In-process calls of the solvers through libjohnson.so ("make libjohnson.so") and its C interface
+# (libjohnson.h).  The CSR arrays are handed to the library as NumPy int32 arrays and the distance
+# matrix is written straight into a NumPy array, so inputs that are already contiguous int32
+# (such as the views of a mapped .csr file) are never copied.
+
+import argparse
+import ctypes
+import os.path
+import sys
+import threading
+
+import numpy as np
+
+from graph import readBinaryGraph, BINARY_SUFFIX
+
+# Library next to this script
+libraryName = os.path.join(os.path.dirname(os.path.abspath(__file__)), "libjohnson.so")
+
+# Same marker the solvers use for unreachable nodes
+IntMax = 2**31 - 1
+
+# Return codes of johnson_solve
+JOHNSON_OK = 0
+JOHNSON_NEGATIVE_CYCLE = 1
+JOHNSON_BAD_GRAPH = 2
+JOHNSON_BAD_OPTION = 3
+
+algorithmChoices = ["johnson", "floyd", "auto"]
+engineChoices = ["scan", "heap", "radix", "delta"]
+
+class SolverError(Exception):
+    pass
+
+class NegativeCycleError(SolverError):
+    pass
+
+class Stats(ctypes.Structure):
+    _fields_ = [("bellman_ford_ms", ctypes.c_double),
+                ("all_pairs_ms", ctypes.c_double),
+                ("algorithm", ctypes.c_int)]
+
+library = None
+# johnson_solve sets process-wide options of the solvers, so calls are made one at a time
+libraryLock = threading.Lock()
+
+def loadLibrary(path = None):
+    global library
+    if library is None:
+        try:
+            lib = ctypes.CDLL(path or libraryName)
+        except OSError as e:
+            raise SolverError("Couldn't load %s (%s).  Run 'make libjohnson.so' first" % (path or libraryName, e))
+        intArray = np.ctypeslib.ndpointer(dtype=np.int32, flags="C_CONTIGUOUS")
+        lib.johnson_solve.argtypes = [ctypes.c_int, ctypes.c_int, intArray, intArray, intArray, intArray,
+                                      ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int, ctypes.POINTER(Stats)]
+        lib.johnson_solve.restype = ctypes.c_int
+        library = lib
+    return library
+
+# Contiguous int32 version of an array, the array itself when it already is one
+def int32Array(a, name):
+    a = np.asarray(a)
+    if a.dtype != np.int32 and a.size > 0 and (a.min() < -2**31 or a.max() > IntMax):
+        raise SolverError("%s doesn't fit in int32" % name)
+    return np.ascontiguousarray(a, dtype=np.int32)
+
+# All-pairs distances of a CSR graph as an nnode x nnode int32 matrix (IntMax where unreachable),
+# with the phase times in ms.  out, if given, must be a C-contiguous nnode x nnode int32 array.
+def solve(node, edge, weight, algorithm = None, engine = None, threads = 0, out = None):
+    node, edge, weight = int32Array(node, "node"), int32Array(edge, "edge"), int32Array(weight, "weight")
+    nnode = len(node) - 1
+    if nnode < 0 or len(edge) != len(weight):
+        raise SolverError("malformed CSR arrays")
+    if out is None:
+        out = np.empty((nnode, nnode), dtype=np.int32)
+    elif out.shape != (nnode, nnode) or out.dtype != np.int32 or not out.flags.c_contiguous or not out.flags.writeable:
+        raise SolverError("output must be a writable contiguous %d x %d int32 array" % (nnode, nnode))
+    lib = loadLibrary()
+    stats = Stats()
+    with libraryLock:
+        rc = lib.johnson_solve(nnode, len(edge), node, edge, weight, out.reshape(-1),
+                               None if algorithm is None else algorithm.encode(),
+                               None if engine is None else engine.encode(),
+                               threads, ctypes.byref(stats))
+    if rc == JOHNSON_NEGATIVE_CYCLE:
+        raise NegativeCycleError("Graph contains negative weight cycle")
+    if rc == JOHNSON_BAD_GRAPH:
+        raise SolverError("malformed CSR arrays")
+    if rc == JOHNSON_BAD_OPTION:
+        raise SolverError("unknown algorithm '%s' or engine '%s'" % (algorithm, engine))
+    return out, {"bellman_ford": stats.bellman_ford_ms, "all_pairs": stats.all_pairs_ms,
+                 "algorithm": algorithmChoices[stats.algorithm]}
+
+# Distances of a graph file; a .csr file is mapped and passed without copies
+def solveFile(gname, algorithm = None, engine = None, threads = 0):
+    if gname.endswith(BINARY_SUFFIX):
+        _, _, node, edge, weight = readBinaryGraph(gname)
+    else:
+        from reference import loadCSR
+        _, node, edge, weight = loadCSR(gname)
+    return solve(node, edge, weight, algorithm, engine, threads)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Solve a graph in-process with libjohnson.so")
+    parser.add_argument("-g", "--graphFileName", type=str, required=True,
+                    help="Graph file (.txt or .csr)")
+    parser.add_argument("-a", "--algorithm", type=str, choices=algorithmChoices,
+                    help="All-pairs algorithm (default auto)")
+    parser.add_argument("-d", "--engine", type=str, choices=engineChoices,
+                    help="Dijkstra priority queue, or delta-stepping (default scan)")
+    parser.add_argument("-t", "--threadCount", type=int, default=0,
+                    help="Number of OMP threads (default is number of processors)")
+    parser.add_argument("-P", "--print", action="store_true",
+                    help="Print the distance matrix")
+    args = parser.parse_args()
+
+    try:
+        distance, stats = solveFile(args.graphFileName, args.algorithm, args.engine, args.threadCount)
+    except SolverError as e:
+        sys.stderr.write("%s\n" % e)
+        sys.exit(1)
+    if args.print:
+        from reference import printMatrix
+        printMatrix(distance)
+    sys.stderr.write("%.2f ms bellman_ford\n%.2f ms %s\n" % (stats["bellman_ford"], stats["all_pairs"],
+                     "dijkstra" if stats["algorithm"] == "johnson" else "floyd_warshall"))
@@ -0,0 +1,230 @@
+#include "johnson.hpp"
+#include <string.h>
+#include <algorithm>
+#include <set>
+#include <vector>
+
+// Find the edge src->dst, -1 if absent
+static int FindEdge(Graph *graph, int src, int dst) {
+    for (int eid = graph->node[src]; eid < graph->node[src+1]; eid++)
+        if (graph->edge[eid] == dst)
+            return eid;
+    return -1;
+}
+
+// Copy a mapped binary graph into private arrays so its edges can be changed
+static void DetachGraph(Graph *graph) {
+    if (graph->mapping == NULL)
+        return;
+    int *node = (int *)malloc((graph->nnode + 1) * sizeof(int));
+    int *edge = (int *)malloc(graph->nedge * sizeof(int));
+    int *weight = (int *)malloc(graph->nedge * sizeof(int));
+    memcpy(node, graph->node, (graph->nnode + 1) * sizeof(int));
+    memcpy(edge, graph->edge, graph->nedge * sizeof(int));
+    memcpy(weight, graph->weight, graph->nedge * sizeof(int));
+    munmap(graph->mapping, graph->mapping_size);
+    graph->node = node;
+    graph->edge = edge;
+    graph->weight = weight;
+    graph->mapping = NULL;
+    graph->mapping_size = 0;
+}
+
+// Update file lines: "+ SRC DST WEIGHT" inserts an edge, "- SRC DST" deletes one,
+// "= SRC DST WEIGHT" changes a weight.  Blank lines and lines starting with '#' are skipped.
+EdgeUpdate *LoadUpdates(FILE *update_file, int *count) {
+    char linebuf[MaxLineLength];
+    int size = 0, capacity = 64;
+    EdgeUpdate *updates = (EdgeUpdate *)malloc(capacity * sizeof(EdgeUpdate));
+    int lineno = 0;
+
+    while (fgets(linebuf, MaxLineLength, update_file) != NULL) {
+        lineno++;
+        char op;
+        EdgeUpdate u;
+        u.weight = 0;
+        int n = sscanf(linebuf, " %c %d %d %d", &op, &u.src, &u.dst, &u.weight);
+        if (n < 1 || op == '#')
+            continue;
+        if (op == '+' && n == 4)
+            u.kind = UPDATE_INSERT;
+        else if (op == '-' && n >= 3)
+            u.kind = UPDATE_DELETE;
+        else if (op == '=' && n == 4)
+            u.kind = UPDATE_WEIGHT;
+        else {
+            printf("ERROR. Malformed update (line %d)\n", lineno);
+            free(updates);
+            return NULL;
+        }
+        if (size == capacity) {
+            capacity *= 2;
+            updates = (EdgeUpdate *)realloc(updates, capacity * sizeof(EdgeUpdate));
+        }
+        updates[size++] = u;
+    }
+
+    *count = size;
+    return updates;
+}
+
+// Rebuild the CSR arrays without the deleted edges and with the inserted ones
+static void RebuildEdges(Graph *graph, const char *deleted, std::vector<EdgeUpdate> &inserts) {
+    std::sort(inserts.begin(), inserts.end(),
+              [](const EdgeUpdate &a, const EdgeUpdate &b) { return a.src < b.src || (a.src == b.src && a.dst < b.dst); });
+    int ndeleted = 0;
+    for (int eid = 0; eid < graph->nedge; eid++)
+        ndeleted += deleted[eid];
+    int nedge = graph->nedge - ndeleted + inserts.size();
+    int *node = (int *)malloc((graph->nnode + 1) * sizeof(int));
+    int *edge = (int *)malloc(nedge * sizeof(int));
+    int *weight = (int *)malloc(nedge * sizeof(int));
+
+    size_t next_insert = 0;
+    int eid_out = 0;
+    for (int u = 0; u < graph->nnode; u++) {
+        node[u] = eid_out;
+        for (int eid = graph->node[u]; eid < graph->node[u+1]; eid++) {
+            if (deleted[eid]) continue;
+            edge[eid_out] = graph->edge[eid];
+            weight[eid_out++] = graph->weight[eid];
+        }
+        for (; next_insert < inserts.size() && inserts[next_insert].src == u; next_insert++) {
+            edge[eid_out] = inserts[next_insert].dst;
+            weight[eid_out++] = inserts[next_insert].weight;
+        }
+    }
+    node[graph->nnode] = eid_out;
+
+    free(graph->node);
+    free(graph->edge);
+    free(graph->weight);
+    graph->node = node;
+    graph->edge = edge;
+    graph->weight = weight;
+    graph->nedge = nedge;
+    graph->new_weight = (int *)realloc(graph->new_weight, nedge * sizeof(int));
+}
+
+// Apply a batch of edge updates to a graph whose distance matrix is up to date.
+// A row needs recomputing only if a changed edge is tight in it (so it may lie on the
+// source's shortest-path tree) or if a cheaper edge shortens a path from the source.
+// Returns the number of rows recomputed, or -1 if an update doesn't match the graph.
+int UpdateGraph(Graph *graph, const EdgeUpdate *updates, int count) {
+    int nnode = graph->nnode;
+    std::vector<EdgeUpdate> cheaper;    // weight is the new weight
+    std::vector<EdgeUpdate> dearer;     // weight is the old weight
+    std::vector<EdgeUpdate> inserts;
+    std::vector<std::pair<int, int> > reweights;  // edge id and new weight
+    std::set<std::pair<int, int> > seen;
+    char *deleted = (char *)calloc(graph->nedge, sizeof(char));
+    bool resize = false;
+
+    DetachGraph(graph);
+    for (int i = 0; i < count; i++) {
+        EdgeUpdate u = updates[i];
+        if (u.src < 0 || u.src >= nnode || u.dst < 0 || u.dst >= nnode) {
+            printf("ERROR. Update %d: node out of range\n", i + 1);
+            free(deleted);
+            return -1;
+        }
+        if (!seen.insert(std::make_pair(u.src, u.dst)).second) {
+            printf("ERROR. Update %d: edge %d %d changed twice in one batch\n", i + 1, u.src, u.dst);
+            free(deleted);
+            return -1;
+        }
+        int eid = FindEdge(graph, u.src, u.dst);
+        if ((u.kind == UPDATE_INSERT) != (eid < 0)) {
+            printf("ERROR. Update %d: edge %d %d %s\n", i + 1, u.src, u.dst, eid < 0 ? "doesn't exist" : "already exists");
+            free(deleted);
+            return -1;
+        }
+        EdgeUpdate old = u;
+        if (eid >= 0)
+            old.weight = graph->weight[eid];
+        switch (u.kind) {
+            case UPDATE_INSERT:
+                inserts.push_back(u);
+                cheaper.push_back(u);
+                resize = true;
+                break;
+            case UPDATE_DELETE:
+                deleted[eid] = 1;
+                resize = true;
+                dearer.push_back(old);
+                break;
+            default:
+                if (u.weight < old.weight)
+                    cheaper.push_back(u);
+                else if (u.weight > old.weight)
+                    dearer.push_back(old);
+                reweights.push_back(std::make_pair(eid, u.weight));
+        }
+    }
+    // The batch is valid, so the graph can be changed now
+    for (size_t i = 0; i < reweights.size(); i++)
+        graph->weight[reweights[i].first] = reweights[i].second;
+
+    // Decide from the old rows which sources are affected
+    char *affected = (char *)calloc(nnode, sizeof(char));
+    #if OMP
+    #pragma omp parallel for schedule(dynamic, 64)
+    #endif
+    for (int s = 0; s < nnode; s++) {
+        int *row = graph->distance[s];
+        for (size_t i = 0; i < cheaper.size() && !affected[s]; i++) {
+            int du = row[cheaper[i].src];
+            if (du != IntMax && (long long)du + cheaper[i].weight < row[cheaper[i].dst])
+                affected[s] = 1;
+        }
+        for (size_t i = 0; i < dearer.size() && !affected[s]; i++) {
+            int du = row[dearer[i].src];
+            if (du != IntMax && (long long)du + dearer[i].weight == row[dearer[i].dst])
+                affected[s] = 1;
+        }
+    }
+
+    if (resize)
+        RebuildEdges(graph, deleted, inserts);
+    free(deleted);
+
+    // Only edges that got cheaper can violate the old potentials
+    std::vector<int> start;
+    char *queued = (char *)calloc(nnode, sizeof(char));
+    for (size_t i = 0; i < cheaper.size(); i++)
+        if (!queued[cheaper[i].src]) {
+            queued[cheaper[i].src] = 1;
+            start.push_back(cheaper[i].src);
+        }
+    free(queued);
+
+    int nrows = 0;
+    if (!RepairPotential(graph, start.data(), start.size()) || !Reweight(graph)) {
+        // A negative cycle may have appeared: recompute everything, which detects it
+        if (display)
+            printf("Potentials didn't settle, recomputing all rows\n");
+        if (!BellmanFord(graph)) {
+            printf("Graph contains negative weight cycle\n");
+            free(affected);
+            return -1;
+        }
+        AllPairsDijkstra(graph, NULL);
+        nrows = nnode;
+    } else {
+        std::vector<int> sources;
+        for (int s = 0; s < nnode; s++)
+            if (affected[s])
+                sources.push_back(s);
+        #if OMP
+        #pragma omp parallel for schedule(dynamic, 1)
+        #endif
+        for (size_t i = 0; i < sources.size(); i++)
+            Dijkstra(graph, sources[i], graph->distance[sources[i]]);
+        nrows = sources.size();
+    }
+    free(affected);
+
+    if (display)
+        printf("Update of %d edges recomputed %d of %d rows\n", count, nrows, nnode);
+    return nrows;
+}
@@ -0,0 +1,177 @@
+#!/usr/bin/python
+# Check a -B distance matrix against its graph without a reference solver.  Row s is correct iff
+#   d[s][s] == 0 and every edge (u, v, w) with finite d[s][u] has d[s][v] <= d[s][u] + w,
+#   so nothing reachable from s is left unreachable and no distance is too high,
+#   every finite d[s][v], v != s, has a tight incoming edge (d[s][u] + w == d[s][v]),
+#   and a BFS from s over the tight edges reaches every finite entry, so no unreachable node has
+#   a distance and no cycle of tight zero-weight edges holds distances below the true ones.
+# Blocks of rows are checked at once over the CSR edge arrays.  All rows, or a random sample big
+# enough to catch a given fraction of bad rows at a given confidence, are split over a process pool.
+
+import argparse
+import concurrent.futures
+import math
+import os
+import random
+import sys
+
+import numpy as np
+
+from graph import readDistance
+from reference import loadCSR, IntMax
+
+# Bytes of the int64 row x edge temporaries of one block
+blockBytes = 1 << 26
+
+# Bad rows reported in detail
+mismatchLimit = 5
+
+# Default sample: catch 1% bad rows with 99% confidence
+defaultConfidence = 0.99
+defaultFraction = 0.01
+
+# Per-process graph and matrix, set by loadWorker
+nnode = 0
+node = edge = weight = src = distance = None
+
+def loadWorker(gname, dname):
+    global nnode, node, edge, weight, src, distance
+    nnode, node, edge, weight = loadCSR(gname)
+    src = np.repeat(np.arange(nnode, dtype=np.int64), np.diff(node))
+    distance = readDistance(dname)
+    if distance.shape[0] != nnode:
+        raise ValueError("%s has %d rows, graph has %d nodes" % (dname, distance.shape[0], nnode))
+
+# Vertices of a CSR graph reached from any of the seeds
+def reached(seeds, offset, target):
+    size = len(offset) - 1
+    seen = np.zeros(size, dtype=bool)
+    seen[seeds] = True
+    # Position of a vertex in the latest neighbour list, to drop repeats without sorting
+    slot = np.zeros(size, dtype=np.int64)
+    frontier = np.asarray(seeds, dtype=np.int64)
+    while len(frontier) > 0:
+        start, count = offset[frontier], offset[frontier + 1] - offset[frontier]
+        total = count.sum()
+        if total == 0:
+            break
+        # Edge indices of all frontier vertices: each range start, stepped by one within a range
+        first = np.repeat(start - np.cumsum(count) + count, count)
+        nbr = target[first + np.arange(total)]
+        nbr = nbr[~seen[nbr]]
+        position = np.arange(len(nbr))
+        slot[nbr] = position
+        frontier = nbr[slot[nbr] == position]
+        seen[frontier] = True
+    return seen
+
+# Check a block of rows with the edge conditions, then all rows with one BFS over the tight edges
+def checkBlock(rows):
+    d = np.asarray(distance[rows], dtype=np.int64)
+    finite = d != IntMax
+    du = d[:, src]
+    fu = finite[:, src]
+    fv = finite[:, edge]
+    bound = du + weight
+    dv = d[:, edge]
+    errors = {}
+    r, e = np.nonzero(fu & (~fv | (dv > bound)))
+    for i, eid in zip(r, e):
+        if rows[i] not in errors:
+            s, u, v = rows[i], src[eid], edge[eid]
+            errors[rows[i]] = "d[%d][%d] is %s, but edge %d->%d of weight %d gives %d" % (
+                s, v, "inf" if not fv[i, eid] else dv[i, eid], u, v, weight[eid], bound[i, eid])
+    tight = fu & fv & (dv == bound)
+    del du, fu, fv, bound, dv
+    r, e = np.nonzero(tight)
+    hasTight = np.zeros(d.shape, dtype=bool)
+    hasTight[r, edge[e]] = True
+    hasTight[np.arange(len(rows)), rows] = True
+    for i, v in zip(*np.nonzero(finite & ~hasTight)):
+        if rows[i] not in errors:
+            errors[rows[i]] = "d[%d][%d] is %d, but no incoming edge is tight" % (rows[i], v, d[i, v])
+    zero = d[np.arange(len(rows)), rows]
+    for i in np.nonzero(zero != 0)[0]:
+        if rows[i] not in errors:
+            errors[rows[i]] = "d[%d][%d] is %d, not 0" % (rows[i], rows[i], zero[i])
+    # Tight edges as a graph on (row, node) pairs, numbered i * nnode + v: the nonzero entries
+    # come row by row with ascending edges, so their sources are sorted and their counts give CSR offsets
+    offset = np.zeros(len(rows) * nnode + 1, dtype=np.int64)
+    np.cumsum(np.bincount(r * nnode + src[e], minlength = len(rows) * nnode), out = offset[1:])
+    seeds = np.arange(len(rows)) * nnode + rows
+    unreached = finite & ~reached(seeds, offset, r * nnode + edge[e]).reshape(d.shape)
+    for i in np.nonzero(unreached.any(axis = 1))[0]:
+        if rows[i] not in errors:
+            v = int(np.argmax(unreached[i]))
+            errors[rows[i]] = "d[%d][%d] is %d, but no shortest-path edges lead there" % (rows[i], v, d[i, v])
+    return errors
+
+def checkRows(rows):
+    block = max(1, blockBytes // (8 * max(1, len(edge), nnode)))
+    errors = {}
+    for start in range(0, len(rows), block):
+        errors.update(checkBlock(rows[start:start+block]))
+    return len(rows), errors
+
+# Rows to check so that a matrix with at least this fraction of bad rows passes with
+# probability at most 1 - confidence
+def sampleSize(count, confidence, fraction):
+    if fraction >= 1.0:
+        return min(count, 1)
+    return min(count, int(math.ceil(math.log(1.0 - confidence) / math.log(1.0 - fraction))))
+
+# Check all rows of a -B file (confidence None) or a random sample, reporting problems on stderr
+def verifyFile(gname, dname, confidence = None, fraction = defaultFraction, workers = None, seed = 1):
+    try:
+        loadWorker(gname, dname)
+    except (OSError, ValueError) as e:
+        sys.stderr.write("Couldn't verify '%s'. %s\n" % (dname, e))
+        return False
+    rows = np.arange(nnode)
+    if confidence is not None:
+        rows = np.sort(np.array(random.Random(seed).sample(range(nnode), sampleSize(nnode, confidence, fraction)), dtype=np.int64))
+    workers = workers or os.cpu_count()
+    chunks = [c for c in np.array_split(rows, 4 * workers) if len(c) > 0]
+    errors = {}
+    checked = 0
+    if workers == 1 or len(chunks) <= 1:
+        for c in chunks:
+            n, e = checkRows(c)
+            checked += n
+            errors.update(e)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers = workers, initializer = loadWorker,
+                                                    initargs = (gname, dname)) as pool:
+            for n, e in pool.map(checkRows, chunks):
+                checked += n
+                errors.update(e)
+    for s in sorted(errors)[:mismatchLimit]:
+        sys.stderr.write("Row %d: %s\n" % (s, errors[s]))
+    if len(errors) > 0:
+        sys.stderr.write("%d of %d checked rows wrong.  File %s\n" % (len(errors), checked, dname))
+    else:
+        sys.stderr.write("%d of %d rows certified%s.  File %s\n" % (checked, nnode,
+                         "" if confidence is None else " (%.0f%% confidence of catching %g%% bad rows)" % (100 * confidence, 100 * fraction), dname))
+    return len(errors) == 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Certify a distance matrix with the shortest-path optimality conditions")
+    parser.add_argument("-g", "--graphFileName", type=str, required=True,
+                    help="Graph file (.txt or .csr)")
+    parser.add_argument("-d", "--distanceFileName", type=str, required=True,
+                    help="Binary distance matrix (-B output)")
+    parser.add_argument("-c", "--confidence", type=float,
+                    help="Check a random sample of rows with this confidence (default: all rows)")
+    parser.add_argument("-f", "--fraction", type=float, default=defaultFraction,
+                    help="Fraction of bad rows the sample must catch (default %g)" % defaultFraction)
+    parser.add_argument("-j", "--jobs", type=int,
+                    help="Worker processes (default: number of processors)")
+    parser.add_argument("-s", "--seed", type=int, default=1,
+                    help="Seed of the row sample")
+    args = parser.parse_args()
+    if args.confidence is not None and not 0 < args.confidence < 1:
+        parser.error("confidence must be in (0, 1)")
+    if not 0 < args.fraction <= 1:
+        parser.error("fraction must be in (0, 1]")
+    ok = verifyFile(args.graphFileName, args.distanceFileName, args.confidence, args.fraction, args.jobs, args.seed)
+    sys.exit(0 if ok else 1)